@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import inspect
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from ncaa_predict.data.access import DataAccess, mens_access, womens_access
+from ncaa_predict.data.processed import infer_slot_dates, possible_games_df, to_team_format
+from ncaa_predict.data.store import lineup_feature_store, player_feature_store, team_feature_store, \
+    team_player_feature_store
+from ncaa_predict.data.synthetic import SyntheticScale, write_synthetic_zip
+from ncaa_predict.features import lf, pf, tf, tpf
+from ncaa_predict.features.elo import EloEngine
+from ncaa_predict.features.team_features import all_season_compact_results_df
+from ncaa_predict.models.design import matchup_design, training_data_df
+from ncaa_predict.models.prediction import EloTournamentPredictor, LRTournamentPredictor, MLPTournamentPredictor
+from ncaa_predict.utils import cache, _size_of
+
+default_output_file = 'benchmark.json'
+
+
+class Benchmark():
+    """
+    Records the wall time and peak traced memory of named stages. A stage runs once under tracemalloc, which
+    also computes whatever it memoizes, then is timed over repeat reruns of the undecorated function without
+    tracing. Memory allocated in worker processes is not seen.
+    """
+
+    def __init__(self, repeat: int = 3):
+        self.repeat = max(1, repeat)
+        self.results = []  # type: List[Dict[str, Any]]
+
+    def measure(self, name: str, prefix: str, f: Callable, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            result = f(*args, **kwargs)
+            peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+        finally:
+            tracemalloc.stop()
+
+        rerun, seconds = _undecorated(f), []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            rerun(*args, **kwargs)
+            seconds.append(time.perf_counter() - start)
+
+        self.results.append({'Prefix': prefix, 'Stage': name, 'Seconds': float(np.median(seconds)),
+                             'MinSeconds': min(seconds), 'PeakBytes': int(peak_bytes),
+                             'ResultBytes': _size_of(result) if result is not None else 0})
+        return result
+
+
+def _undecorated(f: Callable) -> Callable:
+    # Unwrapping a bound method follows its function's __wrapped__ and so loses the instance it was bound to.
+    if inspect.ismethod(f):
+        return types.MethodType(inspect.unwrap(f.__func__), f.__self__)
+    return inspect.unwrap(f)
+
+
+def run_benchmarks(scale: SyntheticScale = SyntheticScale(), work_dir: Optional[str] = None,
+                   repeat: int = 3) -> Dict[str, Any]:
+    """
+    Writes men's and women's synthetic zips of scale to work_dir (a temporary directory by default) and
+    benchmarks the pipeline on each, in the order it runs: the reads, every node of the tf, pf, lf and tpf
+    registries after its inputs, team formatting and Elo on their own, the training data, each predictor's
+    training and estimates, and the slot dates. Returns the environment, scale and results as plain data.
+    """
+    benchmark = Benchmark(repeat=repeat)
+    with _working_directory(work_dir):
+        accesses = [DataAccess(zip_file=mens_access.zip_file, prefix=mens_access.prefix),
+                    DataAccess(zip_file=womens_access.zip_file, prefix=womens_access.prefix)]
+        start = time.perf_counter()
+        for access, first_team_id in zip(accesses, (1101, 3101)):
+            write_synthetic_zip(zip_file=access.zip_file, prefix=access.prefix,
+                                scale=scale._replace(seed=scale.seed + first_team_id), first_team_id=first_team_id)
+        generate_seconds = time.perf_counter() - start
+
+        # Predictions start no earlier than the events, as team player features only exist from then on.
+        first_season = max(scale.first_event_season, scale.last_season - 4)
+        for access in accesses:
+            _benchmark_access(benchmark=benchmark, access=access, first_season=first_season)
+
+    return {'Environment': _environment(), 'Scale': scale._asdict(), 'GenerateSeconds': generate_seconds,
+            'Results': benchmark.results}
+
+
+def _benchmark_access(benchmark: Benchmark, access: DataAccess, first_season: int):
+    # Results memoized by prefix alone, such as persisted features, may belong to another zip.
+    access.clear_cache()
+    cache.invalidate(access.prefix)
+    prefix = access.prefix
+
+    def read():
+        access.clear_cache()
+        for table in (access.regular_season_compact_results_df, access.tourney_compact_results_df,
+                      access.tourney_seeds_df, access.tourney_slots_df, access.team_conferences_df,
+                      access.teams_df):
+            table()
+
+    benchmark.measure('read', prefix, read)
+    for registry_name, registry in (('tf', tf), ('pf', pf), ('lf', lf)):
+        for node in registry.nodes():
+            benchmark.measure(f'{registry_name}.{node.__name__}', prefix, node, access)
+
+    compact_results_df = all_season_compact_results_df(access)
+    benchmark.measure('to_team_format', prefix, to_team_format, game_formatted_df=compact_results_df)
+    benchmark.measure('elo', prefix, EloEngine().run, compact_results_df=compact_results_df.reset_index(),
+                      team_conferences_df=access.team_conferences_df())
+
+    team_feature_store.persist(features=tf, access=access)
+    player_feature_store.persist(features=pf, access=access)
+    lineup_feature_store.persist(features=lf, access=access)
+    for node in tpf.nodes():
+        benchmark.measure(f'tpf.{node.__name__}', prefix, node, access)
+    team_player_feature_store.persist(features=tpf, access=access,
+                                      upstream=(player_feature_store, lineup_feature_store))
+
+    design = matchup_design(prefix=prefix)
+    benchmark.measure('training_data_df', prefix, training_data_df, team_features_df=design.team_features_df)
+    design.training  # Built once here, so predictor training is timed on its own.
+    tourney_games_df = possible_games_df(access=access, first_season=first_season)
+    for predictor in (EloTournamentPredictor(), LRTournamentPredictor(), MLPTournamentPredictor()):
+        pred_name = type(predictor).__name__
+        benchmark.measure(f'train.{pred_name}', prefix, predictor.train_design, design=design)
+        benchmark.measure(f'predict.{pred_name}', prefix, predictor.estimate_probability,
+                          tourney_games_df=tourney_games_df)
+
+    benchmark.measure('infer_slot_dates', prefix, infer_slot_dates, access=access)
+
+
+def results_df(report: Dict[str, Any]) -> pd.DataFrame:
+    return pd.DataFrame.from_records(report['Results'], index=['Prefix', 'Stage'])
+
+
+def compare_df(baseline: Dict[str, Any], current: Dict[str, Any]) -> pd.DataFrame:
+    """
+    The stages of two benchmark runs side by side, with the ratios of current to baseline time and memory.
+    """
+    baseline_df, current_df = results_df(report=baseline), results_df(report=current)
+    compared_df = baseline_df[['Seconds', 'PeakBytes']].add_prefix('Baseline') \
+        .join(current_df[['Seconds', 'PeakBytes']], how='outer')
+    compared_df['SecondsRatio'] = compared_df.Seconds / compared_df.BaselineSeconds
+    compared_df['PeakBytesRatio'] = compared_df.PeakBytes / compared_df.BaselinePeakBytes
+    return compared_df
+
+
+def _environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'Commit': commit, 'Python': platform.python_version(), 'Platform': platform.platform(),
+            'CPUs': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'sklearn': sklearn.__version__, 'Created': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+@contextlib.contextmanager
+def _working_directory(work_dir: Optional[str]) -> Iterator[str]:
+    # DataAccess, its read cache and the feature stores all resolve their paths against the working directory.
+    with contextlib.ExitStack() as stack:
+        directory = os.path.abspath(work_dir) if work_dir is not None \
+            else stack.enter_context(tempfile.TemporaryDirectory(prefix='ncaa_predict_benchmark_'))
+        os.makedirs(directory, exist_ok=True)
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on synthetic Kaggle shaped data.')
+    for field, default in SyntheticScale._field_defaults.items():
+        parser.add_argument(f'--{field.replace("_", "-")}', type=int, default=default)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed reruns of each stage.')
+    parser.add_argument('--work-dir', default=None, help='Where the zips and stores are written; temporary if unset.')
+    parser.add_argument('--output', default=default_output_file, help='The JSON file results are written to.')
+    parser.add_argument('--baseline', default=None, help='A previous output to compare against.')
+    args = parser.parse_args()
+
+    scale = SyntheticScale(**{field: getattr(args, field) for field in SyntheticScale._fields})
+    report = run_benchmarks(scale=scale, work_dir=args.work_dir, repeat=args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', None):
+        if args.baseline is None:
+            print(results_df(report=report))
+        else:
+            with open(args.baseline) as f:
+                print(compare_df(baseline=json.load(f), current=report))
+
+
+if __name__ == '__main__':
+    main()
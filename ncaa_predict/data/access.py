@@ -1,26 +1,117 @@
+import glob
+import os
+import re
+import tempfile
+import zipfile
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
 import pandas as pd
-import os, zipfile
-from ..utils import memoize
+
+from ..tracing import tracer
+from ..utils import cache, memoize
+
+try:
+    from pyarrow import feather
+except ImportError:  # pragma: no cover
+    feather = None
+
+default_cache_dir = os.path.join('.', 'cache')
+
+events_dtypes = {'EventID': 'int32', 'Season': 'int16', 'DayNum': 'int16', 'WTeamID': 'int16', 'LTeamID': 'int16',
+                 'WFinalScore': 'int16', 'LFinalScore': 'int16', 'WCurrentScore': 'int16', 'LCurrentScore': 'int16',
+                 'ElapsedSeconds': 'int16', 'EventTeamID': 'int16', 'EventPlayerID': 'int32',
+                 'EventType': 'category', 'EventSubType': 'category', 'X': 'int16', 'Y': 'int16', 'Area': 'category'}
+events_game_columns = ['Season', 'DayNum', 'WTeamID', 'LTeamID']
+events_chunk_size = 1_000_000
 
 
 class DataAccess():
 
-    def __init__(self, zip_file: str, prefix: str):
+    def __init__(self, zip_file: str, prefix: str, cache_dir: Optional[str] = default_cache_dir,
+                 event_seasons: Optional[Sequence[int]] = None):
         self.zip_file = zip_file
         self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.event_seasons = event_seasons
+
+    def clear_cache(self):
+        # Drops every memoized result computed from this DataAccess, including those of the processed and
+        # feature functions that take it as an argument.
+        cache.invalidate(self)
 
     def _zip(self):
         return zipfile.ZipFile(os.path.join('.', self.zip_file))
 
-    def _read(self, name: str) -> pd.DataFrame:
-        zf = self._zip()
-        _df = pd.read_csv(zf.open(name))
-        return _df
+    def _read(self, name: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        with tracer.span(f'read {os.path.basename(name)}', 'read', zip_file=self.zip_file):
+            return self._read_member(name=name, columns=columns)
+
+    def _read_member(self, name: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        with self._zip() as zf:
+            if self.cache_dir is None or feather is None:
+                tracer.annotate(source='csv')
+                _df = pd.read_csv(zf.open(name), usecols=columns)
+                return _df if columns is None else _df[list(columns)]
+
+            cached_file = self._cached_file(zf=zf, name=name)
 
-    def _read_stage_1_file(self, name: str) -> pd.DataFrame:
-        zf = self._zip()
-        _df = pd.read_csv(zf.open(os.path.join(self.prefix + 'DataFiles_Stage1', name)))
-        return _df
+            tracer.annotate(source='feather' if os.path.exists(cached_file) else 'csv')
+            if not os.path.exists(cached_file):
+                _df = pd.read_csv(zf.open(name))
+                member_cache_dir = os.path.dirname(cached_file)
+                stem = os.path.splitext(os.path.basename(name))[0]
+                os.makedirs(member_cache_dir, exist_ok=True)
+                # Copies of older drops are swept, never the current one, which a concurrent reader may be using.
+                for stale_file in glob.glob(os.path.join(member_cache_dir, f'{glob.escape(stem)}_*.feather')):
+                    if os.path.abspath(stale_file) != os.path.abspath(cached_file):
+                        try:
+                            os.remove(stale_file)
+                        except FileNotFoundError:
+                            pass
+                # Each writer has its own partial file, so concurrent writers only ever replace a complete copy.
+                fd, partial_file = tempfile.mkstemp(dir=member_cache_dir, prefix=f'{stem}.', suffix='.partial')
+                os.close(fd)
+                try:
+                    feather.write_feather(_df, partial_file, compression='uncompressed')
+                    os.replace(partial_file, cached_file)
+                finally:
+                    if os.path.exists(partial_file):
+                        os.remove(partial_file)
+                return _df if columns is None else _df[list(columns)]
+
+        table = feather.read_table(cached_file, columns=None if columns is None else list(columns), memory_map=True)
+        return table.to_pandas()
+
+    def _cached_file(self, zf: zipfile.ZipFile, name: str) -> str:
+        # Each member is converted to Feather once; the member's CRC and size key the cached copy,
+        # so a new Kaggle drop is picked up without any manual invalidation.
+        info = zf.getinfo(name)
+        stem = os.path.splitext(os.path.basename(name))[0]
+        member_cache_dir = os.path.join(self.cache_dir, os.path.splitext(os.path.basename(self.zip_file))[0])
+        return os.path.join(member_cache_dir, f'{stem}_{info.CRC:08x}_{info.file_size}.feather')
+
+    def _read_chunks(self, name: str, columns: Sequence[str], dtypes: Dict[str, str],
+                     chunk_size: int) -> Iterator[pd.DataFrame]:
+        return tracer.iterate(self._read_member_chunks(name=name, columns=columns, dtypes=dtypes,
+                                                       chunk_size=chunk_size),
+                              name=f'read {os.path.basename(name)}', category='read', zip_file=self.zip_file)
+
+    def _read_member_chunks(self, name: str, columns: Sequence[str], dtypes: Dict[str, str],
+                            chunk_size: int) -> Iterator[pd.DataFrame]:
+        # Bounded memory reads: record batches sliced from a memory-mapped cached copy, otherwise CSV chunks.
+        with self._zip() as zf:
+            cached_file = None if self.cache_dir is None or feather is None else self._cached_file(zf=zf, name=name)
+            if cached_file is None or not os.path.exists(cached_file):
+                yield from pd.read_csv(zf.open(name), usecols=columns, dtype=dtypes, chunksize=chunk_size)
+                return
+
+        table = feather.read_table(cached_file, columns=list(columns), memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            yield batch.to_pandas().astype(dtypes)
+
+    def _read_stage_1_file(self, name: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return self._read(name=os.path.join(self.prefix + 'DataFiles_Stage1', name), columns=columns)
 
     @memoize
     def cities_df(self) -> pd.DataFrame:
@@ -88,9 +179,77 @@ class DataAccess():
         return self._read_stage_1_file(name=self.prefix + 'Teams.csv')
 
     @memoize
-    def events_df(self, season: int) -> pd.DataFrame:
+    def events_df(self, season: int, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
         # EventID, Season, DayNum, WTeamID, LTeamID, WFinalScore, LFinalScore, WCurrentScore, LCurrentScore, ElapsedSeconds, EventTeamID, EventPlayerID, EventType, EventSubType, X, Y, Area
-        return self._read(name=f'{self.prefix}Events{season}.csv')
+        return self._read(name=f'{self.prefix}Events{season}.csv', columns=columns)
+
+    @memoize
+    def events_seasons(self) -> Tuple[int, ...]:
+        # The configured event_seasons, otherwise every season with an Events file in the zip.
+        if self.event_seasons is not None:
+            return tuple(sorted(self.event_seasons))
+        events_file = re.compile(re.escape(self.prefix) + r'Events(\d{4})\.csv')
+        with self._zip() as zf:
+            return tuple(sorted(int(m.group(1)) for m in map(events_file.fullmatch, zf.namelist()) if m))
+
+    def events_chunks(self, season: int, columns: Optional[Sequence[str]] = None, player_only: bool = False,
+                      event_types: Optional[Sequence[str]] = None,
+                      chunk_size: int = events_chunk_size) -> Iterator[pd.DataFrame]:
+        """
+        Streams a season's events in chunks of at most chunk_size rows with compact dtypes, reading only the
+        requested columns and keeping only player events and/or the given EventTypes.
+        """
+        columns = list(events_dtypes.keys()) if columns is None else list(columns)
+        predicate_columns = (['EventPlayerID'] if player_only else []) + (['EventType'] if event_types else [])
+        read_columns = columns + [c for c in predicate_columns if c not in columns]
+
+        for chunk in self._read_chunks(name=f'{self.prefix}Events{season}.csv', columns=read_columns,
+                                       dtypes={c: events_dtypes[c] for c in read_columns}, chunk_size=chunk_size):
+            if player_only:
+                chunk = chunk[chunk.EventPlayerID.ne(0)]
+            if event_types:
+                chunk = chunk[chunk.EventType.isin(event_types)]
+            yield chunk[columns]
+
+    def events_game_chunks(self, season: int, columns: Optional[Sequence[str]] = None, player_only: bool = False,
+                           event_types: Optional[Sequence[str]] = None,
+                           chunk_size: int = events_chunk_size) -> Iterator[pd.DataFrame]:
+        """
+        Streams a season's events in chunks of whole games, each with the game columns. A game's events are
+        contiguous in the Events files, so only the game spanning a chunk boundary is carried into the next chunk.
+        """
+        columns = list(events_dtypes.keys()) if columns is None else list(columns)
+        read_columns = columns + [c for c in events_game_columns if c not in columns]
+
+        carried = None
+        for chunk in self.events_chunks(season=season, columns=read_columns, player_only=player_only,
+                                        event_types=event_types, chunk_size=chunk_size):
+            if carried is not None:
+                chunk = concat_events([carried, chunk])
+            if chunk.empty:
+                continue
+            keys = chunk[events_game_columns].to_numpy()
+            last_start = np.flatnonzero(np.append(True, (keys[1:] != keys[:-1]).any(axis=1)))[-1]
+            if last_start > 0:
+                yield chunk.iloc[:last_start]
+            carried = chunk.iloc[last_start:]
+
+        if carried is not None and not carried.empty:
+            yield carried
+
+    def events_by_game(self, season: int, columns: Optional[Sequence[str]] = None, player_only: bool = False,
+                       event_types: Optional[Sequence[str]] = None,
+                       chunk_size: int = events_chunk_size) -> Iterator[Tuple[Tuple[int, int, int, int], pd.DataFrame]]:
+        """
+        Streams a season's events one game at a time, keyed by (Season, DayNum, WTeamID, LTeamID).
+        """
+        columns = list(events_dtypes.keys()) if columns is None else list(columns)
+        for chunk in self.events_game_chunks(season=season, columns=columns, player_only=player_only,
+                                             event_types=event_types, chunk_size=chunk_size):
+            keys = chunk[events_game_columns].to_numpy()
+            starts = np.flatnonzero(np.append(True, (keys[1:] != keys[:-1]).any(axis=1)))
+            for start, end in zip(starts, np.append(starts[1:], len(chunk))):
+                yield tuple(keys[start].tolist()), chunk.iloc[start:end][columns]
 
     @memoize
     def players_df(self) -> pd.DataFrame:
@@ -103,22 +262,14 @@ class DataAccess():
         return self._read(name=f'{self.prefix}SampleSubmissionStage1_2020.csv')
 
 
+def concat_events(events_dfs: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    # Chunks carry their own categories, which pd.concat would widen to object.
+    events_df = pd.concat(events_dfs, ignore_index=True)
+    return events_df.astype({c: 'category' for c in events_df.columns if events_dtypes.get(c) == 'category'})
+
+
 mens_access = DataAccess(zip_file='google-cloud-ncaa-march-madness-2020-division-1-mens-tournament.zip',
                          prefix='M')
 womens_access = DataAccess(zip_file='google-cloud-ncaa-march-madness-2020-division-1-womens-tournament.zip',
                            prefix='W')
 
-
-@memoize
-def team_features_df(prefix: str) -> pd.DataFrame:
-    return pd.read_pickle(f'{prefix}TeamFeatures.pkl')
-
-
-@memoize
-def player_features_df(prefix: str) -> pd.DataFrame:
-    return pd.read_pickle(f'{prefix}PlayerFeatures.pkl')
-
-
-@memoize
-def team_player_features(prefix: str) -> pd.DataFrame:
-    return pd.read_pickle(f'{prefix}TeamPlayerFeatures.pkl')
@@ -0,0 +1,170 @@
+import re
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .access import DataAccess
+from ..utils import memoize
+
+_round_slot = re.compile(r'R(\d)')
+
+
+class Bracket():
+    """
+    A season's tourney slots compiled into an integer tree. Nodes 0 .. n_seeds - 1 are the seeds entering the
+    bracket, in seed order, followed by one node per slot. Slots are ordered by depth, the number of games
+    played on the longest path into them, so every slot comes after the two slots or seeds feeding it.
+
+    Each seed's path to the championship is kept as an array of slot positions aligned from the championship
+    down. Two paths agree from the championship down to the slot where the teams would meet, and diverge below
+    it, so the meeting slot of every pair of seeds is precomputed into a seeds by seeds table.
+    """
+
+    def __init__(self, season: int, seeds: np.ndarray, team_ids: np.ndarray, slots: np.ndarray,
+                 strong: np.ndarray, weak: np.ndarray, depths: np.ndarray):
+        self.season = season
+        self.seeds = seeds
+        self.team_ids = team_ids
+        self.slots = slots
+        self.strong = strong
+        self.weak = weak
+        self.depths = depths
+        self.rounds = np.array([slot_round(slot) for slot in slots], dtype=np.int8)
+
+        parents = np.full(len(seeds) + len(slots), -1, dtype=np.intp)
+        parents[strong] = parents[weak] = np.arange(len(slots))
+        self.paths = _root_aligned_paths(parents=parents, n_seeds=len(seeds))
+
+        # Paths agree on a prefix, ending at the meeting slot; a seed does not meet itself.
+        agree = (self.paths[:, np.newaxis, :] == self.paths[np.newaxis, :, :]) & (self.paths >= 0)
+        meetings = np.take_along_axis(self.paths, agree.sum(axis=2) - 1, axis=1)
+        np.fill_diagonal(meetings, -1)
+        self.meetings = meetings.astype(np.int16)
+        self._seed_order = np.argsort(team_ids, kind='stable')
+
+    @property
+    def n_seeds(self) -> int:
+        return len(self.seeds)
+
+    def levels(self) -> List[np.ndarray]:
+        """
+        Slot positions grouped by depth. The slots of a level only depend on earlier levels, so each level can
+        be played as one vectorized step.
+        """
+        return [np.flatnonzero(self.depths == depth) for depth in np.unique(self.depths)]
+
+    def teams_df(self) -> pd.DataFrame:
+        return pd.DataFrame({'Season': self.season, 'Seed': self.seeds, 'TeamID': self.team_ids})
+
+    def seed_positions(self, team_ids: np.ndarray) -> np.ndarray:
+        """
+        The seed node of each team, -1 for teams not in the bracket.
+        """
+        team_ids = np.asarray(team_ids)
+        sorted_team_ids = self.team_ids[self._seed_order]
+        position = np.minimum(np.searchsorted(sorted_team_ids, team_ids), len(sorted_team_ids) - 1)
+        return np.where(sorted_team_ids[position] == team_ids, self._seed_order[position], -1)
+
+    def meeting_slots(self, team_ids: np.ndarray, other_team_ids: np.ndarray) -> np.ndarray:
+        """
+        The slot position where each pair of teams would meet, -1 if either is not in the bracket.
+        """
+        seed, other_seed = self.seed_positions(team_ids), self.seed_positions(other_team_ids)
+        in_bracket = (seed >= 0) & (other_seed >= 0)
+        return np.where(in_bracket, self.meetings[seed, other_seed], -1)
+
+    def slot_paths(self) -> List[List[str]]:
+        """
+        Each seed's slots, from its first game to the championship.
+        """
+        return [self.slots[path[path >= 0][::-1]].tolist() for path in self.paths]
+
+
+def slot_round(slot: str) -> int:
+    """
+    The round of a slot from its name, R1W1 to R6CH; the play in slots, such as W16, are round 0.
+    """
+    match = _round_slot.match(slot)
+    return int(match.group(1)) if match else 0
+
+
+def _root_aligned_paths(parents: np.ndarray, n_seeds: int) -> np.ndarray:
+    # Slot positions of each seed's path, bottom up, then reversed into columns from the championship down.
+    bottom_up = [parents[:n_seeds]]
+    while (bottom_up[-1] >= 0).any():
+        above = bottom_up[-1]
+        bottom_up.append(np.where(above >= 0, parents[n_seeds + np.maximum(above, 0)], -1))
+    bottom_up = np.array(bottom_up[:-1]).T
+    lengths = (bottom_up >= 0).sum(axis=1)
+
+    paths = np.full(bottom_up.shape, -1, dtype=np.intp)
+    rows, steps = np.nonzero(bottom_up >= 0)
+    paths[rows, lengths[rows] - 1 - steps] = bottom_up[rows, steps]
+    return paths
+
+
+def compile_bracket(season_slots_df: pd.DataFrame, season_seeds_df: pd.DataFrame) -> Bracket:
+    season = int(season_slots_df.Season.iloc[0])
+    children = {slot: (strong, weak) for slot, strong, weak
+                in zip(season_slots_df.Slot, season_slots_df.StrongSeed, season_slots_df.WeakSeed)}
+
+    depths = {}  # type: Dict[str, int]
+
+    def _depth(slot_or_seed: str) -> int:
+        if slot_or_seed not in children:
+            return 0
+        if slot_or_seed not in depths:
+            depths[slot_or_seed] = 1 + max(_depth(child) for child in children[slot_or_seed])
+        return depths[slot_or_seed]
+
+    slots = sorted(children, key=lambda slot: (_depth(slot), slot))
+    seeds = sorted({child for pair in children.values() for child in pair} - set(children))
+
+    team_ids_by_seed = dict(zip(season_seeds_df.Seed, season_seeds_df.TeamID))
+    missing = [seed for seed in seeds if seed not in team_ids_by_seed]
+    if missing:
+        raise ValueError(f'Seeds {missing} of the {season} slots have no team.')
+
+    nodes = {**{seed: node for node, seed in enumerate(seeds)},
+             **{slot: len(seeds) + node for node, slot in enumerate(slots)}}
+    return Bracket(season=season,
+                   seeds=np.array(seeds),
+                   team_ids=np.array([team_ids_by_seed[seed] for seed in seeds]),
+                   slots=np.array(slots),
+                   strong=np.array([nodes[children[slot][0]] for slot in slots], dtype=np.intp),
+                   weak=np.array([nodes[children[slot][1]] for slot in slots], dtype=np.intp),
+                   depths=np.array([depths[slot] for slot in slots], dtype=np.int8))
+
+
+@memoize
+def brackets(access: DataAccess) -> Dict[int, Bracket]:
+    seeds_df = access.tourney_seeds_df()
+    return {season: compile_bracket(season_slots_df=season_slots_df,
+                                    season_seeds_df=seeds_df[seeds_df.Season == season])
+            for season, season_slots_df in access.tourney_slots_df().groupby('Season')}
+
+
+def bracket(access: DataAccess, season: int) -> Bracket:
+    return brackets(access=access)[season]
+
+
+def meeting_slots_df(games_df: pd.DataFrame, access: DataAccess, team_id: str = 'TeamID',
+                     other_team_id: str = 'OtherTeamID') -> pd.DataFrame:
+    """
+    The Slot and Round in which the two teams of each game of games_df would meet in their season's bracket,
+    aligned to games_df. Games between teams outside the bracket get no Slot and Round -1.
+    """
+    seasons = games_df.Season.to_numpy()
+    slot = np.full(len(games_df), None, dtype=object)
+    round_ = np.full(len(games_df), -1, dtype=np.int8)
+    for season, season_bracket in brackets(access=access).items():
+        in_season = seasons == season
+        if not in_season.any():
+            continue
+        position = season_bracket.meeting_slots(team_ids=games_df[team_id].to_numpy()[in_season],
+                                                other_team_ids=games_df[other_team_id].to_numpy()[in_season])
+        found = position >= 0
+        slot[np.flatnonzero(in_season)[found]] = season_bracket.slots[position[found]]
+        round_[np.flatnonzero(in_season)[found]] = season_bracket.rounds[position[found]]
+    return pd.DataFrame({'Slot': slot, 'Round': round_}, index=games_df.index)
@@ -0,0 +1,126 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+# TeamIDs are four digits, so a (Season, TeamID) packs into Season * team_id_limit + TeamID and a matchup into
+# (Season * team_id_limit + TeamID) * team_id_limit + OtherTeamID. Both sort by season, then by team.
+team_id_limit = 10 ** 4
+
+# A Kaggle ID such as 2015_1101_1102: Season_TeamID_OtherTeamID with the lower TeamID first.
+kaggle_id_length = 14
+_kaggle_id_separators = (4, 9)
+_kaggle_id_fields = (slice(0, 4), slice(5, 9), slice(10, 14))
+
+
+def encode_matchups(season: np.ndarray, team_id: np.ndarray, other_team_id: np.ndarray) -> np.ndarray:
+    """
+    Packs (Season, TeamID, OtherTeamID) into int64 keys, keeping the order of the teams.
+    """
+    return (np.asarray(season, dtype=np.int64) * team_id_limit + np.asarray(team_id, dtype=np.int64)) \
+        * team_id_limit + np.asarray(other_team_id, dtype=np.int64)
+
+
+def decode_matchups(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The Season, TeamID and OtherTeamID arrays of keys.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    season_team, other_team_id = np.divmod(keys, team_id_limit)
+    season, team_id = np.divmod(season_team, team_id_limit)
+    return season, team_id, other_team_id
+
+
+def matchup_keys(season: np.ndarray, team_id: np.ndarray, other_team_id: np.ndarray) -> np.ndarray:
+    """
+    Keys that are the same whichever team comes first: the Season, then the lower TeamID, then the higher, as in
+    a Kaggle ID.
+    """
+    team_id, other_team_id = np.asarray(team_id, dtype=np.int64), np.asarray(other_team_id, dtype=np.int64)
+    return encode_matchups(season=season, team_id=np.minimum(team_id, other_team_id),
+                           other_team_id=np.maximum(team_id, other_team_id))
+
+
+def index_matchup_keys(index: pd.MultiIndex) -> np.ndarray:
+    """
+    The encode_matchups keys of an index with Season, TeamID and OtherTeamID levels, in its order.
+    """
+    return encode_matchups(season=index.get_level_values('Season').to_numpy(),
+                           team_id=index.get_level_values('TeamID').to_numpy(),
+                           other_team_id=index.get_level_values('OtherTeamID').to_numpy())
+
+
+def season_team_keys(season: np.ndarray, team_id: np.ndarray) -> np.ndarray:
+    return np.asarray(season, dtype=np.int64) * team_id_limit + np.asarray(team_id, dtype=np.int64)
+
+
+def decode_season_team_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return np.divmod(np.asarray(keys, dtype=np.int64), team_id_limit)
+
+
+def key_positions(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """
+    The position of each of keys in sorted_keys, or -1 where it is absent.
+    """
+    if len(sorted_keys) == 0:
+        return np.full(len(keys), -1, dtype=np.intp)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[positions] == keys, positions, -1)
+
+
+def season_team_positions(index: pd.MultiIndex, season: np.ndarray, team_id: np.ndarray) -> np.ndarray:
+    """
+    The position in index, which has Season and TeamID levels in any order, of each (season, team_id), or -1
+    where it is absent.
+    """
+    index_keys = season_team_keys(season=index.get_level_values('Season').to_numpy(),
+                                  team_id=index.get_level_values('TeamID').to_numpy())
+    order = np.argsort(index_keys, kind='stable')
+    positions = key_positions(sorted_keys=index_keys[order], keys=season_team_keys(season=season, team_id=team_id))
+    # Position -1 reads the -1 on the end.
+    return np.append(order, -1)[positions]
+
+
+def format_kaggle_ids(keys: np.ndarray) -> np.ndarray:
+    """
+    The Season_TeamID_OtherTeamID strings of keys. Four digit seasons and TeamIDs are laid out as ASCII digits
+    in one array; anything else is formatted one key at a time.
+    """
+    season, team_id, other_team_id = decode_matchups(keys)
+    fields = (season, team_id, other_team_id)
+    if not all(((field >= 1000) & (field <= 9999)).all() for field in fields):
+        return np.array([f'{s}_{t}_{o}' for s, t, o in zip(season.tolist(), team_id.tolist(),
+                                                           other_team_id.tolist())], dtype=object)
+
+    characters = np.empty((len(season), kaggle_id_length), dtype=np.uint8)
+    characters[:, list(_kaggle_id_separators)] = ord('_')
+    for field, columns in zip(fields, _kaggle_id_fields):
+        characters[:, columns] = field[:, np.newaxis] // 10 ** np.arange(3, -1, -1) % 10 + ord('0')
+    return characters.view(f'S{kaggle_id_length}')[:, 0].astype(str)
+
+
+def parse_kaggle_ids(ids: Iterable[str]) -> np.ndarray:
+    """
+    The encode_matchups keys of Season_TeamID_OtherTeamID strings, keeping their order of the teams. IDs of the
+    Kaggle width are parsed from their character codes in one array; anything else is split one ID at a time.
+    """
+    ids = np.asarray(ids if isinstance(ids, (np.ndarray, pd.Index, pd.Series)) else list(ids), dtype=str)
+    if ids.dtype.itemsize == 4 * kaggle_id_length:
+        codes = ids.view(np.uint32).reshape(len(ids), kaggle_id_length).astype(np.int64)
+        digits = codes - ord('0')
+        digit_columns = np.ones(kaggle_id_length, dtype=bool)
+        digit_columns[list(_kaggle_id_separators)] = False
+        if (codes[:, ~digit_columns] == ord('_')).all() \
+                and ((digits[:, digit_columns] >= 0) & (digits[:, digit_columns] <= 9)).all():
+            season, team_id, other_team_id = (digits[:, columns] @ 10 ** np.arange(3, -1, -1)
+                                              for columns in _kaggle_id_fields)
+            return encode_matchups(season=season, team_id=team_id, other_team_id=other_team_id)
+
+    try:
+        games = np.array([[int(field) for field in i.split('_')] for i in ids.tolist()], dtype=np.int64)
+        if games.size and games.shape[1] != 3:
+            raise ValueError
+    except ValueError:
+        raise ValueError('IDs are not all of the form Season_TeamID_OtherTeamID.') from None
+    games = games.reshape(-1, 3)
+    return encode_matchups(season=games[:, 0], team_id=games[:, 1], other_team_id=games[:, 2])
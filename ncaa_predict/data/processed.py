@@ -1,34 +1,175 @@
 from collections import defaultdict
-from typing import Iterable, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from pandas.api.extensions import ExtensionArray
 
 from .access import DataAccess
+from .bracket import brackets, meeting_slots_df
+from ..tracing import traced
 from ..utils import memoize
 
 team_format_indices = ['TeamID', 'Season', 'DayNum', 'OtherTeamID']
 game_format_indices = ['Season', 'DayNum', 'WTeamID', 'LTeamID']
 player_game_format_indices = game_format_indices + ['EventPlayerID']
 
+loc_dtype = pd.CategoricalDtype(categories=['H', 'A', 'N'])
+
+# The canonical dtypes of the processed layer, for whichever of these columns or index levels a table has.
+# Team names are not carried; see with_team_names.
+compact_schema = {'Season': 'int16', 'DayNum': 'int16',
+                  'TeamID': 'int16', 'OtherTeamID': 'int16', 'WTeamID': 'int16', 'LTeamID': 'int16',
+                  'Score': 'int16', 'OtherScore': 'int16', 'WScore': 'int16', 'LScore': 'int16',
+                  'WFinalScore': 'int16', 'LFinalScore': 'int16', 'EventTeamID': 'int16', 'EventPlayerID': 'int32',
+                  'NumOT': 'int8', 'Loc': loc_dtype, 'WLoc': loc_dtype, 'Tourney': 'bool'}
+
+
+def to_compact_schema(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype({c: dtype for c, dtype in compact_schema.items() if c in df.columns})
 
-def to_team_format(game_formatted_df: pd.DataFrame) -> pd.DataFrame:
-    winning_game_formatted_df = game_formatted_df.reset_index()
-    winning_game_formatted_df.rename(columns=_winning_column_renamer, inplace=True)
 
-    losing_game_formatted_df = game_formatted_df.reset_index()
-    losing_game_formatted_df.rename(columns=_losing_column_ranamer, inplace=True)
+def validate_compact_schema(df: Union[pd.DataFrame, pd.Series], name: str = '') -> Union[pd.DataFrame, pd.Series]:
+    """
+    Raises a ValueError naming every column or index level of df with a compact_schema name but another dtype.
+    Integer index levels only need to be integers, as pandas before 2.0 holds every integer Index as int64;
+    a MultiIndex stores its rows as compact codes either way.
+    """
+    levels = df.index.levels if isinstance(df.index, pd.MultiIndex) else [df.index]
+    columns = df.dtypes.to_dict() if isinstance(df, pd.DataFrame) else {df.name: df.dtype}
 
-    if 'OtherLoc' in losing_game_formatted_df.columns:
-        losing_game_formatted_df['Loc'] = losing_game_formatted_df.OtherLoc \
-            .transform(lambda x: 'H' if x == 'A' else 'A' if x == 'H' else x)
-        losing_game_formatted_df.drop(columns='OtherLoc', inplace=True)
+    violations = [f'index level {level.name} is {level.dtype}, expected {compact_schema[level.name]}'
+                  for level in levels if level.name in compact_schema
+                  and not _integer_level_matches(level=level, expected=compact_schema[level.name])
+                  and level.dtype != compact_schema[level.name]]
+    violations += [f'{c} is {dtype}, expected {compact_schema[c]}' for c, dtype in columns.items()
+                   if c in compact_schema and dtype != compact_schema[c]]
+    if violations:
+        raise ValueError(f'{name} does not respect the compact schema: ' + '; '.join(violations))
+    return df
 
-    team_formatted_df = winning_game_formatted_df.append(losing_game_formatted_df)
 
-    team_formatted_df.set_index(team_format_indices, inplace=True)
-    team_formatted_df.sort_index(inplace=True)
+def _integer_level_matches(level: pd.Index, expected) -> bool:
+    return pd.api.types.is_integer_dtype(expected) and pd.api.types.is_integer_dtype(level.dtype)
 
-    return team_formatted_df
+
+def empty_df(indices: Sequence[str], dtypes: Dict[str, str]) -> pd.DataFrame:
+    """
+    A frame of no rows with the given integer index levels and columns of the given dtypes, for the result of
+    no input, such as an access without Events files.
+    """
+    index = pd.MultiIndex.from_arrays([np.array([], dtype=np.int64)] * len(indices), names=list(indices))
+    return pd.DataFrame({c: pd.Series([], dtype=dtype) for c, dtype in dtypes.items()}, index=index)
+
+
+@memoize
+def team_names(access: DataAccess) -> pd.Series:
+    teams_df = access.teams_df()
+    return pd.Series(teams_df.TeamName.to_numpy(), index=teams_df.TeamID.astype(compact_schema['TeamID']).to_numpy(),
+                     name='TeamName')
+
+
+def with_team_names(df: pd.DataFrame, access: DataAccess) -> pd.DataFrame:
+    """
+    Joins team names onto a game or team formatted table for each team ID column or index level it has.
+    """
+    names = team_names(access=access)
+    named_df = df.copy()
+    for team_id, team_name in (('TeamID', 'TeamName'), ('OtherTeamID', 'OtherTeamName'),
+                               ('WTeamID', 'WTeamName'), ('LTeamID', 'LTeamName')):
+        if team_id in df.columns or team_id in df.index.names:
+            ids = df[team_id] if team_id in df.columns else df.index.get_level_values(team_id)
+            named_df[team_name] = names.reindex(ids.to_numpy()).fillna('').to_numpy()
+    return named_df
+
+
+@traced('processed')
+def to_team_format(game_formatted_df: pd.DataFrame) -> pd.DataFrame:
+    return TeamFormatView(game_formatted_df=game_formatted_df).to_frame()
+
+
+class TeamFormatView():
+    """
+    A team formatted view over a game formatted table. Each game appears once from the winner's side and once
+    from the loser's, indexed by team_format_indices. Columns are stacked only when asked for, so features that
+    need a single column, or a single side, never materialize the doubled table.
+    """
+
+    def __init__(self, game_formatted_df: pd.DataFrame):
+        self.game_formatted_df = game_formatted_df
+
+        sources = [*(name for name in game_formatted_df.index.names if name is not None), *game_formatted_df.columns]
+        losing_sources = {_losing_column_ranamer(source): source for source in sources}
+
+        # Team formatted column -> (winning side source, losing side source, losing side Loc is swapped)
+        self._sources = {}  # type: Dict[str, Tuple[str, Optional[str], bool]]
+        for source in sources:
+            name = _winning_column_renamer(source)
+            if name == 'Loc' and 'OtherLoc' in losing_sources:
+                self._sources[name] = (source, losing_sources['OtherLoc'], True)
+            else:
+                self._sources[name] = (source, losing_sources.get(name), False)
+
+    @property
+    def columns(self) -> List[str]:
+        return [name for name in self._sources.keys() if name not in team_format_indices]
+
+    @property
+    def _order(self) -> np.ndarray:
+        if not hasattr(self, '_team_order'):
+            self._team_order = np.lexsort([self._stacked(name) for name in reversed(team_format_indices)])
+        return self._team_order
+
+    @property
+    def index(self) -> pd.MultiIndex:
+        return pd.MultiIndex.from_arrays([self._stacked(name)[self._order] for name in team_format_indices],
+                                         names=team_format_indices)
+
+    def __getitem__(self, name: str) -> pd.Series:
+        return pd.Series(self._stacked(name)[self._order], index=self.index, name=name)
+
+    def side(self, winning: bool) -> pd.DataFrame:
+        """
+        The games from the winners' or the losers' side only, in game order.
+        """
+        side_df = pd.DataFrame({name: self._side_values(name=name, winning=winning) for name in self._sources})
+        return side_df.set_index(team_format_indices)
+
+    def to_frame(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({name: self._stacked(name)[self._order] for name in columns},
+                            index=self.index, columns=columns)
+
+    def _source_values(self, source: str) -> Union[np.ndarray, ExtensionArray]:
+        values = self.game_formatted_df[source] if source in self.game_formatted_df.columns \
+            else self.game_formatted_df.index.get_level_values(source)
+        return values.to_numpy() if isinstance(values.dtype, np.dtype) else values.array
+
+    def _side_values(self, name: str, winning: bool) -> Union[np.ndarray, ExtensionArray]:
+        winning_source, losing_source, swap_loc = self._sources[name]
+        if winning:
+            return self._source_values(winning_source)
+        if losing_source is None:
+            return np.full(len(self.game_formatted_df), np.nan)
+        values = self._source_values(losing_source)
+        return _swap_home_and_away(values) if swap_loc else values
+
+    def _stacked(self, name: str) -> Union[np.ndarray, ExtensionArray]:
+        winning_values = self._side_values(name=name, winning=True)
+        losing_values = self._side_values(name=name, winning=False)
+        if isinstance(winning_values, np.ndarray) and isinstance(losing_values, np.ndarray):
+            return np.concatenate([winning_values, losing_values])
+        return pd.concat([pd.Series(winning_values), pd.Series(losing_values)], ignore_index=True).array
+
+
+def _swap_home_and_away(loc: Union[np.ndarray, ExtensionArray]) -> Union[np.ndarray, ExtensionArray]:
+    if isinstance(loc, pd.Categorical):
+        # Categories are renamed in place of relabelling every row, keeping the categorical dtype.
+        return loc.rename_categories([{'H': 'A', 'A': 'H'}.get(c, c) for c in loc.categories]) \
+            .reorder_categories(loc.categories)
+    codes, uniques = pd.factorize(loc)
+    swapped = np.array([{'H': 'A', 'A': 'H'}.get(u, u) for u in uniques] + [np.nan], dtype=object)
+    return swapped[codes]
 
 
 def _winning_column_renamer(column: str) -> str:
@@ -49,43 +190,41 @@ def _losing_column_ranamer(column: str) -> str:
         return column
 
 
-def possible_games(access: DataAccess) -> Iterable[Tuple[int, int, int]]:
-    # Season, Seed, TeamID
-    seeds_df = access.tourney_seeds_df()
-    for season, season_seeds_df in seeds_df.groupby('Season'):
-        teams = season_seeds_df.TeamID.unique().tolist()
-        for ta in teams:
-            for tb in teams:
-                if ta < tb:
-                    yield season, ta, tb
-
-
-def slot_paths_df(access: DataAccess):
-    slots = access.tourney_slots_df()
+def matchups_df(teams_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Every pairing of two teams of the same season, once each with TeamID < OtherTeamID, sorted.
+    teams_df has Season and TeamID columns, such as the tourney seeds.
+    """
+    teams_df = teams_df[['Season', 'TeamID']].drop_duplicates().sort_values(['Season', 'TeamID'])
+    seasons, teams = teams_df.Season.to_numpy(), teams_df.TeamID.to_numpy()
 
-    def _paths(season_slots_df: pd.DataFrame):
-        seed_segments = {**{row.StrongSeed: row.Slot for idx, row in season_slots_df.iterrows()},
-                         **{row.WeakSeed: row.Slot for idx, row in season_slots_df.iterrows()}}
+    starts = np.flatnonzero(np.r_[True, seasons[1:] != seasons[:-1]])
+    sizes = np.diff(np.r_[starts, len(seasons)])
+    # The upper triangle of each season's teams, offset to that season's rows.
+    pairs = [np.triu_indices(size, k=1) for size in sizes]
+    team = np.concatenate([start + i for start, (i, _) in zip(starts, pairs)]).astype(np.intp)
+    other_team = np.concatenate([start + j for start, (_, j) in zip(starts, pairs)]).astype(np.intp)
 
-        initial_seeds = sorted({*seed_segments.keys()} - {*seed_segments.values()})
+    return pd.DataFrame({'Season': seasons[team], 'TeamID': teams[team], 'OtherTeamID': teams[other_team]})
 
-        def _find_slots(slot_or_seed: str) -> Iterable[str]:
-            if slot_or_seed in seed_segments:
-                slot = seed_segments[slot_or_seed]
-                yield slot
-                yield from _find_slots(slot_or_seed=slot)
 
-        paths = {seed: list(_find_slots(slot_or_seed=seed)) for seed in sorted(initial_seeds)}
+def possible_games_df(access: DataAccess, first_season: Optional[int] = None) -> pd.DataFrame:
+    seeds_df = access.tourney_seeds_df()
+    if first_season is not None:
+        seeds_df = seeds_df[seeds_df.Season >= first_season]
+    return matchups_df(teams_df=seeds_df)
 
-        season_paths_df = pd.DataFrame.from_records(({'Seed': seed, 'path': path}
-                                                     for seed, path in paths.items()),
-                                                    index='Seed')
 
-        return season_paths_df
+def possible_games(access: DataAccess) -> Iterable[Tuple[int, int, int]]:
+    # Season, TeamID, OtherTeamID
+    yield from possible_games_df(access=access).itertuples(index=False, name=None)
 
-    paths_df = slots.groupby('Season').apply(_paths).reset_index()
 
-    return paths_df
+def slot_paths_df(access: DataAccess) -> pd.DataFrame:
+    return pd.DataFrame.from_records(({'Season': season, 'Seed': seed, 'path': path}
+                                      for season, season_bracket in brackets(access=access).items()
+                                      for seed, path in zip(season_bracket.seeds, season_bracket.slot_paths())),
+                                     columns=['Season', 'Seed', 'path'])
 
 
 @memoize
@@ -99,41 +238,7 @@ def paths_to_championship_df(access: DataAccess) -> pd.DataFrame:
 @memoize
 def infer_slot_dates(access: DataAccess):
     tourney_compact_results_df = access.tourney_compact_results_df()[['Season', 'DayNum', 'WTeamID', 'LTeamID']].copy()
-    paths_2_championship_df = paths_to_championship_df(access=access).path.to_dict()
-
-    def _slot(row: pd.Series):
-        w_path = paths_2_championship_df[(row.Season, row.WTeamID)]
-        l_path = paths_2_championship_df[(row.Season, row.LTeamID)]
-        for slot in w_path:
-            if slot in l_path:
-                return slot
-        return None
-
-    tourney_compact_results_df['Slot'] = tourney_compact_results_df.apply(_slot, axis=1)
+    tourney_compact_results_df['Slot'] = meeting_slots_df(games_df=tourney_compact_results_df, access=access,
+                                                          team_id='WTeamID', other_team_id='LTeamID').Slot
     slot_dates_df = tourney_compact_results_df.drop(columns=['WTeamID', 'LTeamID'])
     return slot_dates_df
-
-
-@memoize
-def ground_truth_since_2015(access: DataAccess) -> pd.DataFrame:
-    compact_results_df = access.tourney_compact_results_df()
-
-    compact_results_df = compact_results_df[compact_results_df.Season >= 2015]
-
-    smaller_team_id_wins = compact_results_df[compact_results_df.WTeamID < compact_results_df.LTeamID]
-    larger_team_id_wins = compact_results_df[compact_results_df.WTeamID > compact_results_df.LTeamID]
-
-    _s_ground_truth_df = smaller_team_id_wins.Season.astype(str).str \
-        .cat([smaller_team_id_wins.WTeamID.astype(str), smaller_team_id_wins.LTeamID.astype(str)], sep='_') \
-        .rename('ID').to_frame()
-    _g_ground_truth_df = larger_team_id_wins.Season.astype(str).str \
-        .cat([larger_team_id_wins.LTeamID.astype(str), larger_team_id_wins.WTeamID.astype(str)], sep='_') \
-        .rename('ID').to_frame()
-
-    _s_ground_truth_df['Win'] = 1
-    _g_ground_truth_df['Win'] = 0
-
-    _ground_truth_df = _s_ground_truth_df.append(_g_ground_truth_df).set_index('ID')
-    _ground_truth_df.sort_index(inplace=True)
-
-    return _ground_truth_df
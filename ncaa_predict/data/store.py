@@ -0,0 +1,193 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import types
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from .access import DataAccess
+from ..utils import memoize
+
+default_store_dir = os.path.join('.', 'feature_store')
+
+
+class FeatureStore():
+    """
+    Keeps each feature of a Features registry as its own Feather artifact, keyed by a hash of the source data and
+    of the feature's code, so a persist run only recomputes the features whose code or inputs changed.
+    A per prefix manifest maps feature names to their current artifacts.
+    """
+
+    def __init__(self, name: str, store_dir: str = default_store_dir):
+        self.name = name
+        self.store_dir = store_dir
+
+    def _manifest_file(self, prefix: str) -> str:
+        return os.path.join(self.store_dir, f'{prefix}{self.name}.json')
+
+    def manifest(self, prefix: str) -> Dict[str, Dict]:
+        manifest_file = self._manifest_file(prefix=prefix)
+        if not os.path.exists(manifest_file):
+            return {}
+        with open(manifest_file) as f:
+            return json.load(f)
+
+    def keys(self, features, access: DataAccess, upstream: Sequence['FeatureStore'] = ()) -> Dict[str, str]:
+        data = data_fingerprint(access=access)
+        upstream_keys = [(store.name, sorted((feature_name, entry['key'])
+                                             for feature_name, entry in store.manifest(prefix=access.prefix).items()))
+                         for store in upstream]
+        return {feature_name: _hash([data, upstream_keys, code_fingerprint(f)])
+                for feature_name, f in features.features.items()}
+
+    def persist(self, features, access: DataAccess, upstream: Sequence['FeatureStore'] = (),
+                max_workers: Optional[int] = None) -> List[str]:
+        """
+        Recomputes and writes the stale features of the registry, returning their names.
+        Upstream stores are those whose artifacts the features read.
+        """
+        manifest = self.manifest(prefix=access.prefix)
+        keys = self.keys(features=features, access=access, upstream=upstream)
+
+        artifact_dir = os.path.join(self.store_dir, f'{access.prefix}{self.name}')
+        stale = [feature_name for feature_name, key in keys.items()
+                 if manifest.get(feature_name, {}).get('key') != key
+                 or not os.path.exists(os.path.join(artifact_dir, manifest[feature_name]['file']))]
+
+        if stale:
+            os.makedirs(artifact_dir, exist_ok=True)
+            for feature_name, result in features.run(*stale, access=access, max_workers=max_workers).items():
+                result_df = result.to_frame() if isinstance(result, pd.Series) else result
+                artifact_file = f'{feature_name}-{keys[feature_name][:16]}.feather'
+                feather.write_feather(result_df, os.path.join(artifact_dir, artifact_file),
+                                      compression='uncompressed')
+                previous = manifest.get(feature_name)
+                if previous and previous['file'] != artifact_file:
+                    _remove(os.path.join(artifact_dir, previous['file']))
+                manifest[feature_name] = {'key': keys[feature_name], 'file': artifact_file,
+                                          'columns': [str(c) for c in result_df.columns]}
+
+        for feature_name in set(manifest) - set(keys):
+            _remove(os.path.join(artifact_dir, manifest.pop(feature_name)['file']))
+
+        manifest = {feature_name: manifest[feature_name] for feature_name in keys}
+        manifest_file = self._manifest_file(prefix=access.prefix)
+        with open(f'{manifest_file}.partial', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f'{manifest_file}.partial', manifest_file)
+
+        return stale
+
+    def read(self, prefix: str, *feature_names: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Memory maps the artifacts of the given features (all by default), reading only the given columns. When
+        the columns match none of theirs, the frame has the index and no columns. Raises a ValueError naming the
+        prefix when the store has none of the features persisted.
+        """
+        manifest = self.manifest(prefix=prefix)
+        artifact_dir = os.path.join(self.store_dir, f'{prefix}{self.name}')
+        feature_names = feature_names if feature_names else tuple(manifest.keys())
+        unpersisted = [feature_name for feature_name in feature_names if feature_name not in manifest]
+        if not feature_names or unpersisted:
+            raise ValueError(f'{self.name} of prefix "{prefix}" are not persisted'
+                             + (f': {unpersisted}' if unpersisted else '') + '; run the persist script first.')
+
+        feature_dfs = []
+        for feature_name in feature_names:
+            entry = manifest[feature_name]
+            feature_columns = entry['columns'] if columns is None else [c for c in entry['columns'] if c in columns]
+            # The first feature is read for its index even when none of its columns are wanted.
+            if not feature_columns and feature_dfs:
+                continue
+            artifact_file = os.path.join(artifact_dir, entry['file'])
+            with pa.memory_map(artifact_file) as source:
+                index_columns = [c for c in pa.ipc.open_file(source).schema.pandas_metadata['index_columns']
+                                 if isinstance(c, str)]
+            table = feather.read_table(artifact_file, columns=index_columns + feature_columns, memory_map=True)
+            feature_dfs.append(table.to_pandas())
+
+        return pd.concat(feature_dfs, axis=1)
+
+
+def data_fingerprint(access: DataAccess) -> str:
+    with access._zip() as zf:
+        return _hash(sorted((info.filename, info.CRC, info.file_size) for info in zf.infolist()))
+
+
+def code_fingerprint(f) -> str:
+    """
+    A hash over the source of a feature function, the inputs it declares and every function, class and
+    literal constant of this package it references, transitively.
+    """
+    sources = {}
+    _collect_sources(obj=f, sources=sources)
+    return _hash(sorted(sources.items()))
+
+
+def _collect_sources(obj, sources: Dict[str, str]):
+    obj = inspect.unwrap(obj)
+    qualified_name = f'{obj.__module__}.{obj.__qualname__}'
+    if qualified_name in sources:
+        return
+    functions = [member for member in vars(obj).values() if inspect.isfunction(member)] \
+        if inspect.isclass(obj) else [obj]
+    module_globals = vars(sys.modules[obj.__module__])
+    codes = [function.__code__ for function in functions]
+
+    # Default argument values are evaluated once, so they are fingerprinted by value.
+    sources[qualified_name] = inspect.getsource(obj) + repr([(function.__defaults__, function.__kwdefaults__)
+                                                             for function in functions])
+
+    names = {*getattr(obj, 'input_names', ())}
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+
+    for name in sorted(name for name in names if not name.startswith('__')):
+        value = module_globals.get(name)
+        if (inspect.isfunction(value) or inspect.isclass(value)) \
+                and inspect.unwrap(value).__module__.startswith(__package__.split('.')[0]):
+            _collect_sources(obj=value, sources=sources)
+        elif isinstance(value, (str, int, float, list, tuple, dict)):
+            sources[f'{obj.__module__}.{name}'] = repr(value)
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+team_feature_store = FeatureStore(name='TeamFeatures')
+player_feature_store = FeatureStore(name='PlayerFeatures')
+lineup_feature_store = FeatureStore(name='LineupFeatures')
+team_player_feature_store = FeatureStore(name='TeamPlayerFeatures')
+
+
+@memoize
+def team_features_df(prefix: str) -> pd.DataFrame:
+    return team_feature_store.read(prefix)
+
+
+@memoize
+def player_features_df(prefix: str) -> pd.DataFrame:
+    return player_feature_store.read(prefix).fillna(0).astype(int)
+
+
+@memoize
+def lineup_features_df(prefix: str) -> pd.DataFrame:
+    return lineup_feature_store.read(prefix)
+
+
+@memoize
+def team_player_features(prefix: str) -> pd.DataFrame:
+    return team_player_feature_store.read(prefix)
@@ -0,0 +1,300 @@
+import zipfile
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class SyntheticScale(NamedTuple):
+    # Defaults are roughly the size of the 2020 men's Kaggle drop.
+    first_season: int = 1985
+    last_season: int = 2019
+    n_teams: int = 353
+    n_conferences: int = 32
+    games_per_team: int = 30
+    first_detailed_season: int = 2003
+    first_event_season: int = 2015
+    events_per_game: int = 450
+    play_in_games: int = 4
+    seed: int = 0
+
+
+compact_results_columns = ['Season', 'DayNum', 'WTeamID', 'WScore', 'LTeamID', 'LScore', 'WLoc', 'NumOT']
+box_score_columns = ['FGM', 'FGA', 'FGM3', 'FGA3', 'FTM', 'FTA', 'OR', 'DR', 'Ast', 'TO', 'Stl', 'Blk', 'PF']
+events_columns = ['EventID', 'Season', 'DayNum', 'WTeamID', 'LTeamID', 'WFinalScore', 'LFinalScore', 'WCurrentScore',
+                  'LCurrentScore', 'ElapsedSeconds', 'EventTeamID', 'EventPlayerID', 'EventType', 'EventSubType', 'X',
+                  'Y', 'Area']
+
+regions = 'WXYZ'
+regular_season_days = 132
+roster_size = 13
+home_court_points = 3.5
+
+# Strong seed of each first round game against 17 - strong seed, in bracket order.
+_first_round_seeds = (1, 8, 5, 4, 6, 3, 7, 2)
+# DayNum of each round in the first half of the regions, and in the second.
+_round_days = {0: (134, 135), 1: (136, 137), 2: (138, 139), 3: (143, 144), 4: (145, 146), 5: (152, 152),
+               6: (154, 154)}
+
+# EventType, share of events, EventSubTypes, points scored, credited to a player, shot location recorded.
+_event_types = [('made1', .06, ('1of1', '1of2', '2of2'), 1, True, False),
+                 ('miss1', .03, ('1of1', '1of2', '2of2'), 0, True, False),
+                 ('made2', .09, ('jump', 'lay', 'dunk', 'tip'), 2, True, True),
+                 ('miss2', .10, ('jump', 'lay', 'dunk', 'tip'), 0, True, True),
+                 ('made3', .04, ('jump', 'pullu', 'stepb'), 3, True, True),
+                 ('miss3', .08, ('jump', 'pullu', 'stepb'), 0, True, True),
+                 ('reb', .15, ('def', 'off', 'deadb'), 0, True, False),
+                 ('assist', .05, ('unk',), 0, True, False),
+                 ('turnover', .05, ('bpass', 'lostb', 'trav', 'unk'), 0, True, False),
+                 ('steal', .03, ('unk',), 0, True, False),
+                 ('block', .02, ('unk',), 0, True, False),
+                 ('foul', .08, ('pers', 'off', 'tech'), 0, True, False),
+                 ('fouled', .06, ('unk',), 0, True, False),
+                 ('sub', .13, ('in', 'out'), 0, True, False),
+                 ('timeout', .02, ('comm', 'full', 'short'), 0, False, False),
+                 ('jumpb', .01, ('start', 'heldb'), 0, True, False)]
+# Starters are on the floor, and in the events, far more than the end of the bench.
+_player_shares = np.array([12, 12, 11, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2], dtype=float)
+
+
+def synthetic_files(prefix: str, scale: SyntheticScale = SyntheticScale(),
+                    first_team_id: int = 1101) -> Dict[str, pd.DataFrame]:
+    """
+    The members of a Kaggle March Madness zip, by name, for made up seasons of scale. Each team has a latent
+    strength that drifts from season to season; games are decided by strength, home court and noise, and the
+    strongest teams are seeded into a bracket that is played out. Every game from first_event_season on has
+    events_per_game events from the rosters in Players.csv.
+    """
+    if scale.n_teams < 64 + scale.play_in_games:
+        raise ValueError(f'A bracket of {64 + scale.play_in_games} teams needs at least that many teams.')
+    if not 0 <= scale.play_in_games <= 8:
+        raise ValueError('There are at most 8 play in games, at the 11 and 16 lines of each region.')
+
+    rng = np.random.default_rng(scale.seed)
+    seasons = range(scale.first_season, scale.last_season + 1)
+    team_ids = np.arange(first_team_id, first_team_id + scale.n_teams)
+    conferences = np.array([f'conf{c:02d}' for c in range(scale.n_conferences)])
+
+    strength = rng.normal(0, 8, scale.n_teams)
+    conference = rng.integers(0, scale.n_conferences, scale.n_teams)
+    team_conferences_dfs, regular_season_dfs, tourney_dfs, seeds_dfs, slots_dfs = [], [], [], [], []
+    for season in seasons:
+        strength = .8 * strength + rng.normal(0, 4.8, scale.n_teams)
+        switching = rng.random(scale.n_teams) < .02
+        conference[switching] = rng.integers(0, scale.n_conferences, switching.sum())
+        team_conferences_dfs.append(pd.DataFrame({'Season': season, 'TeamID': team_ids,
+                                                  'ConfAbbrev': conferences[conference]}))
+
+        team, other_team, day_num = _regular_season_schedule(rng=rng, n_teams=scale.n_teams,
+                                                             games_per_team=scale.games_per_team)
+        home = rng.choice([1, -1, 0], size=len(team), p=[.45, .45, .1])
+        regular_season_dfs.append(_compact_results_df(rng=rng, season=season, day_num=day_num,
+                                                      team_ids=team_ids, strength=strength, team=team,
+                                                      other_team=other_team, home=home))
+
+        seeds_df, slots_df = _bracket(season=season, play_in_games=scale.play_in_games)
+        # The strongest teams take the seeds in order of their lines.
+        seeds_df['TeamID'] = team_ids[np.argsort(-strength)[:len(seeds_df)]]
+        seeds_dfs.append(seeds_df)
+        slots_dfs.append(slots_df)
+        tourney_dfs.append(_tourney_results_df(rng=rng, season=season, seeds_df=seeds_df, slots_df=slots_df,
+                                               team_ids=team_ids, strength=strength))
+
+    regular_season_df = pd.concat(regular_season_dfs, ignore_index=True)
+    tourney_df = pd.concat(tourney_dfs, ignore_index=True)
+    seeds_df = pd.concat(seeds_dfs, ignore_index=True)
+
+    stage_1 = f'{prefix}DataFiles_Stage1/'
+    files = {
+        f'{stage_1}{prefix}Teams.csv': pd.DataFrame({'TeamID': team_ids,
+                                                     'TeamName': [f'Team {t}' for t in team_ids]}),
+        f'{stage_1}{prefix}Seasons.csv': pd.DataFrame({'Season': list(seasons),
+                                                       'DayZero': [f'11/01/{s - 1}' for s in seasons],
+                                                       **{f'Region{r}': f'Region {r}' for r in regions}}),
+        f'{stage_1}Conferences.csv': pd.DataFrame({'ConfAbbrev': conferences,
+                                                   'Description': [f'Conference {c}' for c in conferences]}),
+        f'{stage_1}{prefix}TeamConferences.csv': pd.concat(team_conferences_dfs, ignore_index=True),
+        f'{stage_1}{prefix}RegularSeasonCompactResults.csv': regular_season_df,
+        f'{stage_1}{prefix}NCAATourneyCompactResults.csv': tourney_df,
+        f'{stage_1}{prefix}RegularSeasonDetailedResults.csv': _detailed_results_df(
+            rng=rng, compact_results_df=regular_season_df[regular_season_df.Season >= scale.first_detailed_season]),
+        f'{stage_1}{prefix}NCAATourneyDetailedResults.csv': _detailed_results_df(
+            rng=rng, compact_results_df=tourney_df[tourney_df.Season >= scale.first_detailed_season]),
+        f'{stage_1}{prefix}NCAATourneySeeds.csv': seeds_df,
+        f'{stage_1}{prefix}NCAATourneySlots.csv': pd.concat(slots_dfs, ignore_index=True),
+        f'{prefix}SampleSubmissionStage1_2020.csv': _sample_submission_df(
+            seeds_df=seeds_df[seeds_df.Season >= max(scale.first_season, scale.last_season - 4)]),
+    }
+
+    players_dfs, first_event_id, first_player_id = [], 1, 600_001
+    for season in range(max(scale.first_event_season, scale.first_season), scale.last_season + 1):
+        rosters = first_player_id + np.arange(scale.n_teams * roster_size).reshape(scale.n_teams, roster_size)
+        players_dfs.append(pd.DataFrame({'PlayerID': rosters.ravel(), 'LastName': [f'Last{p}' for p in rosters.flat],
+                                         'FirstName': [f'First{p}' for p in rosters.flat],
+                                         'TeamID': np.repeat(team_ids, roster_size)}))
+        games_df = pd.concat([regular_season_df[regular_season_df.Season == season],
+                              tourney_df[tourney_df.Season == season]], ignore_index=True)
+        files[f'{prefix}Events{season}.csv'] = _events_df(rng=rng, games_df=games_df, rosters=rosters,
+                                                          first_team_id=first_team_id,
+                                                          events_per_game=scale.events_per_game,
+                                                          first_event_id=first_event_id)
+        first_event_id += len(games_df) * scale.events_per_game
+        first_player_id += rosters.size
+    files[f'{prefix}Players.csv'] = pd.concat(players_dfs, ignore_index=True) if players_dfs \
+        else pd.DataFrame(columns=['PlayerID', 'LastName', 'FirstName', 'TeamID'])
+
+    return files
+
+
+def write_synthetic_zip(zip_file: str, prefix: str, scale: SyntheticScale = SyntheticScale(),
+                        first_team_id: int = 1101):
+    """
+    Writes the synthetic_files of scale as a zip that a DataAccess with this zip_file and prefix reads.
+    """
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, df in synthetic_files(prefix=prefix, scale=scale, first_team_id=first_team_id).items():
+            with zf.open(name, 'w', force_zip64=True) as member:
+                df.to_csv(member, index=False)
+
+
+def _regular_season_schedule(rng: np.random.Generator, n_teams: int,
+                             games_per_team: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Each day a random subset of the teams is paired off, so no team plays twice in a day.
+    teams, other_teams, day_nums = [], [], []
+    playing = rng.binomial(n_teams, min(1., games_per_team / regular_season_days), size=regular_season_days)
+    for day_num, n_playing in enumerate(playing):
+        order = rng.permutation(n_teams)[:n_playing - n_playing % 2]
+        teams.append(order[0::2])
+        other_teams.append(order[1::2])
+        day_nums.append(np.full(len(order) // 2, day_num))
+    return np.concatenate(teams), np.concatenate(other_teams), np.concatenate(day_nums)
+
+
+def _compact_results_df(rng: np.random.Generator, season: int, day_num: np.ndarray, team_ids: np.ndarray,
+                        strength: np.ndarray, team: np.ndarray, other_team: np.ndarray,
+                        home: np.ndarray) -> pd.DataFrame:
+    # home is 1 when team is at home, -1 when other_team is and 0 at a neutral site.
+    margin = strength[team] - strength[other_team] + home_court_points * home + rng.normal(0, 11, len(team))
+    team_won = margin > 0
+    num_ot = (np.abs(margin) < 1.5).astype(int) + (np.abs(margin) < .3)
+    l_score = np.clip(np.round(rng.normal(66, 9, len(team)) + 7 * num_ot), 30, 130).astype(int)
+    w_score = l_score + np.maximum(1, np.round(np.abs(margin))).astype(int)
+    w_home = np.where(team_won, home, -home)
+    return pd.DataFrame({'Season': season, 'DayNum': day_num,
+                         'WTeamID': team_ids[np.where(team_won, team, other_team)], 'WScore': w_score,
+                         'LTeamID': team_ids[np.where(team_won, other_team, team)], 'LScore': l_score,
+                         'WLoc': np.array(['A', 'N', 'H'])[w_home + 1], 'NumOT': num_ot},
+                        columns=compact_results_columns)
+
+
+def _bracket(season: int, play_in_games: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # Play in games alternate between the 16 and 11 lines, and rotate through the regions.
+    play_ins = {(regions[g % 4], (16, 11)[(g + g // 4) % 2]) for g in range(play_in_games)}
+
+    seeds = [f'{region}{line:02d}{suffix}' for line in range(1, 17) for region in regions
+             for suffix in (('a', 'b') if (region, line) in play_ins else ('',))]
+    slots = [(f'{region}{line:02d}', f'{region}{line:02d}a', f'{region}{line:02d}b')
+             for region, line in sorted(play_ins)]
+    for region in regions:
+        slots += [(f'R1{region}{s}', f'{region}{s:02d}', f'{region}{17 - s:02d}') for s in _first_round_seeds]
+        slots += [(f'R2{region}{s}', f'R1{region}{s}', f'R1{region}{9 - s}') for s in range(1, 5)]
+        slots += [(f'R3{region}{s}', f'R2{region}{s}', f'R2{region}{5 - s}') for s in range(1, 3)]
+        slots += [(f'R4{region}1', f'R3{region}1', f'R3{region}2')]
+    slots += [('R5WX', 'R4W1', 'R4X1'), ('R5YZ', 'R4Y1', 'R4Z1'), ('R6CH', 'R5WX', 'R5YZ')]
+
+    seeds_df = pd.DataFrame({'Season': season, 'Seed': seeds})
+    slots_df = pd.DataFrame.from_records(slots, columns=['Slot', 'StrongSeed', 'WeakSeed'])
+    slots_df.insert(0, 'Season', season)
+    return seeds_df, slots_df
+
+
+def _tourney_results_df(rng: np.random.Generator, season: int, seeds_df: pd.DataFrame, slots_df: pd.DataFrame,
+                        team_ids: np.ndarray, strength: np.ndarray) -> pd.DataFrame:
+    positions = {team_id: position for position, team_id in enumerate(team_ids)}
+    occupants = {seed: positions[team_id] for seed, team_id in zip(seeds_df.Seed, seeds_df.TeamID)}
+    results_dfs = []  # type: List[pd.DataFrame]
+    # Play in slots come first and every slot follows the slots it is fed by.
+    for slot, strong_seed, weak_seed in zip(slots_df.Slot, slots_df.StrongSeed, slots_df.WeakSeed):
+        round_number = int(slot[1]) if slot.startswith('R') else 0
+        day_num = _round_days[round_number][slot[2] in 'YZ' if round_number else slot[0] in 'YZ']
+        team, other_team = np.array([occupants[strong_seed]]), np.array([occupants[weak_seed]])
+        results_df = _compact_results_df(rng=rng, season=season, day_num=np.array([day_num]), team_ids=team_ids,
+                                         strength=strength, team=team, other_team=other_team, home=np.zeros(1, int))
+        occupants[slot] = positions[results_df.WTeamID.iloc[0]]
+        results_dfs.append(results_df)
+    return pd.concat(results_dfs, ignore_index=True).sort_values('DayNum', kind='stable', ignore_index=True)
+
+
+def _detailed_results_df(rng: np.random.Generator, compact_results_df: pd.DataFrame) -> pd.DataFrame:
+    detailed_df = compact_results_df.reset_index(drop=True)
+    for side in ('W', 'L'):
+        box_score = _box_scores(rng=rng, score=detailed_df[f'{side}Score'].to_numpy())
+        for column in box_score_columns:
+            detailed_df[f'{side}{column}'] = box_score[column]
+    return detailed_df
+
+
+def _box_scores(rng: np.random.Generator, score: np.ndarray) -> Dict[str, np.ndarray]:
+    # Field goals, threes and free throws that add up to score, with attempts and the other counts around them.
+    n = len(score)
+    fgm3 = np.minimum(rng.integers(2, 12, n), score // 8)
+    ftm = np.minimum(rng.integers(5, 22, n), score // 4)
+    ftm += np.where((score - ftm - 3 * fgm3) % 2 == 1, np.where(ftm > 0, -1, 1), 0)
+    fgm = (score - ftm - 3 * fgm3) // 2 + fgm3
+    fga3 = fgm3 + rng.integers(6, 16, n)
+    return {'FGM': fgm, 'FGA': np.maximum(fgm + rng.integers(25, 40, n), fga3), 'FGM3': fgm3, 'FGA3': fga3,
+            'FTM': ftm, 'FTA': ftm + rng.integers(0, 9, n), 'OR': rng.integers(4, 16, n),
+            'DR': rng.integers(16, 32, n), 'Ast': rng.integers(6, 20, n), 'TO': rng.integers(6, 20, n),
+            'Stl': rng.integers(2, 11, n), 'Blk': rng.integers(0, 7, n), 'PF': rng.integers(12, 24, n)}
+
+
+def _sample_submission_df(seeds_df: pd.DataFrame) -> pd.DataFrame:
+    seeds_df = seeds_df.sort_values(['Season', 'TeamID'])
+    ids = [f'{season}_{team_id}_{other_team_id}'
+           for season, season_seeds_df in seeds_df.groupby('Season')
+           for i, team_id in enumerate(season_seeds_df.TeamID)
+           for other_team_id in season_seeds_df.TeamID.iloc[i + 1:]]
+    return pd.DataFrame({'ID': ids, 'Pred': .5})
+
+
+def _events_df(rng: np.random.Generator, games_df: pd.DataFrame, rosters: np.ndarray, first_team_id: int,
+               events_per_game: int, first_event_id: int) -> pd.DataFrame:
+    """
+    events_per_game events for every game, contiguous and in time order within each game, with running scores.
+    """
+    n_games, n = len(games_df), len(games_df) * events_per_game
+    names, shares, subtypes, points, player_event, located = zip(*_event_types)
+    game = np.repeat(np.arange(n_games), events_per_game)
+
+    event_type = rng.choice(len(names), size=n, p=np.array(shares) / sum(shares))
+    subtype_counts = np.array([len(s) for s in subtypes])
+    subtype_table = np.array([list(s) + [''] * (subtype_counts.max() - len(s)) for s in subtypes], dtype=object)
+    event_subtype = subtype_table[event_type, rng.integers(0, 1 << 30, n) % subtype_counts[event_type]]
+
+    w_side = rng.random(n) < .5
+    w_team_id, l_team_id = games_df.WTeamID.to_numpy()[game], games_df.LTeamID.to_numpy()[game]
+    event_team_id = np.where(w_side, w_team_id, l_team_id)
+    roster_spot = rng.choice(roster_size, size=n, p=_player_shares / _player_shares.sum())
+    player_id = rosters[event_team_id - first_team_id, roster_spot]
+    player_id[~np.array(player_event)[event_type] | (event_subtype == 'deadb')] = 0
+
+    scored = np.array(points)[event_type].reshape(n_games, events_per_game)
+    w_side = w_side.reshape(n_games, events_per_game)
+    duration = 2400 + 300 * games_df.NumOT.to_numpy()
+    elapsed = np.sort(rng.random((n_games, events_per_game)), axis=1) * duration[:, np.newaxis]
+
+    shot = np.array(located)[event_type]
+    return pd.DataFrame({'EventID': np.arange(first_event_id, first_event_id + n),
+                         'Season': games_df.Season.to_numpy()[game], 'DayNum': games_df.DayNum.to_numpy()[game],
+                         'WTeamID': w_team_id, 'LTeamID': l_team_id,
+                         'WFinalScore': games_df.WScore.to_numpy()[game],
+                         'LFinalScore': games_df.LScore.to_numpy()[game],
+                         'WCurrentScore': np.cumsum(np.where(w_side, scored, 0), axis=1).ravel(),
+                         'LCurrentScore': np.cumsum(np.where(w_side, 0, scored), axis=1).ravel(),
+                         'ElapsedSeconds': elapsed.astype(int).ravel(), 'EventTeamID': event_team_id,
+                         'EventPlayerID': player_id, 'EventType': np.array(names, dtype=object)[event_type],
+                         'EventSubType': event_subtype,
+                         'X': np.where(shot, rng.integers(0, 101, n), 0),
+                         'Y': np.where(shot, rng.integers(0, 101, n), 0),
+                         'Area': np.where(shot, rng.integers(1, 12, n), 0)},
+                        columns=events_columns)
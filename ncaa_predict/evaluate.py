@@ -1,12 +1,244 @@
+import time
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
 from ncaa_predict.data.access import DataAccess
-from ncaa_predict.data.processed import ground_truth_since_2015
-from sklearn.metrics import log_loss
+from ncaa_predict.data.bracket import slot_round
+from ncaa_predict.data.matchup_keys import decode_matchups, index_matchup_keys, key_positions, matchup_keys, \
+    parse_kaggle_ids
+from ncaa_predict.data.processed import infer_slot_dates
+from ncaa_predict.features.elo import EloParameters, EloSweep
+from ncaa_predict.features.team_features import all_season_compact_results_df
+from ncaa_predict.models.design import MatchupDesign
+from ncaa_predict.models.prediction import TournamentPredictor
+from ncaa_predict.utils import memoize
 import pandas as pd
 
+default_n_bootstrap = 2000
+default_confidence = .95
+default_n_bins = 10
+# Probabilities are clipped as scikit-learn's log_loss clips them.
+log_loss_eps = 1e-15
+
+
+class Evaluation(NamedTuple):
+    games: int
+    # Tourney games without a prediction, which are left out of every metric.
+    missing_games: int
+    log_loss: float
+    brier_score: float
+    # Bootstrap percentile intervals at the evaluation's confidence; NaN without resamples.
+    log_loss_interval: Tuple[float, float]
+    brier_score_interval: Tuple[float, float]
+    calibration_df: pd.DataFrame
+    rounds_df: pd.DataFrame
+    seasons_df: pd.DataFrame
+
+    def summary(self) -> Dict[str, float]:
+        return {'Games': self.games, 'MissingGames': self.missing_games,
+                'LogLoss': self.log_loss, 'LogLossLower': self.log_loss_interval[0],
+                'LogLossUpper': self.log_loss_interval[1], 'BrierScore': self.brier_score,
+                'BrierScoreLower': self.brier_score_interval[0], 'BrierScoreUpper': self.brier_score_interval[1]}
+
+
+def evaluate_probabilities(predictions: pd.Series, access: DataAccess, first_season: Optional[int] = None,
+                           n_bootstrap: int = default_n_bootstrap, confidence: float = default_confidence,
+                           n_bins: int = default_n_bins, seed: int = 0,
+                           comparison_file: Optional[str] = None) -> Evaluation:
+    """
+    Scores P(TeamID beats OtherTeamID), indexed by Season, TeamID and OtherTeamID as estimate_probability returns
+    it or by their encode_matchups keys, against the tourney games from first_season on. Games are matched on
+    packed integer keys, in either team order. Log loss and Brier score come with bootstrap intervals over
+    n_bootstrap resamples of the games, and are broken down by round and by season alongside n_bins calibration
+    bins. The matched games are written to comparison_file only if one is given.
+    """
+    truth_df = tourney_truth_df(access=access)
+    if first_season is not None:
+        truth_df = truth_df[truth_df.Season >= first_season]
+
+    keys, pred = lower_team_probabilities(predictions=predictions)
+    order = np.argsort(keys, kind='stable')
+    keys, pred = keys[order], pred[order].astype(float)
+
+    position = key_positions(sorted_keys=keys, keys=truth_df.Key.to_numpy())
+    found = position >= 0
+    found[found] = ~np.isnan(pred[position[found]])
+    y, p = truth_df.Win.to_numpy()[found].astype(float), pred[position[found]]
+
+    log_losses, brier_scores = binary_log_losses(y=y, p=p), (p - y) ** 2
+    if n_bootstrap > 0 and len(y):
+        intervals = np.quantile(bootstrap_means(values=np.stack([log_losses, brier_scores]),
+                                                n_bootstrap=n_bootstrap, seed=seed),
+                                [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+    else:
+        intervals = np.full((2, 2), np.nan)
+
+    if comparison_file is not None:
+        matched_df = truth_df[found]
+        pd.DataFrame({'Season': matched_df.Season, 'TeamID': matched_df.TeamID,
+                      'OtherTeamID': matched_df.OtherTeamID, 'Round': matched_df.Round, 'Win': matched_df.Win,
+                      'Pred': p}).to_csv(comparison_file, index=False)
+
+    return Evaluation(games=len(y), missing_games=int((~found).sum()),
+                      log_loss=float(log_losses.mean()) if len(y) else np.nan,
+                      brier_score=float(brier_scores.mean()) if len(y) else np.nan,
+                      log_loss_interval=(float(intervals[0, 0]), float(intervals[1, 0])),
+                      brier_score_interval=(float(intervals[0, 1]), float(intervals[1, 1])),
+                      calibration_df=calibration_df(y=y, p=p, n_bins=n_bins),
+                      rounds_df=_grouped_df(groups=truth_df.Round.to_numpy()[found], y=y, p=p,
+                                            log_losses=log_losses, name='Round'),
+                      seasons_df=_grouped_df(groups=truth_df.Season.to_numpy()[found], y=y, p=p,
+                                             log_losses=log_losses, name='Season'))
+
+
+def lower_team_probabilities(predictions: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The matchup_keys of predictions, indexed as evaluate_probabilities takes them, with each probability turned
+    around to be that of the lower TeamID, as a Kaggle ID's is, in the dtype of predictions.
+    """
+    keys = index_matchup_keys(predictions.index) if isinstance(predictions.index, pd.MultiIndex) \
+        else predictions.index.to_numpy(dtype=np.int64)
+    season, team_id, other_team_id = decode_matchups(keys)
+    pred = predictions.to_numpy()
+    return matchup_keys(season=season, team_id=team_id, other_team_id=other_team_id), \
+        np.where(team_id < other_team_id, pred, 1 - pred)
+
+
+def binary_log_losses(y: np.ndarray, p: np.ndarray, eps: float = log_loss_eps) -> np.ndarray:
+    """
+    The log loss of each game, whose mean is scikit-learn's log_loss.
+    """
+    p = np.clip(p, eps, 1 - eps)
+    return -(y * np.log(p) + (1 - y) * np.log(1 - p))
+
+
+def bootstrap_means(values: np.ndarray, n_bootstrap: int = default_n_bootstrap, seed: int = 0,
+                    batch_size: int = 1000) -> np.ndarray:
+    """
+    The means of each row of values (metrics by games) over n_bootstrap resamples of the games, as a resamples
+    by metrics array. A batch of resamples is drawn at once as counts of each game, so each mean is a product.
+    """
+    rng = np.random.default_rng(seed)
+    n = values.shape[1]
+    means = []
+    for start in range(0, n_bootstrap, batch_size):
+        counts = rng.multinomial(n, np.full(n, 1 / n), size=min(batch_size, n_bootstrap - start))
+        means.append(counts @ values.T / n)
+    return np.concatenate(means)
+
+
+def calibration_df(y: np.ndarray, p: np.ndarray, n_bins: int = default_n_bins) -> pd.DataFrame:
+    """
+    Games, mean probability and win rate in each of n_bins equal width probability bins.
+    """
+    bins = np.minimum((p * n_bins).astype(int), n_bins - 1)
+    games = np.bincount(bins, minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({'Lower': np.arange(n_bins) / n_bins, 'Upper': np.arange(1, n_bins + 1) / n_bins,
+                             'Games': games, 'MeanPred': np.bincount(bins, weights=p, minlength=n_bins) / games,
+                             'WinRate': np.bincount(bins, weights=y, minlength=n_bins) / games},
+                            index=pd.RangeIndex(n_bins, name='Bin'))
+
+
+def _grouped_df(groups: np.ndarray, y: np.ndarray, p: np.ndarray, log_losses: np.ndarray, name: str) -> pd.DataFrame:
+    labels, group = np.unique(groups, return_inverse=True)
+    games = np.bincount(group, minlength=len(labels))
+    return pd.DataFrame({'Games': games,
+                         'LogLoss': np.bincount(group, weights=log_losses, minlength=len(labels)) / games,
+                         'BrierScore': np.bincount(group, weights=(p - y) ** 2, minlength=len(labels)) / games,
+                         'MeanPred': np.bincount(group, weights=p, minlength=len(labels)) / games,
+                         'WinRate': np.bincount(group, weights=y, minlength=len(labels)) / games},
+                        index=pd.Index(labels, name=name))
+
+
+def log_loss_error(predictions_df: pd.DataFrame, access: DataAccess, comparison_file: Optional[str] = None) -> float:
+    """
+    The log loss of a submission (Pred indexed by Season_TeamID_OtherTeamID IDs) on the tourneys since 2015.
+    """
+    predictions = pd.Series(predictions_df.Pred.to_numpy(), index=parse_kaggle_ids(predictions_df.index))
+    return evaluate_probabilities(predictions=predictions, access=access, first_season=2015, n_bootstrap=0,
+                                  comparison_file=comparison_file).log_loss
+
+
+def elo_sweep_log_loss(parameters: Sequence[EloParameters], access: DataAccess, eps: float = 1e-15) -> pd.DataFrame:
+    """
+    Scores every Elo parameter setting against the tourney ground truth in one pass over the games, using the
+    end of regular season ratings as EloTournamentPredictor does. One row per setting, best first.
+    """
+    sweep = EloSweep(parameters=parameters)
+    end_of_regular_season_ratings = sweep.run(compact_results_df=all_season_compact_results_df(access).reset_index(),
+                                              team_conferences_df=access.team_conferences_df())
+
+    truth_df = tourney_truth_df(access=access)
+    truth_df = truth_df[truth_df.Season >= 2015]
+    season = np.searchsorted(sweep.seasons, truth_df.Season.to_numpy())
+    team_elo = end_of_regular_season_ratings[season, :, np.searchsorted(sweep.team_ids, truth_df.TeamID.to_numpy())]
+    other_team_elo = end_of_regular_season_ratings[season, :,
+                                                   np.searchsorted(sweep.team_ids, truth_df.OtherTeamID.to_numpy())]
+
+    win_probability = np.clip(1 / (1 + 10 ** ((other_team_elo - team_elo) / 400)), eps, 1 - eps)
+    win = truth_df.Win.to_numpy()[:, np.newaxis]
+    loss = -np.mean(win * np.log(win_probability) + (1 - win) * np.log(1 - win_probability), axis=0)
+
+    sweep_df = pd.DataFrame.from_records(sweep.parameters, columns=EloParameters._fields)
+    sweep_df['LogLoss'] = loss
+    return sweep_df.sort_values('LogLoss').reset_index(drop=True)
+
+
+def tourney_outcomes_df(access: DataAccess) -> pd.DataFrame:
+    """
+    Every tourney game as TeamID < OtherTeamID, with Win true when TeamID won.
+    """
+    results_df = access.tourney_compact_results_df()
+    return pd.DataFrame({'Season': results_df.Season.to_numpy(),
+                         'TeamID': np.minimum(results_df.WTeamID, results_df.LTeamID).to_numpy(),
+                         'OtherTeamID': np.maximum(results_df.WTeamID, results_df.LTeamID).to_numpy(),
+                         'Win': (results_df.WTeamID < results_df.LTeamID).to_numpy()})
+
+
+@memoize
+def tourney_truth_df(access: DataAccess) -> pd.DataFrame:
+    """
+    tourney_outcomes_df with each game's matchup_keys Key and the Round of the slot it was played in, from
+    infer_slot_dates (-1 outside the bracket), sorted by Key.
+    """
+    truth_df = tourney_outcomes_df(access=access)
+    slots = infer_slot_dates(access=access).Slot
+    truth_df['Round'] = slots.map({slot: slot_round(slot) for slot in slots.dropna().unique()}) \
+        .fillna(-1).to_numpy(dtype=np.int8)
+    truth_df.insert(0, 'Key', matchup_keys(season=truth_df.Season, team_id=truth_df.TeamID,
+                                           other_team_id=truth_df.OtherTeamID))
+    return truth_df.sort_values('Key', ignore_index=True)
+
+
+def rolling_origin_backtest(predictor: TournamentPredictor, design: MatchupDesign, access: DataAccess,
+                            seasons: Optional[Sequence[int]] = None, incremental: bool = True) -> pd.DataFrame:
+    """
+    Walks forward over seasons, scoring each season's tourney with the predictor trained on the games of the
+    seasons before it only. After the first step the predictor is brought up to date with update_design, one
+    season at a time, or retrained from scratch unless incremental. Seasons default to those of the design with
+    an earlier season to train on. One row per season of log loss, Brier score and the time spent fitting for it.
+    """
+    design_seasons = np.unique(design.team_features_df.index.get_level_values('Season'))
+    seasons = design_seasons[1:] if seasons is None else sorted(seasons)
+    outcomes_df = tourney_outcomes_df(access=access)
+
+    rows, trained_through = [], None
+    for season in seasons:
+        start = time.perf_counter()
+        if trained_through is None or not incremental:
+            predictor.train_design(design=design, last_season=season - 1)
+        else:
+            for new_season in design_seasons[(design_seasons > trained_through) & (design_seasons < season)]:
+                predictor.update_design(design=design, season=int(new_season))
+        trained_through = season - 1
+        fit_seconds = time.perf_counter() - start
+
+        season_outcomes_df = outcomes_df[outcomes_df.Season == season]
+        y = season_outcomes_df.Win.to_numpy(dtype=float)
+        p = predictor.estimate_probability(tourney_games_df=season_outcomes_df).to_numpy()
+        rows.append({'Season': season, 'Games': len(season_outcomes_df),
+                     'LogLoss': binary_log_losses(y=y, p=p).mean(), 'BrierScore': ((p - y) ** 2).mean(),
+                     'FitSeconds': fit_seconds})
 
-def log_loss_error(predictions_df: pd.DataFrame, access: DataAccess, comparison_file: str) -> float:
-    truth_df = ground_truth_since_2015(access)
-    comparison_df = pd.concat([truth_df, predictions_df], axis=1, join='inner')
-    comparison_df.to_csv(comparison_file, index=True)
-    loss = log_loss(y_true=comparison_df.Win, y_pred=comparison_df.Pred)
-    return loss
+    return pd.DataFrame.from_records(rows, index='Season')
@@ -0,0 +1,102 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ncaa_predict.data.access import DataAccess, mens_access, womens_access
+from ncaa_predict.data.matchup_keys import format_kaggle_ids
+from ncaa_predict.data.processed import possible_games_df
+from ncaa_predict.evaluate import evaluate_probabilities, lower_team_probabilities
+from ncaa_predict.models.design import MatchupDesign, matchup_design
+from ncaa_predict.models.prediction import TournamentPredictor, EloTournamentPredictor, LRTournamentPredictor, \
+    MLPTournamentPredictor
+from ncaa_predict.utils import SharedFrame, attach_frame, pool_context, share_frame
+
+default_out_dir = 'out'
+
+# Designs rebuilt from shared memory, kept for the life of a worker so later jobs on a dataset only pay to fit.
+_worker_designs = {}  # type: Dict[SharedFrame, MatchupDesign]
+
+
+def run_experiments(accesses: Sequence[DataAccess] = (mens_access, womens_access),
+                    predictors: Optional[Sequence[TournamentPredictor]] = None,
+                    first_season: int = 2015, out_dir: str = default_out_dir,
+                    max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Trains and evaluates every predictor on every dataset as independent jobs on a pool of worker processes,
+    writing each job's submission and comparison files to out_dir. Each dataset's team features are built once
+    here and handed to the workers through shared memory. Returns the evaluation summary and timings of each job.
+    Predictors default to a new Elo, LR and MLP predictor per call.
+    """
+    if predictors is None:
+        predictors = (EloTournamentPredictor(), LRTournamentPredictor(), MLPTournamentPredictor())
+    shared_frames, blocks = {}, []
+    try:
+        for access in accesses:
+            shared_frames[access.prefix], access_blocks = share_frame(
+                matchup_design(prefix=access.prefix).team_features_df)
+            blocks.extend(access_blocks)
+
+        jobs = list(itertools.product(accesses, predictors))
+        max_workers = max(1, min(len(jobs), os.cpu_count() or 1)) if max_workers is None else max_workers
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=pool_context) as executor:
+            results = list(executor.map(_run_job,
+                                        [access for access, _ in jobs],
+                                        [shared_frames[access.prefix] for access, _ in jobs],
+                                        [predictor for _, predictor in jobs],
+                                        itertools.repeat(first_season), itertools.repeat(out_dir)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return pd.DataFrame.from_records(results, index=['Prefix', 'Predictor'])
+
+
+def _run_job(access: DataAccess, shared: SharedFrame, predictor: TournamentPredictor, first_season: int,
+             out_dir: str) -> Dict:
+    start = time.perf_counter()
+    if shared not in _worker_designs:
+        _worker_designs[shared] = MatchupDesign(team_features_df=attach_frame(shared))
+    design = _worker_designs[shared]
+    attached = time.perf_counter()
+
+    predictor.train_design(design=design)
+    trained = time.perf_counter()
+
+    predictions = predictor.estimate_probability(tourney_games_df=possible_games_df(access=access,
+                                                                                     first_season=first_season))
+    estimated = time.perf_counter()
+
+    pred_name = type(predictor).__name__
+    comparison_file = os.path.join(out_dir, f'{access.prefix}_{pred_name}_ComparisonStage1.csv')
+    evaluation = evaluate_probabilities(predictions=predictions, access=access, first_season=first_season,
+                                        comparison_file=comparison_file)
+    write_submission(submission_df=submission_df(predictions=predictions),
+                     submission_file=os.path.join(out_dir, f'{access.prefix}_{pred_name}_SubmissionStage1.csv'))
+
+    return {'Prefix': access.prefix, 'Predictor': pred_name, **evaluation.summary(),
+            'AttachSeconds': attached - start, 'TrainSeconds': trained - attached,
+            'EstimateSeconds': estimated - trained, 'WallSeconds': time.perf_counter() - start}
+
+
+def submission_df(predictions: pd.Series) -> pd.DataFrame:
+    """
+    Pred, the probability that the lower TeamID of each game wins, indexed by the game's matchup_keys Key in
+    order, which is the order of the Kaggle IDs.
+    """
+    keys, pred = lower_team_probabilities(predictions=predictions)
+    order = np.argsort(keys, kind='stable')
+    return pd.DataFrame({'Pred': pred[order]}, index=pd.Index(keys[order], name='Key'))
+
+
+def write_submission(submission_df: pd.DataFrame, submission_file: str):
+    """
+    Writes a submission_df as the Kaggle ID, Pred CSV; the only place the keys become strings.
+    """
+    pd.DataFrame({'ID': format_kaggle_ids(submission_df.index.to_numpy()), 'Pred': submission_df.Pred.to_numpy()}) \
+        .to_csv(submission_file, index=False)
@@ -1,26 +1,128 @@
-from typing import Callable, Dict, Union
-from ..data.access import DataAccess
+import inspect
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set, Union
+
 import pandas as pd
 from tqdm import tqdm
 
+from ..data.access import DataAccess
+from ..data.processed import validate_compact_schema
+from ..tracing import _maxrss, traced
+
+FeatureFunction = Callable[[DataAccess], Union[pd.DataFrame, pd.Series]]
+
+
+def depends_on(*input_names: str):
+    """
+    Declares the features or intermediates, by name within the same module, that a feature function reads.
+    """
+
+    def decorator(f: FeatureFunction) -> FeatureFunction:
+        f.input_names = input_names
+        return f
+
+    return decorator
+
 
 class Features():
     def __init__(self):
         self.features = {}  # type: Dict[str,Callable[[DataAccess], Union[pd.DataFrame, pd.Series]]]
+        self.run_stats_df = None  # type: Optional[pd.DataFrame]
 
     def register(self, f: Callable[[DataAccess], Union[pd.DataFrame, pd.Series]]):
+        f = traced('feature', name=f.__name__)(f)
         self.features[f.__name__] = f
         return f
 
-    def run(self, *feature_names, access: DataAccess) -> Dict[str, Union[pd.DataFrame, pd.Series]]:
-        to_run = ((feature_name, self.features.get(feature_name)) for feature_name in
-                  feature_names) if feature_names else self.features.items()
-        return {name: f(access) for name, f in
-                tqdm(iterable=to_run, desc=f'Computing "{access.prefix}" prefixed Features', leave=True)}
+    def run(self, *feature_names, access: DataAccess,
+            max_workers: Optional[int] = None) -> Dict[str, Union[pd.DataFrame, pd.Series]]:
+        """
+        Runs the features and, once each, the intermediates they depend on. Nodes whose inputs are complete run
+        concurrently on a thread pool; per node timings, result sizes and how far each raised the process's peak
+        RSS are kept in run_stats_df. Nodes run side by side, so a node's PeakRSSDelta may include its neighbours'.
+        Every feature is checked against the processed layer's compact schema.
+        """
+        targets = {feature_name: self.features[feature_name]
+                   for feature_name in (feature_names if feature_names else self.features.keys())}
+
+        inputs = _dependency_graph(nodes=targets.values())
+        remaining = {node: set(node_inputs) for node, node_inputs in inputs.items()}
+        results, stats = {}, []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                tqdm(total=len(inputs), desc=f'Computing "{access.prefix}" prefixed Features', leave=True) as progress:
+            running = {}
+            while remaining or running:
+                for node in [node for node, node_inputs in remaining.items() if not node_inputs]:
+                    del remaining[node]
+                    running[executor.submit(_timed, node, access)] = node
+                if not running:
+                    raise ValueError(f'Cyclic feature dependencies among {sorted(n.__name__ for n in remaining)}')
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    results[node], node_stats = future.result()
+                    if node in targets.values():
+                        validate_compact_schema(results[node], name=node.__name__)
+                    stats.append({'Node': node.__name__, 'Feature': node in targets.values(), **node_stats})
+                    for node_inputs in remaining.values():
+                        node_inputs.discard(node)
+                    progress.update()
+
+        self.run_stats_df = pd.DataFrame.from_records(stats, index='Node')
+        return {name: results[f] for name, f in targets.items()}
+
+    def nodes(self, *feature_names) -> List[FeatureFunction]:
+        """
+        The features (all by default) and the intermediates they depend on, each after all of its inputs.
+        """
+        inputs = _dependency_graph(nodes=[self.features[feature_name]
+                                          for feature_name in (feature_names if feature_names else self.features)])
+        ordered, visited = [], set()
+
+        def visit(node: FeatureFunction):
+            if node not in visited:
+                visited.add(node)
+                for node_input in sorted(inputs[node], key=lambda n: n.__name__):
+                    visit(node_input)
+                ordered.append(node)
+
+        for node in sorted(inputs, key=lambda n: n.__name__):
+            visit(node)
+        return ordered
+
+
+def _dependency_graph(nodes) -> Dict[FeatureFunction, Set[FeatureFunction]]:
+    graph = {}
+    to_visit = list(nodes)
+    while to_visit:
+        node = to_visit.pop()
+        if node in graph:
+            continue
+        module_globals = inspect.unwrap(node).__globals__
+        graph[node] = {module_globals[name] for name in getattr(node, 'input_names', ())}
+        to_visit.extend(graph[node])
+    return graph
+
+
+def _timed(f: FeatureFunction, access: DataAccess):
+    start, start_cpu, start_maxrss = time.perf_counter(), time.thread_time(), _maxrss()
+    result = f(access)
+    wall_seconds, cpu_seconds = time.perf_counter() - start, time.thread_time() - start_cpu
+    peak_rss_delta = _maxrss() - start_maxrss
+    result_bytes = result.memory_usage(deep=True) if isinstance(result, (pd.DataFrame, pd.Series)) else 0
+    return result, {'WallSeconds': wall_seconds,
+                    'ThreadCPUSeconds': cpu_seconds,
+                    'PeakRSSDelta': peak_rss_delta,
+                    'ResultBytes': int(result_bytes.sum() if isinstance(result, pd.DataFrame) else result_bytes)}
 
 
 tf = Features()
 pf = Features()
+# Lineup features, indexed by the lineups of each team game rather than by player game.
+lf = Features()
 tpf = Features()
 
 from . import team_features
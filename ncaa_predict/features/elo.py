@@ -0,0 +1,268 @@
+import itertools
+from typing import Iterable, List, NamedTuple, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+
+# https://fivethirtyeight.com/features/how-we-calculate-nba-elo-ratings/
+# https://www.ergosum.co/nate-silvers-nba-elo-algorithm/
+
+class EloParameters(NamedTuple):
+    r_0: float = 1300
+    home_advantage: float = 100
+    regression: float = 0.25
+    k: float = 20
+    mov_offset: float = 3
+    mov_exponent: float = 0.8
+
+
+class EloEngine():
+    """
+    Array backed Elo ratings. TeamIDs are mapped to dense integers once and ratings are held in a NumPy array,
+    so the engine can be run over any game formatted results independently of the Features registries.
+    """
+
+    def __init__(self, parameters: EloParameters = EloParameters()):
+        self.parameters = parameters
+
+    def run(self, compact_results_df: pd.DataFrame, team_conferences_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rates games in the order given within each season, seasons ascending.
+        Returns the post game ratings of the winning and losing teams aligned with the rows of compact_results_df.
+        """
+        p = self.parameters
+        g = _elo_games(compact_results_df=compact_results_df, team_conferences_df=team_conferences_df)
+        order, n_games = g.order, len(g.order)
+
+        w_bonus = np.where(g.w_loc == 'H', p.home_advantage, 0.0)
+        l_bonus = np.where(g.w_loc == 'A', p.home_advantage, 0.0)
+
+        k_numerator = _k_numerators(unique_mov=g.unique_mov, parameters=p)[g.mov_index]
+
+        ratings = np.full(len(g.team_ids), p.r_0, dtype=float)
+        w_elo = np.empty(n_games)
+        l_elo = np.empty(n_games)
+
+        for s, start, _, end in tqdm(iterable=g.season_bounds(), total=len(g.seasons),
+                                     leave=False, desc='Calculating Historical Elo Ratings'):
+            # We apply a regression to conference mean at the start of each season.
+            teams, conferences = g.season_conferences(s)
+            ratings = _regress_to_conference_means(ratings=ratings, teams=teams, conferences=conferences,
+                                                   regression=p.regression)
+
+            # The game sequence is inherently serial; ratings are updated as Python floats for exactness.
+            r = ratings.tolist()
+            season_w_elo, season_l_elo = [], []
+            for w, l, w_ha, l_ha, k_num in zip(g.w_team[start:end].tolist(), g.l_team[start:end].tolist(),
+                                               w_bonus[start:end].tolist(), l_bonus[start:end].tolist(),
+                                               k_numerator[start:end].tolist()):
+                r_w = r[w]
+                r_l = r[l]
+
+                r_w_ha = r_w + w_ha
+                r_l_ha = r_l + l_ha
+
+                k = k_num / (7.5 + 0.006 * (r_w_ha - r_l_ha))
+
+                e_w = 1 / (1 + 10 ** ((r_l_ha - r_w_ha) / 400))
+                e_l = 1 / (1 + 10 ** ((r_w_ha - r_l_ha) / 400))
+
+                r[w] = k * (1 - e_w) + r_w
+                r[l] = k * (0 - e_l) + r_l
+
+                season_w_elo.append(r[w])
+                season_l_elo.append(r[l])
+
+            ratings = np.array(r)
+            w_elo[order[start:end]] = season_w_elo
+            l_elo[order[start:end]] = season_l_elo
+
+        self.team_ids = g.team_ids
+        self.ratings = ratings
+
+        return w_elo, l_elo
+
+
+class EloSweep():
+    """
+    Carries a grid of Elo parameter settings through the game sequence at once. Ratings are held as a 2-D array
+    of params x teams and games between disjoint teams are updated together, one vectorized step per batch.
+    """
+
+    def __init__(self, parameters: Sequence[EloParameters]):
+        self.parameters = list(parameters)
+
+    @property
+    def ratings(self) -> np.ndarray:
+        # params x teams
+        return self._ratings.T
+
+    def run(self, compact_results_df: pd.DataFrame, team_conferences_df: pd.DataFrame) -> np.ndarray:
+        """
+        Returns the end of regular season ratings, shaped seasons x params x teams and labelled by
+        self.seasons and self.team_ids. Rows flagged by a Tourney column are rated after the snapshot is taken.
+        """
+        p = EloParameters(*(np.array(values, dtype=float) for values in zip(*self.parameters)))
+        g = _elo_games(compact_results_df=compact_results_df, team_conferences_df=team_conferences_df)
+
+        w_home = (g.w_loc == 'H')[:, np.newaxis]
+        l_home = (g.w_loc == 'A')[:, np.newaxis]
+
+        k_numerator = _k_numerators(unique_mov=g.unique_mov, parameters=p)
+
+        # Held as teams x params so that the rows gathered for a batch of games are contiguous.
+        ratings = np.tile(p.r_0, (len(g.team_ids), 1))
+        snapshots = np.empty((len(g.seasons), len(self.parameters), len(g.team_ids)))
+
+        for i, (s, start, tourney_start, end) in enumerate(tqdm(iterable=g.season_bounds(), total=len(g.seasons),
+                                                                  leave=False, desc='Sweeping Elo parameters')):
+            teams, conferences = g.season_conferences(s)
+            ratings = _regress_to_conference_means(ratings=ratings, teams=teams, conferences=conferences,
+                                                   regression=p.regression)
+
+            for a, b in _independent_batches(w_team=g.w_team, l_team=g.l_team, start=start, end=end,
+                                             breaks={tourney_start}):
+                if a == tourney_start:
+                    snapshots[i] = ratings.T
+
+                w, l = g.w_team[a:b], g.l_team[a:b]
+                r_w, r_l = ratings[w], ratings[l]
+
+                r_w_ha = r_w + p.home_advantage * w_home[a:b]
+                r_l_ha = r_l + p.home_advantage * l_home[a:b]
+
+                k = k_numerator[g.mov_index[a:b]] / (7.5 + 0.006 * (r_w_ha - r_l_ha))
+
+                e_w = 1 / (1 + 10 ** ((r_l_ha - r_w_ha) / 400))
+                e_l = 1 / (1 + 10 ** ((r_w_ha - r_l_ha) / 400))
+
+                ratings[w] = k * (1 - e_w) + r_w
+                ratings[l] = k * (0 - e_l) + r_l
+
+            if tourney_start == end:
+                snapshots[i] = ratings.T
+
+        self.seasons = g.seasons
+        self.team_ids = g.team_ids
+        self._ratings = ratings
+
+        return snapshots
+
+
+def elo_parameter_grid(**values: Sequence[float]) -> List[EloParameters]:
+    """
+    The cartesian product of the given values for any EloParameters fields, the remaining fields kept at default.
+    """
+    names = [name for name in EloParameters._fields if name in values]
+    return [EloParameters()._replace(**dict(zip(names, combination)))
+            for combination in itertools.product(*(values[name] for name in names))]
+
+
+class _EloGames(NamedTuple):
+    order: np.ndarray
+    team_ids: np.ndarray
+    w_team: np.ndarray
+    l_team: np.ndarray
+    w_loc: np.ndarray
+    unique_mov: np.ndarray
+    mov_index: np.ndarray
+    seasons: np.ndarray
+    season_starts: np.ndarray
+    tourney_starts: np.ndarray
+    conference_season: np.ndarray
+    conference_team: np.ndarray
+    conferences: np.ndarray
+
+    def season_bounds(self) -> Iterable[Tuple[int, int, int, int]]:
+        season_ends = np.append(self.season_starts[1:], len(self.order))
+        return zip(self.seasons, self.season_starts, self.tourney_starts, season_ends)
+
+    def season_conferences(self, season: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = np.searchsorted(self.conference_season, [season, season + 1])
+        return self.conference_team[start:end], self.conferences[start:end]
+
+
+def _elo_games(compact_results_df: pd.DataFrame, team_conferences_df: pd.DataFrame) -> _EloGames:
+    # Games are taken in the order given within each season, seasons ascending.
+    season = compact_results_df.Season.to_numpy()
+    order = np.argsort(season, kind='stable')
+    season = season[order]
+
+    team_ids, dense = np.unique(np.concatenate([compact_results_df.WTeamID.to_numpy(),
+                                                compact_results_df.LTeamID.to_numpy(),
+                                                team_conferences_df.TeamID.to_numpy()]),
+                                return_inverse=True)
+    n_games = len(season)
+
+    mov = (compact_results_df.WScore.to_numpy() - compact_results_df.LScore.to_numpy())[order]
+    unique_mov, mov_index = np.unique(mov, return_inverse=True)
+
+    seasons, season_starts = np.unique(season, return_index=True)
+
+    # Tourney games follow the regular season within each season.
+    if 'Tourney' in compact_results_df.columns:
+        regular_season_games = np.bincount(np.searchsorted(seasons, season),
+                                           weights=~compact_results_df.Tourney.to_numpy(dtype=bool)[order],
+                                           minlength=len(seasons))
+        tourney_starts = season_starts + regular_season_games.astype(int)
+    else:
+        tourney_starts = np.append(season_starts[1:], n_games)
+
+    conference_season = team_conferences_df.Season.to_numpy()
+    conference_order = np.argsort(conference_season, kind='stable')
+
+    return _EloGames(order=order,
+                     team_ids=team_ids,
+                     w_team=dense[:n_games][order],
+                     l_team=dense[n_games:2 * n_games][order],
+                     w_loc=compact_results_df.WLoc.to_numpy()[order],
+                     unique_mov=unique_mov,
+                     mov_index=mov_index,
+                     seasons=seasons,
+                     season_starts=season_starts,
+                     tourney_starts=tourney_starts,
+                     conference_season=conference_season[conference_order],
+                     conference_team=dense[2 * n_games:][conference_order],
+                     conferences=team_conferences_df.ConfAbbrev.to_numpy()[conference_order])
+
+
+def _independent_batches(w_team: np.ndarray, l_team: np.ndarray, start: int, end: int,
+                         breaks: Set[int]) -> Iterable[Tuple[int, int]]:
+    # Consecutive games between disjoint teams commute, so each maximal run of them can be rated in one step.
+    batch_start, seen = start, set()
+    for i, w, l in zip(range(start, end), w_team[start:end].tolist(), l_team[start:end].tolist()):
+        if w in seen or l in seen or (i in breaks and i != batch_start):
+            yield batch_start, i
+            batch_start, seen = i, set()
+        seen.add(w)
+        seen.add(l)
+    if batch_start < end:
+        yield batch_start, end
+
+
+def _k_numerators(unique_mov: np.ndarray, parameters: EloParameters) -> np.ndarray:
+    # Margins of victory take few distinct values, so the power is evaluated once per value with Python floats.
+    if np.ndim(parameters.k) == 0:
+        return np.array([parameters.k * ((m + parameters.mov_offset) ** parameters.mov_exponent)
+                         for m in unique_mov.tolist()], dtype=float)
+    return parameters.k * ((unique_mov[:, np.newaxis] + parameters.mov_offset) ** parameters.mov_exponent)
+
+
+def _regress_to_conference_means(ratings: np.ndarray, teams: np.ndarray, conferences: np.ndarray,
+                                 regression: Union[float, np.ndarray]) -> np.ndarray:
+    if len(teams) == 0:
+        return ratings
+    codes, _ = pd.factorize(conferences)
+    team_ratings = ratings[teams]
+    counts = np.bincount(codes)
+    if team_ratings.ndim == 1:
+        conference_average = np.bincount(codes, weights=team_ratings) / counts
+    else:
+        conference_sums = np.zeros((len(counts), team_ratings.shape[1]))
+        np.add.at(conference_sums, codes, team_ratings)
+        conference_average = conference_sums / counts[:, np.newaxis]
+    ratings = ratings.copy()
+    ratings[teams] = regression * conference_average[codes] + (1 - regression) * team_ratings
+    return ratings
@@ -0,0 +1,222 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ..data.access import DataAccess, events_chunk_size, events_game_columns
+from ..data.processed import empty_df, game_format_indices, player_game_format_indices
+from ..utils import memoize, pool_context
+
+court_events_columns = [*events_game_columns, 'WCurrentScore', 'LCurrentScore', 'ElapsedSeconds', 'EventTeamID',
+                        'EventPlayerID', 'EventType', 'EventSubType']
+
+# A team's possession ends on its made field goal, turnover or made last free throw, or on the other team's
+# defensive rebound. Ends of the same team in a row, such as a basket and its and-one, are one possession.
+offensive_possession_end_types = ['made2', 'made3', 'turnover']
+last_free_throw_subtypes = ['1of1', '2of2', '3of3']
+defensive_rebound_subtypes = ['def', 'defdb']
+# sub subtypes that put a player on the court; any other takes them off.
+on_court_sub_subtypes = ['in', 'start']
+
+lineup_indices = [*game_format_indices, 'TeamID', 'Lineup']
+court_stats_columns = ['Seconds', 'Possessions', 'PlusMinus']
+
+
+class CourtStats(NamedTuple):
+    # Seconds on court, own team possessions and plus-minus of each player game with substitutions, indexed by
+    # player_game_format_indices.
+    players_df: pd.DataFrame
+    # The same for each lineup a team used in a game, with its number of Players and whether it was Starting, on
+    # court when the clock first ran, indexed by lineup_indices. Lineup hashes the set of players.
+    lineups_df: pd.DataFrame
+
+
+@memoize
+def court_stats(access: DataAccess) -> CourtStats:
+    """
+    The CourtStats of every event season of the access. Seasons are independent and are processed on a pool of
+    worker processes, each streaming its season in chunks of whole games.
+    """
+    seasons = access.events_seasons()
+    with ProcessPoolExecutor(max_workers=max(1, min(len(seasons), os.cpu_count() or 1)),
+                             mp_context=pool_context) as executor:
+        return _concat_court_stats(list(executor.map(season_court_stats, itertools.repeat(access), seasons)))
+
+
+def season_court_stats(access: DataAccess, season: int, chunk_size: int = events_chunk_size) -> CourtStats:
+    return _concat_court_stats([games_court_stats(events_df=chunk)
+                                for chunk in access.events_game_chunks(season=season, columns=court_events_columns,
+                                                                       chunk_size=chunk_size)])
+
+
+def games_court_stats(events_df: pd.DataFrame) -> CourtStats:
+    """
+    Rebuilds who was on court, and each team's possessions, from the events of whole games in time order, in one
+    vectorized pass over all of their games.
+
+    Each game has a boundary before its first event and after each event, at which the clock, the score margin
+    and the possession counts are read. A player is on court from an in or start substitution to an out, from
+    tip-off when their first substitution is an out and to the final buzzer when their last is not. A team's
+    lineup is the XOR of a hash of each of its players on court, which each of their substitutions toggles.
+    """
+    n = len(events_df)
+    keys = events_df[events_game_columns].to_numpy()
+    new_game = np.append(True, (keys[1:] != keys[:-1]).any(axis=1))[:n]
+    starts = np.flatnonzero(new_game)
+    n_games = len(starts)
+    game = np.cumsum(new_game) - 1
+    # The boundary after row i is i + game[i] + 1; game g's first is starts[g] + g and its last its end + g.
+    after = np.arange(n) + game + 1
+    game_start = starts + np.arange(n_games)
+    game_end = np.append(starts[1:], n) + np.arange(n_games)
+
+    team, player = events_df.EventTeamID.to_numpy(), events_df.EventPlayerID.to_numpy()
+    # Side 0 is the winning team, 1 the losing team and -1 neither.
+    side = np.where(team == events_df.WTeamID.to_numpy(), 0, np.where(team == events_df.LTeamID.to_numpy(), 1, -1))
+    event_type, event_subtype = events_df.EventType, events_df.EventSubType
+
+    elapsed = np.insert(events_df.ElapsedSeconds.to_numpy(dtype=np.int64), starts, 0)
+    margin = np.insert(events_df.WCurrentScore.to_numpy(dtype=np.int64)
+                       - events_df.LCurrentScore.to_numpy(dtype=np.int64), starts, 0)
+    possessions = _possession_counts(event_type=event_type, event_subtype=event_subtype, side=side, game=game,
+                                     starts=starts)
+
+    def stats(side: np.ndarray, first: np.ndarray, last: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({'Seconds': elapsed[last] - elapsed[first],
+                             'Possessions': possessions[side, last] - possessions[side, first],
+                             'PlusMinus': np.where(side == 0, 1, -1) * (margin[last] - margin[first])},
+                            dtype=np.int32)
+
+    # The substitutions of each player game in time order, kept where they change the player's state.
+    sub_rows = np.flatnonzero((event_type == 'sub').to_numpy() & (player != 0) & (side >= 0))
+    sub_rows = sub_rows[np.lexsort((sub_rows, player[sub_rows], game[sub_rows]))]
+    sub_game, sub_side, sub_player = game[sub_rows], side[sub_rows], player[sub_rows]
+    on = event_subtype.isin(on_court_sub_subtypes).to_numpy()[sub_rows]
+    first_sub = np.append(True, (sub_game[1:] != sub_game[:-1]) | (sub_player[1:] != sub_player[:-1]))[:len(on)]
+    changed = first_sub.copy()
+    changed[1:] |= on[1:] != on[:-1]
+    implied = first_sub & ~on
+    closing = np.append(first_sub[1:], True)[:len(on)] & on
+
+    changes = _transitions(game=np.concatenate([sub_game[changed], sub_game[implied]]),
+                           side=np.concatenate([sub_side[changed], sub_side[implied]]),
+                           player=np.concatenate([sub_player[changed], sub_player[implied]]),
+                           boundary=np.concatenate([after[sub_rows][changed], game_start[sub_game[implied]]]),
+                           on=np.concatenate([on[changed], np.ones(implied.sum(), dtype=bool)]))
+    closings = _transitions(game=sub_game[closing], side=sub_side[closing], player=sub_player[closing],
+                            boundary=game_end[sub_game[closing]], on=np.zeros(closing.sum(), dtype=bool))
+
+    # Stints alternate on and off within each player game; an off at the boundary of an on sorts after it.
+    stints = pd.concat([changes, closings], ignore_index=True)
+    stints = stints.iloc[np.lexsort((~stints.On.to_numpy(), stints.Boundary.to_numpy(), stints.Player.to_numpy(),
+                                     stints.Game.to_numpy()))]
+    stint_starts, stint_ends = stints.iloc[0::2], stints.iloc[1::2]
+    stints_df = stats(side=stint_starts.Side.to_numpy(), first=stint_starts.Boundary.to_numpy(),
+                      last=stint_ends.Boundary.to_numpy())
+    stints_df['Game'], stints_df['EventPlayerID'] = stint_starts.Game.to_numpy(), stint_starts.Player.to_numpy()
+    players_df = stints_df.groupby(['Game', 'EventPlayerID'], sort=True)[court_stats_columns].sum()
+
+    # A tip-off transition of no player begins each team's first lineup, ahead of any implied starters.
+    tip_offs = _transitions(game=np.repeat(np.arange(n_games), 2), side=np.tile([0, 1], n_games),
+                            player=np.zeros(2 * n_games, dtype=player.dtype), boundary=np.repeat(game_start, 2),
+                            on=np.zeros(2 * n_games, dtype=bool))
+    lineups_df = _lineups_df(transitions=pd.concat([tip_offs, changes], ignore_index=True), game_end=game_end,
+                             stats=stats)
+
+    game_index_df = pd.DataFrame(keys[starts], columns=events_game_columns) \
+        .astype({c: events_df[c].dtype for c in events_game_columns})
+    lineup_game = lineups_df.index.get_level_values('Game').to_numpy()
+    lineups_df.insert(0, 'TeamID', np.where(lineups_df.index.get_level_values('Side') == 0,
+                                            game_index_df.WTeamID.to_numpy()[lineup_game],
+                                            game_index_df.LTeamID.to_numpy()[lineup_game]))
+    return CourtStats(players_df=_game_indexed(df=players_df, game_index_df=game_index_df,
+                                               indices=player_game_format_indices),
+                      lineups_df=_game_indexed(df=lineups_df.reset_index(level='Side', drop=True),
+                                               game_index_df=game_index_df, indices=lineup_indices))
+
+
+def _possession_counts(event_type: pd.Series, event_subtype: pd.Series, side: np.ndarray, game: np.ndarray,
+                       starts: np.ndarray) -> np.ndarray:
+    # Each side's possessions so far at every boundary, as a 2 by boundaries array.
+    offensive_end = (event_type.isin(offensive_possession_end_types)
+                     | ((event_type == 'made1') & event_subtype.isin(last_free_throw_subtypes))).to_numpy()
+    defensive_rebound = ((event_type == 'reb') & event_subtype.isin(defensive_rebound_subtypes)).to_numpy()
+    owner = np.where(side < 0, -1, np.where(offensive_end, side, np.where(defensive_rebound, 1 - side, -1)))
+
+    end_rows = np.flatnonzero(owner >= 0)
+    end_owner, end_game = owner[end_rows], game[end_rows]
+    new_possession = np.append(True, (end_owner[1:] != end_owner[:-1]) | (end_game[1:] != end_game[:-1]))
+    ended = np.zeros((2, len(side)), dtype=np.int64)
+    ended[end_owner, end_rows] = new_possession[:len(end_rows)]
+    counts = np.cumsum(ended, axis=1)
+    return np.insert(counts, starts, counts[:, starts] - ended[:, starts], axis=1)
+
+
+def _transitions(game: np.ndarray, side: np.ndarray, player: np.ndarray, boundary: np.ndarray,
+                 on: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({'Game': game, 'Side': side, 'Player': player, 'Boundary': boundary, 'On': on})
+
+
+def _lineups_df(transitions: pd.DataFrame, game_end: np.ndarray,
+                stats: Callable[[np.ndarray, np.ndarray, np.ndarray], pd.DataFrame]) -> pd.DataFrame:
+    # The lexsort is stable, so each team's tip-off stays first among its transitions at the opening boundary.
+    transitions = transitions.iloc[np.lexsort((transitions.Boundary.to_numpy(), transitions.Side.to_numpy(),
+                                               transitions.Game.to_numpy()))]
+    game, side, boundary = (transitions[c].to_numpy() for c in ('Game', 'Side', 'Boundary'))
+    player = transitions.Player.to_numpy()
+    team = 2 * game + side
+    first = np.flatnonzero(np.append(True, team[1:] != team[:-1])[:len(team)])
+    team_sizes = np.diff(np.append(first, len(team)))
+
+    # Running XOR and count of the players on court, from each team's tip-off, whose hash and change are zero.
+    lineup = np.bitwise_xor.accumulate(np.where(player != 0, _player_hashes(player), np.uint64(0)))
+    lineup ^= np.repeat(lineup[first], team_sizes)
+    players = np.cumsum(np.where(player == 0, 0, np.where(transitions.On.to_numpy(), 1, -1)))
+    players -= np.repeat(players[first], team_sizes)
+
+    # A segment runs from the last transition of a team at a boundary to its next one, or the final buzzer.
+    last = np.append((team[1:] != team[:-1]) | (boundary[1:] != boundary[:-1]), True)[:len(team)]
+    segment_team, segment_start = team[last], boundary[last]
+    continued = np.append(segment_team[1:] == segment_team[:-1], False)[:len(segment_team)]
+    segment_end = np.where(continued, np.roll(segment_start, -1), game_end[game[last]])
+
+    segments_df = stats(side[last], segment_start, segment_end)
+    segments_df['Game'], segments_df['Side'] = game[last], side[last]
+    segments_df['Lineup'], segments_df['Players'] = lineup[last].view(np.int64), players[last].astype(np.int32)
+
+    lineups_df = segments_df.groupby(['Game', 'Side', 'Lineup'], sort=True) \
+        .agg(Players=('Players', 'first'), Seconds=('Seconds', 'sum'), Possessions=('Possessions', 'sum'),
+             PlusMinus=('PlusMinus', 'sum'))
+    starting = segments_df[segments_df.Seconds > 0].groupby(['Game', 'Side']).head(1) \
+        .set_index(['Game', 'Side', 'Lineup']).index
+    lineups_df['Starting'] = lineups_df.index.isin(starting)
+    return lineups_df
+
+
+def _player_hashes(player: np.ndarray) -> np.ndarray:
+    # splitmix64, so that the XOR of a lineup's hashes is all but unique to its set of players.
+    z = player.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _game_indexed(df: pd.DataFrame, game_index_df: pd.DataFrame, indices: Sequence[str]) -> pd.DataFrame:
+    # Replaces the Game level of df, a position in game_index_df, with the game columns.
+    df = df.reset_index()
+    return pd.concat([game_index_df.iloc[df.Game.to_numpy()].reset_index(drop=True), df.drop(columns='Game')],
+                     axis=1).set_index(list(indices))
+
+
+def _concat_court_stats(court_stats: Sequence[CourtStats]) -> CourtStats:
+    if not court_stats:
+        return CourtStats(players_df=empty_df(indices=player_game_format_indices,
+                                              dtypes={c: 'int32' for c in court_stats_columns}),
+                          lineups_df=empty_df(indices=lineup_indices,
+                                              dtypes={'Players': 'int32', **{c: 'int32' for c in court_stats_columns},
+                                                      'Starting': 'bool'}))
+    return CourtStats(players_df=pd.concat([s.players_df for s in court_stats]),
+                      lineups_df=pd.concat([s.lineups_df for s in court_stats]))
@@ -1,12 +1,16 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
 from typing import Sequence
 
 import numpy as np
 import pandas as pd
 
-from . import pf
+from . import lf, pf, depends_on
 from ..data.access import DataAccess
-from ..data.processed import player_game_format_indices
-from ..utils import memoize
+from ..data.processed import compact_schema, empty_df, player_game_format_indices
+from .lineups import court_stats
+from ..utils import memoize, pool_context
 
 # assist - an assist was credited on a made shot
 # block - a blocked shot was recorded
@@ -26,54 +30,121 @@ scoring_event_types = ['made1', 'made2', 'made3', 'miss1', 'miss2', 'miss3']
 offensive_event_types = ['assist', 'turnover', 'fouled']
 defensive_event_types = ['block', 'steal', 'reb', 'foul']
 
-seasons = list(range(2015, 2020))
+player_game_info_columns = ['WFinalScore', 'LFinalScore', 'EventTeamID']
+player_events_columns = [*player_game_format_indices, *player_game_info_columns, 'EventType', 'EventSubType']
 
 
 @pf.register
+@depends_on('player_event_counts_df')
 def player_game_info(access: DataAccess):
-    p_info_df = None
-    for season in seasons:
-        events_df = player_events_df(access=access, season=season)
-        season_p_info_df = events_df[player_game_format_indices + ['WFinalScore', 'LFinalScore', 'EventTeamID']] \
-            .groupby(player_game_format_indices).first()
-        p_info_df = season_p_info_df if p_info_df is None else p_info_df.append(season_p_info_df)
-    return p_info_df
+    return player_event_counts_df(access=access)[player_game_info_columns]
 
 
 @pf.register
+@depends_on('player_event_counts_df')
 def player_scoring_stats_df(access: DataAccess) -> pd.DataFrame:
     return player_stats_df(*scoring_event_types, access=access)
 
 
 @pf.register
+@depends_on('player_event_counts_df')
 def player_offensive_stats_df(access: DataAccess) -> pd.DataFrame:
     return player_stats_df(*offensive_event_types, access=access)
 
 
 @pf.register
+@depends_on('player_event_counts_df')
 def player_defensive_stats_df(access: DataAccess) -> pd.DataFrame:
     return player_stats_df(*defensive_event_types, access=access)
 
 
-@memoize
-def player_events_df(access: DataAccess, season: int) -> pd.DataFrame:
-    events_df = access.events_df(season=season)
-    pe_df = events_df[events_df.EventPlayerID.ne(0)]
-    return pe_df
+@pf.register
+@depends_on('court_stats')
+def player_court_stats_df(access: DataAccess) -> pd.DataFrame:
+    return court_stats(access=access).players_df
+
+
+@lf.register
+@depends_on('court_stats')
+def lineup_court_stats_df(access: DataAccess) -> pd.DataFrame:
+    return court_stats(access=access).lineups_df
 
 
 def player_stats_df(*event_types: Sequence[str], access: DataAccess) -> pd.DataFrame:
+    counts_df = player_event_counts_df(access=access)
+    return counts_df[sorted({*event_types} & {*counts_df.columns})]
+
+
+@memoize
+def player_event_counts_df(access: DataAccess, subtypes: bool = False) -> pd.DataFrame:
+    """
+    Game info and the count of every EventType for each player game, optionally also of every
+    EventType_EventSubType pair, built in one pass over each of the access's event seasons.
+    Seasons are independent and are processed on a pool of worker processes, each counting its season
+    chunk by chunk.
+    """
+    seasons = access.events_seasons()
+    with ProcessPoolExecutor(max_workers=max(1, min(len(seasons), os.cpu_count() or 1)),
+                             mp_context=pool_context) as executor:
+        season_counts_dfs = list(executor.map(_season_player_event_counts_df,
+                                              itertools.repeat(access), seasons, itertools.repeat(subtypes)))
+    if not season_counts_dfs:
+        return _empty_counts_df()
+    return pd.concat(season_counts_dfs).fillna(0)
+
+
+def _season_player_event_counts_df(access: DataAccess, season: int, subtypes: bool) -> pd.DataFrame:
+    # Chunks hold whole games, so each player game is counted in exactly one of them and memory stays bounded by
+    # the chunk size rather than by the season.
+    chunk_counts_dfs = [_compact_counts_df(_player_event_counts_df(pe_df=pe_df, subtypes=subtypes))
+                        for pe_df in access.events_game_chunks(season=season, columns=player_events_columns,
+                                                               player_only=True)]
+    if not chunk_counts_dfs:
+        return _empty_counts_df()
+    counts_df = pd.concat(chunk_counts_dfs).fillna(0).sort_index()
+    # EventTypes first, then EventType_EventSubType pairs, each in order, whichever chunks they were seen in.
+    count_columns = sorted((c for c in counts_df.columns if c not in player_game_info_columns),
+                           key=lambda c: ('_' in c, c))
+    return _compact_counts_df(counts_df[player_game_info_columns + count_columns])
+
+
+def _compact_counts_df(counts_df: pd.DataFrame) -> pd.DataFrame:
+    # Counts are kept compactly to keep partial counts and what crosses the process boundary small.
+    return counts_df.astype({c: 'int32' for c in counts_df.columns if c not in player_game_info_columns})
+
+
+def _empty_counts_df() -> pd.DataFrame:
+    return empty_df(indices=player_game_format_indices,
+                    dtypes={c: compact_schema[c] for c in player_game_info_columns})
+
+
+def _player_event_counts_df(pe_df: pd.DataFrame, subtypes: bool) -> pd.DataFrame:
     # EventID, Season, DayNum, WTeamID, LTeamID, WFinalScore, LFinalScore, WCurrentScore, LCurrentScore,
     # ElapsedSeconds, EventTeamID, EventPlayerID, EventType, EventSubType, X, Y, Area
-    p_stats_df = None
-    for season in seasons:
-        pe_df = player_events_df(access=access, season=season)
-        filtered_df = pe_df[pe_df.EventType.isin({*event_types})]
-        season_p_stats_df = filtered_df.pivot_table(index=player_game_format_indices,
-                                                    columns='EventType',
-                                                    values='EventID',
-                                                    aggfunc=np.count_nonzero).fillna(0)
-        p_stats_df = season_p_stats_df \
-            if p_stats_df is None \
-            else p_stats_df.append(season_p_stats_df)
-    return p_stats_df
+    grouped = pe_df.groupby(player_game_format_indices, sort=True)
+    counts_df = grouped[player_game_info_columns].first()
+    player_game = grouped.ngroup().to_numpy()
+
+    event_type = pe_df.EventType.astype('category')
+    counts_df = counts_df.join(_code_counts_df(player_game=player_game, n_player_games=len(counts_df),
+                                               codes=event_type.cat.codes.to_numpy(),
+                                               labels=event_type.cat.categories.tolist(),
+                                               index=counts_df.index))
+    if subtypes:
+        event_subtype = pe_df.EventSubType.astype('category')
+        n_subtypes = len(event_subtype.cat.categories)
+        codes = np.where(event_subtype.cat.codes.to_numpy() < 0, -1,
+                         event_type.cat.codes.to_numpy() * n_subtypes + event_subtype.cat.codes.to_numpy())
+        labels = [f'{t}_{st}' for t in event_type.cat.categories for st in event_subtype.cat.categories]
+        counts_df = counts_df.join(_code_counts_df(player_game=player_game, n_player_games=len(counts_df),
+                                                   codes=codes, labels=labels, index=counts_df.index))
+    return counts_df
+
+
+def _code_counts_df(player_game: np.ndarray, n_player_games: int, codes: np.ndarray, labels: Sequence[str],
+                    index: pd.Index) -> pd.DataFrame:
+    known = codes >= 0
+    counts = np.bincount(player_game[known] * len(labels) + codes[known], minlength=n_player_games * len(labels)) \
+        .reshape(n_player_games, len(labels))
+    observed = counts.any(axis=0)
+    return pd.DataFrame(counts[:, observed], index=index, columns=np.array(labels, dtype=object)[observed])
@@ -1,50 +1,174 @@
-from . import tpf
-from ..data.access import DataAccess, player_features_df
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from . import tpf, depends_on
+from ..data.access import DataAccess
+from ..data.store import lineup_features_df, player_features_df
 import pandas as pd
-from ..data.processed import to_team_format, game_format_indices
+from ..data.processed import TeamFormatView, game_format_indices
+from ..utils import memoize
 import numpy as np
 
 
-@tpf.register
-def assist_entropy(access: DataAccess) -> pd.Series:
-    pf_df = player_features_df(prefix=access.prefix).reset_index()
+class Concentration(NamedTuple):
+    """
+    How one stat is shared among a team's players in a game, as the <name>Entropy, <name>Gini and <name>HHI
+    team player features.
+    """
+    name: str
+    # Player feature columns and their weights, summed into the stat.
+    weights: Tuple[Tuple[str, int], ...]
+    # Game columns of the winning and losing teams' totals, when shares are of those rather than of the players'
+    # sum.
+    totals: Optional[Tuple[str, str]] = None
+
+
+# A new concentration is one more entry here: every entry is computed in the same pass over the player games.
+concentrations = (
+    Concentration(name='Assist', weights=(('assist', 1),)),
+    Concentration(name='Scoring', weights=(('made1', 1), ('made2', 2), ('made3', 3)),
+                  totals=('WFinalScore', 'LFinalScore')),
+    Concentration(name='Rebound', weights=(('reb', 1),)),
+    Concentration(name='Steal', weights=(('steal', 1),)),
+    Concentration(name='Minutes', weights=(('Seconds', 1),)),
+)  # type: Tuple[Concentration, ...]
+concentration_measures = ('Entropy', 'Gini', 'HHI')
+
 
-    w_total_assists = pf_df[pf_df.EventTeamID == pf_df.WTeamID].groupby(game_format_indices) \
-        .assist.sum().rename('WTotalAssist')
-    l_total_assists = pf_df[pf_df.EventTeamID == pf_df.LTeamID].groupby(game_format_indices) \
-        .assist.sum().rename('LTotalAssist')
+# The store readers are memoized themselves, so these only give them names to depend on.
+def persisted_player_features_df(access: DataAccess) -> pd.DataFrame:
+    return player_features_df(prefix=access.prefix)
 
-    pf_df = pf_df.merge(w_total_assists, on=game_format_indices, how='outer')
-    pf_df = pf_df.merge(l_total_assists, on=game_format_indices, how='outer')
 
-    pf_df['WAssistFraction'] = np.where(pf_df.EventTeamID == pf_df.WTeamID, pf_df.assist / pf_df.WTotalAssist, 0)
-    pf_df['LAssistFraction'] = np.where(pf_df.EventTeamID == pf_df.LTeamID, pf_df.assist / pf_df.LTotalAssist, 0)
+def persisted_lineup_features_df(access: DataAccess) -> pd.DataFrame:
+    return lineup_features_df(prefix=access.prefix)
 
-    pf_df['WAssistEntropyContribution'] = -pf_df.WAssistFraction * np.log(pf_df.WAssistFraction)
-    pf_df['LAssistEntropyContribution'] = -pf_df.LAssistFraction * np.log(pf_df.LAssistFraction)
 
-    w_assist_entropy = pf_df.groupby(game_format_indices).WAssistEntropyContribution.sum().rename('WAssistEntropy')
-    l_assist_entropy = pf_df.groupby(game_format_indices).LAssistEntropyContribution.sum().rename('LAssistEntropy')
+@memoize
+@depends_on('persisted_player_features_df')
+def player_concentrations_df(access: DataAccess) -> pd.DataFrame:
+    return concentrations_df(pf_df=persisted_player_features_df(access), concentrations=concentrations)
 
-    assist_entropy_game_format_df = pd.concat([w_assist_entropy, l_assist_entropy], axis=1)
-    assist_entropy_df = to_team_format(game_formatted_df=assist_entropy_game_format_df)
-    return assist_entropy_df.AssistEntropy
+
+@tpf.register
+@depends_on('player_concentrations_df')
+def assist_entropy(access: DataAccess) -> pd.Series:
+    return TeamFormatView(game_formatted_df=player_concentrations_df(access))['AssistEntropy']
 
 
 @tpf.register
+@depends_on('player_concentrations_df')
 def scoring_entropy(access: DataAccess) -> pd.Series:
-    pf_df = player_features_df(prefix=access.prefix).reset_index()
-    pf_df['Score'] = pf_df.made3 * 3 + pf_df.made2 * 2 + pf_df.made1
+    return TeamFormatView(game_formatted_df=player_concentrations_df(access))['ScoringEntropy']
+
+
+@tpf.register
+@depends_on('player_concentrations_df')
+def player_concentration(access: DataAccess) -> pd.DataFrame:
+    """
+    Every other measure of every concentration; AssistEntropy and ScoringEntropy are features of their own.
+    """
+    columns = [f'{c.name}{measure}' for c in concentrations for measure in concentration_measures
+               if f'{c.name}{measure}' not in ('AssistEntropy', 'ScoringEntropy')]
+    return TeamFormatView(game_formatted_df=player_concentrations_df(access)).to_frame(columns=columns)
+
+
+@tpf.register
+@depends_on('persisted_lineup_features_df')
+def lineup_stats(access: DataAccess) -> pd.DataFrame:
+    """
+    A team's possessions in a game, the five player lineups it used, the shares of the game's seconds played by
+    its most used lineup and by its starting lineup, and the starting lineup's plus-minus.
+    """
+    lineups_df = persisted_lineup_features_df(access).reset_index()
+    five = lineups_df.Players.to_numpy() == 5
+    starting = lineups_df.Starting.to_numpy()
+    lineups_df = lineups_df.assign(Side=np.where(lineups_df.TeamID == lineups_df.WTeamID, 'W', 'L'), Five=five,
+                                   FiveSeconds=np.where(five, lineups_df.Seconds, 0),
+                                   StartingSeconds=np.where(starting, lineups_df.Seconds, 0),
+                                   StartingPlusMinus=np.where(starting, lineups_df.PlusMinus, 0))
+    teams_df = lineups_df.groupby([*game_format_indices, 'Side']) \
+        .agg(Possessions=('Possessions', 'sum'), Seconds=('Seconds', 'sum'), Lineups=('Five', 'sum'),
+             TopLineupSeconds=('FiveSeconds', 'max'), StartingSeconds=('StartingSeconds', 'sum'),
+             StartingLineupPlusMinus=('StartingPlusMinus', 'sum'))
+    seconds = teams_df.Seconds.where(teams_df.Seconds > 0)
+    teams_df['TopLineupShare'] = (teams_df.TopLineupSeconds / seconds).fillna(0)
+    teams_df['StartingLineupShare'] = (teams_df.StartingSeconds / seconds).fillna(0)
+
+    columns = ['Possessions', 'Lineups', 'TopLineupShare', 'StartingLineupShare', 'StartingLineupPlusMinus']
+    game_df = teams_df[columns].unstack('Side').reindex(columns=pd.MultiIndex.from_product([columns, ['W', 'L']]))
+    game_df.columns = [f'{side}{column}' for column, side in game_df.columns]
+    return TeamFormatView(game_formatted_df=game_df).to_frame(columns=columns)
+
+
+def concentrations_df(pf_df: pd.DataFrame, concentrations: Sequence[Concentration]) -> pd.DataFrame:
+    """
+    The Entropy, Gini and HHI of each concentration's stat over each team's players in each game, from player
+    features indexed by player_game_format_indices, in game format: W<name><measure> and L<name><measure> columns
+    indexed by game_format_indices. Player games are grouped once, by integer game and side codes, and every
+    stat is a column of one matrix.
+
+    A player's share is their stat over the team total. Entropy is -sum(share * ln(share)) over nonzero shares,
+    HHI the sum of squared shares, and Gini the Gini coefficient of the stat over the team's players in the game.
+    Every measure is 0 for a team whose total is 0. Raises a KeyError naming any weight or total column that
+    pf_df lacks.
+    """
+    games = pf_df.index.droplevel('EventPlayerID')
+    game_keys = np.zeros(len(pf_df), dtype=np.int64)
+    for name, limit in zip(game_format_indices, _game_key_limits):
+        game_keys = game_keys * limit + games.get_level_values(name).to_numpy(dtype=np.int64)
+    _, first_rows, game = np.unique(game_keys, return_index=True, return_inverse=True)
+    n_games = len(first_rows)
+
+    team_id = pf_df.EventTeamID.to_numpy()
+    winning = team_id == games.get_level_values('WTeamID').to_numpy()
+    losing = team_id == games.get_level_values('LTeamID').to_numpy()
+    # Players of neither team count towards no group.
+    on_team = winning | losing
+    group = (2 * game + losing)[on_team]
+    n_groups = 2 * n_games
+
+    columns = {column for c in concentrations for column, _ in c.weights} \
+        | {column for c in concentrations for column in c.totals or ()}
+    missing = sorted(columns - {*pf_df.columns})
+    if missing:
+        raise KeyError(f'Player features lack the concentration columns {missing}.')
+
+    stats = np.zeros((len(pf_df), len(concentrations)))
+    for k, c in enumerate(concentrations):
+        for column, weight in c.weights:
+            stats[:, k] += weight * pf_df[column].to_numpy()
+    stats = stats[on_team]
+
+    players = np.bincount(group, minlength=n_groups)
+    measures = {}
+    for k, c in enumerate(concentrations):
+        x = stats[:, k]
+        player_total = np.bincount(group, weights=x, minlength=n_groups)
+        if c.totals is None:
+            total = player_total[group]
+        else:
+            total = np.where(winning, pf_df[c.totals[0]].to_numpy(), pf_df[c.totals[1]].to_numpy())[on_team]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(total > 0, x / total, 0)
+            entropy_terms = np.where(share > 0, -share * np.log(share), 0)
+
+        # Gini from each player's rank within the team, ascending: 2 * sum(rank * x) / (n * sum(x)) - (n + 1) / n.
+        order = np.lexsort((x, group))
+        group_starts = np.cumsum(players) - players
+        rank = np.empty(len(x))
+        rank[order] = np.arange(1, len(x) + 1) - group_starts[group[order]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gini = 2 * np.bincount(group, weights=rank * x, minlength=n_groups) / (players * player_total) \
+                - (players + 1) / players
 
-    pf_df['WScoreFraction'] = np.where(pf_df.EventTeamID == pf_df.WTeamID, pf_df.Score / pf_df.WFinalScore, 0)
-    pf_df['LScoreFraction'] = np.where(pf_df.EventTeamID == pf_df.LTeamID, pf_df.Score / pf_df.LFinalScore, 0)
+        measures[f'{c.name}Entropy'] = np.bincount(group, weights=entropy_terms, minlength=n_groups)
+        measures[f'{c.name}Gini'] = np.where(player_total > 0, gini, 0)
+        measures[f'{c.name}HHI'] = np.bincount(group, weights=share ** 2, minlength=n_groups)
 
-    pf_df['WScoreEntropyContribution'] = -pf_df.WScoreFraction * np.log(pf_df.WScoreFraction)
-    pf_df['LScoreEntropyContribution'] = -pf_df.LScoreFraction * np.log(pf_df.LScoreFraction)
+    index = games[first_rows]
+    return pd.DataFrame({f'{side}{name}': values[offset::2] for name, values in measures.items()
+                         for side, offset in (('W', 0), ('L', 1))}, index=index)
 
-    w_scoring_entropy = pf_df.groupby(game_format_indices).WScoreEntropyContribution.sum().rename('WScoringEntropy')
-    l_scoring_entropy = pf_df.groupby(game_format_indices).LScoreEntropyContribution.sum().rename('LScoringEntropy')
 
-    scoring_entropy_game_format_df = pd.concat([w_scoring_entropy, l_scoring_entropy], axis=1)
-    scoring_entropy_df = to_team_format(game_formatted_df=scoring_entropy_game_format_df)
-    return scoring_entropy_df.ScoringEntropy
+# Ranges of the game_format_indices levels, so a game packs into one int64 key that sorts as they do.
+_game_key_limits = (10 ** 4, 10 ** 3, 10 ** 4, 10 ** 4)
@@ -0,0 +1,97 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# DayNum never reaches this, so Season * _days_per_season + DayNum orders a team's games in time.
+_days_per_season = 1000
+end_of_season = _days_per_season - 1
+
+
+class AsOfIndex():
+    """
+    A point in time index over team formatted features. Rows are sorted once into per team timelines held as a
+    single contiguous float array, and a lookup of (Season, DayNum, TeamID) arrays binary searches those
+    timelines for each team's most recent feature vector before, or as of, that day.
+    """
+
+    def __init__(self, team_features_df: pd.DataFrame, columns: Optional[Sequence[str]] = None):
+        tf_df = team_features_df.reset_index()
+        self.columns = [c for c in (team_features_df.columns if columns is None else columns)
+                        if pd.api.types.is_numeric_dtype(tf_df[c]) or pd.api.types.is_bool_dtype(tf_df[c])]
+
+        self.team_ids, team = np.unique(tf_df.TeamID.to_numpy(), return_inverse=True)
+        time = _time(season=tf_df.Season.to_numpy(), day_num=tf_df.DayNum.to_numpy())
+
+        order = np.lexsort((time, team))
+        self._keys = _key(team=team[order], time=time[order])
+        self._team = team[order]
+        self._season = tf_df.Season.to_numpy()[order]
+        self._day_num = tf_df.DayNum.to_numpy()[order]
+        self._other_team_id = tf_df.OtherTeamID.to_numpy()[order]
+        self._values = np.ascontiguousarray(tf_df[self.columns].to_numpy(dtype=float)[order])
+
+    def positions(self, season: np.ndarray, day_num: np.ndarray, team_id: np.ndarray, strict: bool = True,
+                  same_season: bool = False) -> np.ndarray:
+        """
+        The timeline row of each team's latest game strictly before (or, unless strict, on) the given day,
+        -1 where there is none. With same_season, games of earlier seasons do not count.
+        """
+        season, day_num, team_id = np.asarray(season), np.asarray(day_num), np.asarray(team_id)
+        team = np.searchsorted(self.team_ids, team_id)
+        known = (team < len(self.team_ids)) & (self.team_ids[np.minimum(team, len(self.team_ids) - 1)] == team_id)
+        team = np.where(known, team, -1)
+
+        position = np.searchsorted(self._keys, _key(team=team, time=_time(season=season, day_num=day_num)),
+                                   side='left' if strict else 'right') - 1
+        found = known & (position >= 0)
+        found[found] &= self._team[position[found]] == team[found]
+        if same_season:
+            found[found] &= self._season[position[found]] == season[found]
+        return np.where(found, position, -1)
+
+    def lookup(self, season: np.ndarray, day_num: np.ndarray, team_id: np.ndarray, strict: bool = True,
+               same_season: bool = False, columns: Optional[Sequence[str]] = None) -> np.ndarray:
+        """
+        Feature vectors, one row per query in the order of columns (all of self.columns by default), NaN where
+        the team has no earlier game.
+        """
+        position = self.positions(season=season, day_num=day_num, team_id=team_id, strict=strict,
+                                  same_season=same_season)
+        values = self._values[np.maximum(position, 0)]
+        if columns is not None:
+            values = values[:, [self.columns.index(c) for c in columns]]
+        values[position < 0] = np.nan
+        return values
+
+    def lookup_df(self, season: np.ndarray, day_num: np.ndarray, team_id: np.ndarray, strict: bool = True,
+                  same_season: bool = False, columns: Optional[Sequence[str]] = None, prefix: str = '',
+                  index: Optional[pd.Index] = None) -> pd.DataFrame:
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame(self.lookup(season=season, day_num=day_num, team_id=team_id, strict=strict,
+                                        same_season=same_season, columns=columns),
+                            columns=[f'{prefix}{c}' for c in columns], index=index)
+
+    def snapshot_df(self, season: int, day_num: int = end_of_season, strict: bool = True) -> pd.DataFrame:
+        """
+        Every team's latest features of the season as of the given day (its last game by default), indexed by
+        TeamID, with the DayNum and OtherTeamID of the game they come from.
+        """
+        team_ids = self.team_ids
+        position = self.positions(season=np.full(len(team_ids), season), day_num=np.full(len(team_ids), day_num),
+                                  team_id=team_ids, strict=strict, same_season=True)
+        found = position >= 0
+        snapshot_df = pd.DataFrame(self._values[position[found]], columns=self.columns,
+                                   index=pd.Index(team_ids[found], name='TeamID'))
+        snapshot_df.insert(0, 'DayNum', self._day_num[position[found]])
+        snapshot_df.insert(1, 'OtherTeamID', self._other_team_id[position[found]])
+        return snapshot_df
+
+
+def _time(season: np.ndarray, day_num: np.ndarray) -> np.ndarray:
+    return season.astype(np.int64) * _days_per_season + day_num
+
+
+def _key(team: np.ndarray, time: np.ndarray) -> np.ndarray:
+    # Unknown teams (-1) sort before every timeline and are never matched.
+    return team.astype(np.int64) * (_days_per_season * 10 ** 4) + time
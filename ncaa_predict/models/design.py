@@ -0,0 +1,166 @@
+import hashlib
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .as_of import AsOfIndex
+from ..data.matchup_keys import season_team_positions
+from ..data.store import team_features_df, team_player_features
+from ..utils import memoize
+
+
+class MatchupFeatureSet(NamedTuple):
+    # Team features left out of a matchup entirely.
+    excluded: Tuple[str, ...] = ('Win', 'Tourney', 'RestDaysMax7')
+    # Team features entered as the difference p_<c>Adv = p_<c> - po_<c> only.
+    advantages: Tuple[str, ...] = ('Elo',)
+    # Features of the game itself, which a tourney matchup sets to zero (a neutral site).
+    game: Tuple[str, ...] = ('HomeAdvantage',)
+
+
+class MatchupDesign():
+    """
+    The design matrices of the matchup predictors for one table of team features and one feature set. Training
+    games are taken once each, with TeamID < OtherTeamID, from each team's features as of its previous game;
+    tourney matchups from each team's features as of its last regular season game. Both are built once, then
+    held as contiguous float32 arrays whose columns follow feature_names.
+    """
+
+    def __init__(self, team_features_df: pd.DataFrame, feature_set: MatchupFeatureSet = MatchupFeatureSet()):
+        self.team_features_df = team_features_df
+        self.feature_set = feature_set
+        self.team_columns = [c for c in team_features_df.columns if c not in feature_set.excluded]
+        self.feature_names = sorted([*feature_set.game,
+                                     *(f'p_{c}Adv' for c in self.team_columns if c in feature_set.advantages),
+                                     *(f'{side}_{c}' for side in ('p', 'po') for c in self.team_columns
+                                       if c not in feature_set.advantages)])
+        self.team_map, self.other_team_map = matchup_maps(feature_names=self.feature_names,
+                                                          columns=self.team_columns)
+        # The digest of the last tourney games table and its design matrix. Predictors sharing the design ask for
+        # the same table in turn, and keeping only the last bounds what a long-lived design holds.
+        self._last_matchup_x = None  # type: Optional[Tuple[str, np.ndarray]]
+
+    @property
+    def training(self) -> Tuple[np.ndarray, np.ndarray, pd.MultiIndex]:
+        if not hasattr(self, '_training'):
+            x, y = training_data_df(team_features_df=self.team_features_df)
+            once = x.index.get_level_values('TeamID') < x.index.get_level_values('OtherTeamID')
+            x, y = x[once], y[once]
+            x = x.assign(**{f'p_{c}Adv': x[f'p_{c}'] - x[f'po_{c}'] for c in self.team_columns
+                              if c in self.feature_set.advantages})
+            self._training = (np.ascontiguousarray(x[self.feature_names].to_numpy(dtype=np.float32)),
+                              y.to_numpy(dtype=bool), x.index)
+        return self._training
+
+    def training_rows(self, first_season: Optional[int] = None,
+                      last_season: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The training matrix and outcomes of the games from first_season through last_season, all by default.
+        """
+        x, y, index = self.training
+        if first_season is None and last_season is None:
+            return x, y
+        seasons = index.get_level_values('Season').to_numpy()
+        rows = ((seasons >= first_season) if first_season is not None else True) \
+            & ((seasons <= last_season) if last_season is not None else True)
+        return x[rows], y[rows]
+
+    @property
+    def training_x(self) -> np.ndarray:
+        return self.training[0]
+
+    @property
+    def training_y(self) -> np.ndarray:
+        return self.training[1]
+
+    @property
+    def end_of_regular_season_df(self) -> pd.DataFrame:
+        """
+        The team_columns of each team as of its last regular season game, indexed by TeamID and Season.
+        """
+        if not hasattr(self, '_end_of_regular_season_df'):
+            self._end_of_regular_season_df = end_of_regular_season_df(
+                team_features_df=self.team_features_df)[self.team_columns]
+        return self._end_of_regular_season_df
+
+    def matchup_x(self, tourney_games_df: pd.DataFrame) -> np.ndarray:
+        """
+        The design matrix of tourney matchups (Season, TeamID and OtherTeamID columns), in their order.
+        Teams without regular season features get NaN rows.
+        """
+        games = tourney_games_df[['Season', 'TeamID', 'OtherTeamID']].to_numpy(dtype=np.int64)
+        digest = hashlib.sha1(games.tobytes()).hexdigest()
+        if self._last_matchup_x is None or self._last_matchup_x[0] != digest:
+            table = self.end_of_regular_season_df
+            features = table.to_numpy(dtype=np.float32)
+            team = season_team_positions(index=table.index, season=games[:, 0], team_id=games[:, 1])
+            other_team = season_team_positions(index=table.index, season=games[:, 0], team_id=games[:, 2])
+            team_features = np.where((team >= 0)[:, np.newaxis], features[team], np.nan)
+            other_team_features = np.where((other_team >= 0)[:, np.newaxis], features[other_team], np.nan)
+            self._last_matchup_x = (digest, np.ascontiguousarray(
+                (team_features @ self.team_map + other_team_features @ self.other_team_map).astype(np.float32)))
+        return self._last_matchup_x[1]
+
+
+@memoize
+def matchup_design(prefix: str, feature_set: MatchupFeatureSet = MatchupFeatureSet()) -> MatchupDesign:
+    """
+    The design of the persisted team and team player features of a dataset.
+    """
+    tf_df = team_features_df(prefix=prefix).join(team_player_features(prefix=prefix), how='inner')
+    return MatchupDesign(team_features_df=tf_df, feature_set=feature_set)
+
+
+def matchup_maps(feature_names: Sequence[str], columns: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Linear maps from one team's features (columns) to the matchup features, as the team (p_) and as the
+    other team (po_). p_<c>Adv is p_<c> - po_<c>; game features, such as HomeAdvantage, map to zero.
+    """
+    columns = list(columns)  # type: List[str]
+    team_map = np.zeros((len(columns), len(feature_names)), dtype=np.float32)
+    other_team_map = np.zeros((len(columns), len(feature_names)), dtype=np.float32)
+    for feature, name in enumerate(feature_names):
+        if name.startswith('p_') and name.endswith('Adv') and name[2:-3] in columns:
+            team_map[columns.index(name[2:-3]), feature] = 1
+            other_team_map[columns.index(name[2:-3]), feature] = -1
+        elif name.startswith('po_') and name[3:] in columns:
+            other_team_map[columns.index(name[3:]), feature] = 1
+        elif name.startswith('p_') and name[2:] in columns:
+            team_map[columns.index(name[2:]), feature] = 1
+        elif name.startswith('p_') or name.startswith('po_'):
+            raise ValueError(f'Matchup feature {name} is not built from the team features {columns}.')
+    return team_map, other_team_map
+
+
+def training_data_df(team_features_df: pd.DataFrame,
+                     as_of: Optional[AsOfIndex] = None) -> Tuple[pd.DataFrame, pd.Series]:
+    as_of = AsOfIndex(team_features_df) if as_of is None else as_of
+
+    tf_df = team_features_df[['Win', 'HomeAdvantage', 'Tourney', 'RestDaysMax7']].reset_index()
+    season, day_num = tf_df.Season.to_numpy(), tf_df.DayNum.to_numpy()
+    team_id, other_team_id = tf_df.TeamID.to_numpy(), tf_df.OtherTeamID.to_numpy()
+
+    # The other team's rest going into this game, then each team's features as of its previous game.
+    tf_df['OtherRestDaysMax7'] = as_of.lookup(season=season, day_num=day_num, team_id=other_team_id, strict=False,
+                                              columns=['RestDaysMax7'])[:, 0]
+    p_attributes_df = as_of.lookup_df(season=season, day_num=day_num, team_id=team_id, prefix='p_')
+    po_attributes_df = as_of.lookup_df(season=season, day_num=day_num, team_id=other_team_id, prefix='po_')
+
+    data_df = pd.concat([tf_df, p_attributes_df, po_attributes_df], axis=1)
+    data_df.set_index(['Season', 'DayNum', 'TeamID', 'OtherTeamID'], inplace=True)
+    data_df.sort_index(inplace=True)
+    data_df.dropna(inplace=True)
+
+    return data_df.drop(columns='Win'), data_df.Win
+
+
+def end_of_regular_season_df(team_features_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Each team's features as of its last regular season game, indexed by TeamID and Season.
+    """
+    regular_season_df = team_features_df[~team_features_df.Tourney]
+    as_of = AsOfIndex(regular_season_df)
+    return pd.concat({season: as_of.snapshot_df(season=season, strict=False)
+                      for season in regular_season_df.index.unique(level='Season')}, names=['Season']) \
+        .swaplevel().sort_index()
@@ -0,0 +1,99 @@
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+
+from .design import MatchupDesign
+from ..data.matchup_keys import decode_season_team_keys, season_team_keys, team_id_limit
+
+_activations = {
+    'identity': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0),
+    'tanh': np.tanh,
+    'logistic': expit,
+}  # type: Dict[str, Callable[[np.ndarray], np.ndarray]]
+
+
+class FrozenPredictor():
+    """
+    A trained predictor reduced to arrays for serving single matchups. The first (or only) layer of each model is
+    linear in the features of the two teams, so every (Season, TeamID) carries its precomputed contribution as
+    the team and as the other team. A query gathers two rows, adds them to the intercept and applies whatever
+    layers remain, ending in a logistic.
+    """
+
+    def __init__(self, seasons: np.ndarray, team_ids: np.ndarray, team_table: np.ndarray,
+                 other_team_table: np.ndarray, intercept: np.ndarray,
+                 layers: Sequence[Tuple[np.ndarray, np.ndarray]] = (), activation: str = 'relu'):
+        keys = season_team_keys(season=seasons, team_id=team_ids)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.seasons, self.team_ids = np.asarray(seasons)[order], np.asarray(team_ids)[order]
+        self.team_table = np.ascontiguousarray(np.asarray(team_table, dtype=float)[order])
+        self.other_team_table = np.ascontiguousarray(np.asarray(other_team_table, dtype=float)[order])
+        self.intercept = np.asarray(intercept, dtype=float)
+        self.layers = [(np.asarray(weights, dtype=float), np.asarray(biases, dtype=float))
+                       for weights, biases in layers]
+        self.activation = _activations[activation]
+        self._positions = {key: position for position, key in enumerate(self.keys.tolist())}
+
+    def positions(self, season: np.ndarray, team_id: np.ndarray) -> np.ndarray:
+        keys = season_team_keys(season=season, team_id=team_id)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        unknown = self.keys[positions] != keys
+        if unknown.any():
+            unknown_season, unknown_team_id = decode_season_team_keys(keys[unknown][0])
+            raise KeyError(f'No features for (Season, TeamID) ({unknown_season}, {unknown_team_id}).')
+        return positions
+
+    def probability(self, season: np.ndarray, team_id: np.ndarray, other_team_id: np.ndarray) -> np.ndarray:
+        """
+        P(TeamID beats OtherTeamID) for arrays of matchups.
+        """
+        z = self.team_table[self.positions(season=season, team_id=team_id)] \
+            + self.other_team_table[self.positions(season=season, team_id=other_team_id)] + self.intercept
+        return expit(self._head(z)[:, 0])
+
+    def probability_of(self, season: int, team_id: int, other_team_id: int) -> float:
+        """
+        P(team_id beats other_team_id) for a single matchup, keyed through a dict rather than a binary search.
+        """
+        try:
+            z = self.team_table[self._positions[season * team_id_limit + team_id]] \
+                + self.other_team_table[self._positions[season * team_id_limit + other_team_id]] + self.intercept
+        except KeyError:
+            raise KeyError(f'No features for Season {season} and one of TeamID {team_id}, {other_team_id}.')
+        return float(expit(self._head(z[np.newaxis, :])[0, 0]))
+
+    def _head(self, z: np.ndarray) -> np.ndarray:
+        for weights, biases in self.layers:
+            z = self.activation(z) @ weights + biases
+        return z
+
+
+def freeze_elo(ratings: pd.Series) -> FrozenPredictor:
+    """
+    1 / (1 + 10 ** ((other - elo) / 400)) is the logistic of ln(10) / 400 * (elo - other).
+    """
+    scale = np.log(10) / 400
+    elo = ratings.to_numpy()[:, np.newaxis]
+    return FrozenPredictor(seasons=ratings.index.get_level_values('Season').to_numpy(),
+                           team_ids=ratings.index.get_level_values('TeamID').to_numpy(),
+                           team_table=scale * elo, other_team_table=-scale * elo, intercept=np.zeros(1))
+
+
+def freeze_design(design: MatchupDesign, weights: np.ndarray, intercept: np.ndarray,
+                  layers: Sequence[Tuple[np.ndarray, np.ndarray]] = (), activation: str = 'relu') -> FrozenPredictor:
+    """
+    Freezes a model whose first layer maps the design's matchup features through weights of shape features by
+    outputs, using each team's end of regular season features.
+    """
+    table = design.end_of_regular_season_df
+    features = table.to_numpy(dtype=float)
+    return FrozenPredictor(seasons=table.index.get_level_values('Season').to_numpy(),
+                           team_ids=table.index.get_level_values('TeamID').to_numpy(),
+                           team_table=features @ (design.team_map @ weights),
+                           other_team_table=features @ (design.other_team_map @ weights),
+                           intercept=intercept, layers=layers, activation=activation)
+
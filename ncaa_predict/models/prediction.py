@@ -1,14 +1,29 @@
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Dict, Optional
 
+import numpy as np
 import pandas as pd
 from sklearn.linear_model import LogisticRegression
 from sklearn.neural_network import MLPClassifier
 
-tournament_game_index_labels = ['Season', 'TeamID', 'OtherTeamID']
+from .design import MatchupDesign, end_of_regular_season_df, training_data_df
+from .frozen import FrozenPredictor, freeze_elo, freeze_design
+from .probability_matrix import ProbabilityMatrix, tournament_game_index_labels
+from ..data.matchup_keys import season_team_positions
+from ..data.processed import matchups_df
+from ..tracing import traced
 
 
 class TournamentPredictor(ABC):
+    # Methods run in a span of their own, wherever a subclass defines them.
+    traced_methods = ('train', 'train_design', 'update_design', 'estimate_probability',
+                      'estimate_probability_matrices')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method_name in cls.traced_methods:
+            if method_name in vars(cls):
+                setattr(cls, method_name, traced('model', name=f'{cls.__name__}.{method_name}')(vars(cls)[method_name]))
 
     @abstractmethod
     def train(self, team_features_df: pd.DataFrame):
@@ -18,151 +33,125 @@ class TournamentPredictor(ABC):
     def estimate_probability(self, tourney_games_df: pd.DataFrame) -> pd.Series:
         pass
 
+    def estimate_probability_matrices(self, teams_df: pd.DataFrame) -> Dict[int, ProbabilityMatrix]:
+        """
+        A probability matrix per season over every pairing of the teams in teams_df (Season and TeamID columns).
+        """
+        return ProbabilityMatrix.from_series(self.estimate_probability(tourney_games_df=matchups_df(teams_df)))
 
-class EloTournamentPredictor(TournamentPredictor):
-
-    def train(self, team_features_df: pd.DataFrame):
-        self.end_of_regular_season_ratings = team_features_df[~team_features_df.Tourney] \
-            .reset_index().groupby(['Season', 'TeamID']).Elo.last()
-
-    def estimate_probability(self, tourney_games_df: pd.DataFrame) -> pd.Series:
-        team_elo = tourney_games_df.merge(self.end_of_regular_season_ratings,
-                                          on=['Season', 'TeamID'],
-                                          how='left').set_index(tournament_game_index_labels).Elo
+    @abstractmethod
+    def freeze(self) -> FrozenPredictor:
+        """
+        The trained predictor as lookup tables and weights, for serving single matchups.
+        """
+        pass
 
-        other_team_elo = tourney_games_df.merge(self.end_of_regular_season_ratings,
-                                                left_on=['Season', 'OtherTeamID'],
-                                                right_on=['Season', 'TeamID'],
-                                                how='left').set_index(tournament_game_index_labels).Elo
+    def train_design(self, design: MatchupDesign, last_season: Optional[int] = None):
+        """
+        Trains on a shared design, on the games up to and including last_season only if given. Predictors that
+        do not use its matrices train on its team features.
+        """
+        tf_df = design.team_features_df
+        if last_season is not None:
+            tf_df = tf_df[tf_df.index.get_level_values('Season') <= last_season]
+        self.train(team_features_df=tf_df)
 
-        win_probability = (1 / (1 + 10 ** ((other_team_elo - team_elo) / 400))).rename('Pred')
-        return win_probability
+    def update_design(self, design: MatchupDesign, season: int):
+        """
+        Brings a predictor trained through the season before up to date with the games of season. By default it
+        is retrained from scratch.
+        """
+        self.train_design(design=design, last_season=season)
 
 
-class LRTournamentPredictor(TournamentPredictor):
+class EloTournamentPredictor(TournamentPredictor):
 
     def train(self, team_features_df: pd.DataFrame):
-        self.last_games = team_features_df[~team_features_df.Tourney].reset_index().groupby(['TeamID', 'Season']).last()
-
-        x, y = training_data_df(team_features_df=team_features_df)
-
-        x['p_EloAdv'] = x.p_Elo - x.po_Elo
-        # x['RestDaysAdv'] = x.RestDaysMax7 - x.OtherRestDaysMax7
-
-        x.drop(columns=['p_Win', 'po_Win', 'p_Elo', 'po_Elo', 'p_RestDaysMax7', 'po_RestDaysMax7',
-                        'RestDaysMax7', 'OtherRestDaysMax7', 'Tourney', 'p_Tourney', 'po_Tourney'], inplace=True)
+        self.end_of_regular_season_ratings = end_of_regular_season_df(team_features_df=team_features_df).Elo
 
-        x = x.reindex(sorted(x.columns), axis=1)
-
-        x = x[x.index.get_level_values('TeamID') < x.index.get_level_values('OtherTeamID')]
-        y = y[y.index.get_level_values('TeamID') < y.index.get_level_values('OtherTeamID')]
-
-        self.lr = LogisticRegression(random_state=0, max_iter=1e6).fit(x, y)
+    def train_design(self, design: MatchupDesign, last_season: Optional[int] = None):
+        # Nothing is fitted: a season's estimates only read ratings as of the end of its own regular season.
+        self.train(team_features_df=design.team_features_df)
 
     def estimate_probability(self, tourney_games_df: pd.DataFrame) -> pd.Series:
-        team_last_features_df = tourney_games_df.merge(self.last_games.drop(columns='OtherTeamID'),
-                                                       on=['Season', 'TeamID'],
-                                                       how='left').set_index(tournament_game_index_labels)
-
-        other_team_last_features_df = tourney_games_df.merge(self.last_games.drop(columns='OtherTeamID'),
-                                                             left_on=['Season', 'OtherTeamID'],
-                                                             right_on=['Season', 'TeamID'],
-                                                             how='left').set_index(tournament_game_index_labels)
-
-        to_drop = ['DayNum', 'Tourney', 'Win', 'RestDaysMax7']
-        team_last_features_df = team_last_features_df.drop(columns=to_drop)
-        other_team_last_features_df = other_team_last_features_df.drop(columns=to_drop)
+        games = tourney_games_df[tournament_game_index_labels].to_numpy(dtype=np.int64)
+        ratings = self.end_of_regular_season_ratings
+        # Position -1, a team without a rating, reads the NaN on the end.
+        elo = np.append(ratings.to_numpy(dtype=float), np.nan)
+        team_elo = elo[season_team_positions(index=ratings.index, season=games[:, 0], team_id=games[:, 1])]
+        other_team_elo = elo[season_team_positions(index=ratings.index, season=games[:, 0], team_id=games[:, 2])]
+
+        win_probability = 1 / (1 + 10 ** ((other_team_elo - team_elo) / 400))
+        return pd.Series(index=pd.MultiIndex.from_frame(tourney_games_df[tournament_game_index_labels]),
+                         name='Pred', data=win_probability)
+
+    def estimate_probability_matrices(self, teams_df: pd.DataFrame) -> Dict[int, ProbabilityMatrix]:
+        matrices = {}
+        for season, season_teams_df in teams_df.groupby('Season'):
+            team_ids = np.unique(season_teams_df.TeamID.to_numpy())
+            elo = self.end_of_regular_season_ratings.reindex(
+                pd.MultiIndex.from_arrays([team_ids, np.full(len(team_ids), season)])).to_numpy()
+            i, j = np.triu_indices(len(team_ids), k=1)
+            matrices[season] = ProbabilityMatrix(season=season, team_ids=team_ids,
+                                                 upper=1 / (1 + 10 ** ((elo[j] - elo[i]) / 400)))
+        return matrices
+
+    def freeze(self) -> FrozenPredictor:
+        return freeze_elo(ratings=self.end_of_regular_season_ratings)
+
+
+class SklearnTournamentPredictor(TournamentPredictor):
+    """
+    Fits a scikit-learn classifier to a MatchupDesign, sharing the design's cached matrices with every other
+    predictor trained on it.
+    """
 
-        team_last_features_df.rename(columns=lambda c: f'p_{c}', inplace=True)
-        other_team_last_features_df.rename(columns=lambda c: f'po_{c}', inplace=True)
-
-        x = team_last_features_df.join(other_team_last_features_df)
-        x['HomeAdvantage'] = 0
-        x['p_EloAdv'] = x.p_Elo - x.po_Elo
-        x = x.drop(columns=['p_Elo', 'po_Elo'])
-        x = x.reindex(sorted(x.columns), axis=1)
-
-        p = self.lr.predict_proba(x)
-        return pd.Series(index=x.index, name='Pred', data=p[:, 1])
-
-
-class MLPTournamentPredictor(TournamentPredictor):
+    @abstractmethod
+    def classifier(self):
+        pass
 
     def train(self, team_features_df: pd.DataFrame):
-        self.last_games = team_features_df[~team_features_df.Tourney].reset_index().groupby(['TeamID', 'Season']).last()
-
-        x, y = training_data_df(team_features_df=team_features_df)
-
-        x['p_EloAdv'] = x.p_Elo - x.po_Elo
-        # x['RestDaysAdv'] = x.RestDaysMax7 - x.OtherRestDaysMax7
+        self.train_design(design=MatchupDesign(team_features_df=team_features_df))
 
-        x.drop(columns=['p_Win', 'po_Win', 'p_Elo', 'po_Elo', 'p_RestDaysMax7', 'po_RestDaysMax7',
-                        'RestDaysMax7', 'OtherRestDaysMax7', 'Tourney', 'p_Tourney', 'po_Tourney'], inplace=True)
-
-        x = x.reindex(sorted(x.columns), axis=1)
-
-        x = x[x.index.get_level_values('TeamID') < x.index.get_level_values('OtherTeamID')]
-        y = y[y.index.get_level_values('TeamID') < y.index.get_level_values('OtherTeamID')]
-
-        self.mlp = MLPClassifier(hidden_layer_sizes=(25, 25), max_iter=1000).fit(x, y)
+    def train_design(self, design: MatchupDesign, last_season: Optional[int] = None):
+        self.design = design
+        self.model = self.classifier().fit(*design.training_rows(last_season=last_season))
 
     def estimate_probability(self, tourney_games_df: pd.DataFrame) -> pd.Series:
-        team_last_features_df = tourney_games_df.merge(self.last_games.drop(columns='OtherTeamID'),
-                                                       on=['Season', 'TeamID'],
-                                                       how='left').set_index(tournament_game_index_labels)
-
-        other_team_last_features_df = tourney_games_df.merge(self.last_games.drop(columns='OtherTeamID'),
-                                                             left_on=['Season', 'OtherTeamID'],
-                                                             right_on=['Season', 'TeamID'],
-                                                             how='left').set_index(tournament_game_index_labels)
-
-        to_drop = ['DayNum', 'Tourney', 'Win', 'RestDaysMax7']
-        team_last_features_df = team_last_features_df.drop(columns=to_drop)
-        other_team_last_features_df = other_team_last_features_df.drop(columns=to_drop)
-
-        team_last_features_df.rename(columns=lambda c: f'p_{c}', inplace=True)
-        other_team_last_features_df.rename(columns=lambda c: f'po_{c}', inplace=True)
-
-        x = team_last_features_df.join(other_team_last_features_df)
-        x['HomeAdvantage'] = 0
-        x['p_EloAdv'] = x.p_Elo - x.po_Elo
-        x = x.drop(columns=['p_Elo', 'po_Elo'])
-        x = x.reindex(sorted(x.columns), axis=1)
+        p = self.model.predict_proba(self.design.matchup_x(tourney_games_df=tourney_games_df))
+        return pd.Series(index=pd.MultiIndex.from_frame(tourney_games_df[tournament_game_index_labels]),
+                         name='Pred', data=p[:, 1])
 
-        p = self.mlp.predict_proba(x)
-        return pd.Series(index=x.index, name='Pred', data=p[:, 1])
 
+class LRTournamentPredictor(SklearnTournamentPredictor):
 
-def training_data_df(team_features_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
-    tf_df = team_features_df.reset_index()
-    tf_df.set_index(['Season', 'DayNum', 'TeamID', 'OtherTeamID'], inplace=True)
-    tf_df.sort_index(inplace=True)
-    tf_df = tf_df[['Win', 'HomeAdvantage', 'Tourney', 'RestDaysMax7']]
+    def classifier(self):
+        return LogisticRegression(random_state=0, max_iter=1e6)
 
-    other_known_df = team_features_df.RestDaysMax7.rename('OtherRestDaysMax7').reset_index() \
-        .rename(columns=lambda x: 'OtherTeamID' if x == 'TeamID' else 'TeamID' if x == 'OtherTeamID' else x)
-    other_known_df.set_index(['Season', 'DayNum', 'TeamID', 'OtherTeamID'], inplace=True)
-    other_known_df.sort_index(inplace=True)
+    def update_design(self, design: MatchupDesign, season: int):
+        # The fit is still over every game through season, as an update on the new games alone would forget the
+        # earlier ones, but it starts from the previous coefficients and so converges in far fewer iterations.
+        self.design = design
+        self.model.set_params(warm_start=True).fit(*design.training_rows(last_season=season))
 
-    tf_df = tf_df.join(other_known_df)
-    tf_df.reset_index(inplace=True)
+    def freeze(self) -> FrozenPredictor:
+        return freeze_design(design=self.design, weights=self.model.coef_.T, intercept=self.model.intercept_)
 
-    previous_team_attributes_df = team_features_df.reset_index().set_index(['TeamID', 'Season', 'DayNum']) \
-        .groupby(by='TeamID').shift(1)
 
-    p_attributes_df = previous_team_attributes_df.drop(columns='OtherTeamID') \
-        .rename(columns=lambda c: 'p_' + c).reset_index()
-    po_team_attributes_df = previous_team_attributes_df.drop(columns='OtherTeamID') \
-        .rename(columns=lambda c: 'po_' + c).reset_index() \
-        .rename(columns={'TeamID': 'OtherTeamID'})
+class MLPTournamentPredictor(SklearnTournamentPredictor):
+    # Passes of partial_fit over the games of each season added by update_design.
+    update_epochs = 20
 
-    data_df = pd.merge(left=tf_df, right=p_attributes_df,
-                       left_on=['Season', 'DayNum', 'TeamID'], right_on=['Season', 'DayNum', 'TeamID'])
-    data_df = pd.merge(left=data_df, right=po_team_attributes_df,
-                       left_on=['Season', 'DayNum', 'OtherTeamID'], right_on=['Season', 'DayNum', 'OtherTeamID'])
+    def classifier(self):
+        return MLPClassifier(hidden_layer_sizes=(25, 25), max_iter=1000)
 
-    data_df.set_index(['Season', 'DayNum', 'TeamID', 'OtherTeamID'], inplace=True)
-    data_df.sort_index(inplace=True)
-    data_df.dropna(inplace=True)
+    def update_design(self, design: MatchupDesign, season: int):
+        self.design = design
+        x, y = design.training_rows(first_season=season, last_season=season)
+        for _ in range(self.update_epochs):
+            self.model.partial_fit(x, y)
 
-    return data_df.drop(columns='Win'), data_df.Win
+    def freeze(self) -> FrozenPredictor:
+        return freeze_design(design=self.design, weights=self.model.coefs_[0], intercept=self.model.intercepts_[0],
+                             layers=list(zip(self.model.coefs_[1:], self.model.intercepts_[1:])),
+                             activation=self.model.activation)
@@ -0,0 +1,75 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+tournament_game_index_labels = ['Season', 'TeamID', 'OtherTeamID']
+
+
+class ProbabilityMatrix():
+    """
+    The probability that each of a season's teams beats each other, for teams sorted by TeamID. Only the upper
+    triangle, P(TeamID beats OtherTeamID) for TeamID < OtherTeamID, is stored, condensed row by row into a float32
+    array. The lower triangle is its complement and the diagonal is NaN.
+    """
+
+    def __init__(self, season: int, team_ids: np.ndarray, upper: np.ndarray):
+        n = len(team_ids)
+        if len(upper) != n * (n - 1) // 2:
+            raise ValueError(f'{len(upper)} probabilities do not fill the upper triangle of {n} teams.')
+        self.season = season
+        self.team_ids = np.asarray(team_ids)
+        self.upper = np.asarray(upper, dtype=np.float32)
+
+    @classmethod
+    def from_series(cls, predictions: pd.Series) -> Dict[int, 'ProbabilityMatrix']:
+        """
+        Matrices by season from predictions indexed by tournament_game_index_labels, in either orientation.
+        Pairings without a prediction are NaN.
+        """
+        games_df = predictions.index.to_frame(index=False)
+        seasons = games_df.Season.to_numpy()
+        matrices = {}
+        for season in np.unique(seasons):
+            in_season = seasons == season
+            team_id = games_df.TeamID.to_numpy()[in_season]
+            other_team_id = games_df.OtherTeamID.to_numpy()[in_season]
+            team_ids = np.union1d(team_id, other_team_id)
+
+            i, j = np.searchsorted(team_ids, team_id), np.searchsorted(team_ids, other_team_id)
+            p = predictions.to_numpy()[in_season]
+            upper = np.full(len(team_ids) * (len(team_ids) - 1) // 2, np.nan, dtype=np.float32)
+            upper[_condensed_index(n=len(team_ids), i=np.minimum(i, j), j=np.maximum(i, j))] = np.where(i < j, p, 1 - p)
+            matrices[int(season)] = cls(season=int(season), team_ids=team_ids, upper=upper)
+        return matrices
+
+    def probability(self, team_id: np.ndarray, other_team_id: np.ndarray) -> np.ndarray:
+        i, j = np.searchsorted(self.team_ids, team_id), np.searchsorted(self.team_ids, other_team_id)
+        if not (np.array_equal(self.team_ids[np.minimum(i, len(self.team_ids) - 1)], team_id)
+                and np.array_equal(self.team_ids[np.minimum(j, len(self.team_ids) - 1)], other_team_id)):
+            raise KeyError(f'Teams without a row in the {self.season} matrix.')
+        p = self.upper[_condensed_index(n=len(self.team_ids), i=np.minimum(i, j), j=np.maximum(i, j))]
+        return np.where(i < j, p, np.where(i > j, 1 - p, np.nan))
+
+    def to_dense(self) -> np.ndarray:
+        n = len(self.team_ids)
+        dense = np.full((n, n), np.nan, dtype=np.float32)
+        i, j = np.triu_indices(n, k=1)
+        dense[i, j] = self.upper
+        dense[j, i] = 1 - self.upper
+        return dense
+
+    def to_series(self) -> pd.Series:
+        """
+        The upper triangle in long form, indexed by tournament_game_index_labels as estimate_probability returns.
+        """
+        i, j = np.triu_indices(len(self.team_ids), k=1)
+        index = pd.MultiIndex.from_arrays([np.full(len(i), self.season), self.team_ids[i], self.team_ids[j]],
+                                          names=tournament_game_index_labels)
+        return pd.Series(self.upper, index=index, name='Pred')
+
+
+def _condensed_index(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    # Row i of the upper triangle starts after the n - 1, n - 2, ... pairings of the rows before it.
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
@@ -0,0 +1,121 @@
+from typing import Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .prediction import TournamentPredictor
+from .probability_matrix import ProbabilityMatrix
+from ..data.access import DataAccess
+from ..data.bracket import Bracket, bracket
+
+# Points for a correct pick by round; play in games score nothing.
+default_round_points = (0, 1, 2, 4, 8, 16, 32)
+
+
+class BracketSimulation():
+    """
+    The outcome of simulating a bracket many times: how often each seed won each slot.
+    """
+
+    def __init__(self, bracket: Bracket, slot_win_counts: np.ndarray, n_simulations: int):
+        self.bracket = bracket
+        self.slot_win_counts = slot_win_counts
+        self.n_simulations = n_simulations
+
+    @property
+    def slot_win_probability(self) -> np.ndarray:
+        # Slots by seeds, in the bracket's order.
+        return self.slot_win_counts / self.n_simulations
+
+    def slot_win_probability_df(self) -> pd.DataFrame:
+        return pd.DataFrame(self.slot_win_probability, index=pd.Index(self.bracket.slots, name='Slot'),
+                            columns=pd.Index(self.bracket.team_ids, name='TeamID'))
+
+    def advancement_df(self) -> pd.DataFrame:
+        """
+        The probability that each team wins its game of each round, R0 being the play in round. Teams without
+        a play in game advance through R0.
+        """
+        rounds = np.unique(self.bracket.rounds)
+        advancement = np.array([self.slot_win_probability[self.bracket.rounds == r].sum(axis=0) for r in rounds]).T
+        if 0 in rounds:
+            play_in = self.bracket.rounds == 0
+            in_play_in = np.isin(np.arange(self.bracket.n_seeds),
+                                 np.r_[self.bracket.strong[play_in], self.bracket.weak[play_in]])
+            advancement[~in_play_in, 0] = 1
+
+        advancement_df = pd.DataFrame(advancement, columns=[f'R{r}' for r in rounds],
+                                      index=pd.Index(self.bracket.team_ids, name='TeamID'))
+        advancement_df.insert(0, 'Seed', self.bracket.seeds)
+        return advancement_df.sort_values(advancement_df.columns[-1], ascending=False)
+
+    def picks(self) -> pd.Series:
+        """
+        A consistent bracket, picking in each slot whichever of the two teams picked to reach it wins it more often.
+        """
+        picked = np.arange(self.bracket.n_seeds + len(self.bracket.slots))
+        for level in self.bracket.levels():
+            strong, weak = picked[self.bracket.strong[level]], picked[self.bracket.weak[level]]
+            strong_wins = self.slot_win_probability[level, strong] >= self.slot_win_probability[level, weak]
+            picked[self.bracket.n_seeds + level] = np.where(strong_wins, strong, weak)
+        return pd.Series(self.bracket.team_ids[picked[self.bracket.n_seeds:]],
+                         index=pd.Index(self.bracket.slots, name='Slot'), name='TeamID')
+
+    def expected_score(self, picks: Optional[Mapping[str, int]] = None,
+                       round_points: Sequence[int] = default_round_points) -> float:
+        """
+        The expected score of a bracket, given as the TeamID picked for each slot (self.picks() by default).
+        """
+        picks = self.picks() if picks is None else pd.Series(picks)
+        slot_of_pick = pd.Series(np.arange(len(self.bracket.slots)), index=self.bracket.slots)[picks.index].to_numpy()
+        seed_of_pick = pd.Series(np.arange(self.bracket.n_seeds), index=self.bracket.team_ids)[picks].to_numpy()
+        win_probability = self.slot_win_probability[slot_of_pick, seed_of_pick]
+        return float(np.sum(np.asarray(round_points)[self.bracket.rounds[slot_of_pick]] * win_probability))
+
+
+def simulate(bracket: Bracket, matrix: ProbabilityMatrix, n_simulations: int = 1_000_000,
+             batch_size: int = 100_000, seed: Optional[int] = None) -> BracketSimulation:
+    """
+    Plays the bracket n_simulations times with the matrix's win probabilities, one vectorized step per level
+    of slots over a batch of simulations at a time.
+    """
+    n_seeds, n_slots = bracket.n_seeds, len(bracket.slots)
+    positions = np.searchsorted(matrix.team_ids, bracket.team_ids)
+    if not np.array_equal(matrix.team_ids[np.minimum(positions, len(matrix.team_ids) - 1)], bracket.team_ids):
+        raise ValueError(f'The {matrix.season} probability matrix does not cover every team of the bracket.')
+    win_probability = matrix.to_dense()[np.ix_(positions, positions)].ravel()
+    if np.isnan(np.delete(win_probability, np.arange(n_seeds) * (n_seeds + 1))).any():
+        raise ValueError(f'The {matrix.season} probability matrix is missing pairings of the bracket.')
+
+    rng = np.random.default_rng(seed)
+    levels = bracket.levels()
+    slot_offsets = np.arange(n_slots) * n_seeds
+    slot_win_counts = np.zeros(n_slots * n_seeds, dtype=np.int64)
+
+    for start in range(0, n_simulations, batch_size):
+        size = min(batch_size, n_simulations - start)
+        # The seed holding each node of the bracket, one column per simulation, so a level reads and writes rows.
+        winners = np.empty((n_seeds + n_slots, size), dtype=np.int16)
+        winners[:n_seeds] = np.arange(n_seeds)[:, np.newaxis]
+        for level in levels:
+            strong, weak = winners[bracket.strong[level]], winners[bracket.weak[level]]
+            strong_win_probability = win_probability[strong.astype(np.int32) * n_seeds + weak]
+            winners[n_seeds + level] = np.where(rng.random(strong.shape, dtype=np.float32) < strong_win_probability,
+                                                strong, weak)
+        slot_win_counts += np.bincount((winners[n_seeds:] + slot_offsets[:, np.newaxis]).ravel(),
+                                       minlength=n_slots * n_seeds)
+
+    return BracketSimulation(bracket=bracket, slot_win_counts=slot_win_counts.reshape(n_slots, n_seeds),
+                             n_simulations=n_simulations)
+
+
+def simulate_tournament(predictor: TournamentPredictor, access: DataAccess, season: int,
+                        n_simulations: int = 1_000_000, batch_size: int = 100_000,
+                        seed: Optional[int] = None) -> BracketSimulation:
+    """
+    Simulates a season's tournament with the win probabilities of a trained predictor.
+    """
+    season_bracket = bracket(access=access, season=season)
+    matrix = predictor.estimate_probability_matrices(teams_df=season_bracket.teams_df())[season]
+    return simulate(bracket=season_bracket, matrix=matrix, n_simulations=n_simulations, batch_size=batch_size,
+                    seed=seed)
@@ -1,13 +1,12 @@
 from ncaa_predict.data.access import mens_access, womens_access
-from ncaa_predict.features import pf
-import pandas as pd
+from ncaa_predict.data.store import lineup_feature_store, player_feature_store
+from ncaa_predict.features import lf, pf
 
 
 def main():
     for access in (mens_access, womens_access):
-        player_features_df = pd.concat(pf.run(access=access).values(), axis=1)
-        player_features_df = player_features_df.fillna(0).astype(int)
-        player_features_df.to_pickle(f'{access.prefix}PlayerFeatures.pkl')
+        player_feature_store.persist(features=pf, access=access)
+        lineup_feature_store.persist(features=lf, access=access)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from ncaa_predict.data.access import mens_access, womens_access
+from ncaa_predict.models.design import matchup_design
+from ncaa_predict.models.frozen import FrozenPredictor
+from ncaa_predict.models.prediction import EloTournamentPredictor, LRTournamentPredictor, MLPTournamentPredictor
+
+default_address = ('127.0.0.1', int(os.environ.get('NCAA_PREDICT_SERVE_PORT', 8000)))
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    GET /predict?prefix=M&model=EloTournamentPredictor&season=2019&team=1181&other_team=1438 answers one matchup.
+    POST /predict with {"prefix": ..., "model": ..., "games": [[season, team, other_team], ...]} answers a batch.
+    GET /models lists the frozen models by prefix.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/models':
+            return self._respond(200, {prefix: sorted(models) for prefix, models in self._models().items()})
+        if url.path != '/predict':
+            return self._respond(404, {'error': f'Unknown path {url.path}.'})
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            predictor = self._predictor(prefix=query['prefix'], model=query['model'])
+            season, team, other_team = int(query['season']), int(query['team']), int(query['other_team'])
+            pred = predictor.probability_of(season=season, team_id=team, other_team_id=other_team)
+        except (KeyError, ValueError) as e:
+            return self._respond(400, {'error': _message(e)})
+        self._respond(200, {'Season': season, 'TeamID': team, 'OtherTeamID': other_team, 'Pred': pred})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/predict':
+            return self._respond(404, {'error': f'Unknown path {self.path}.'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            predictor = self._predictor(prefix=request['prefix'], model=request['model'])
+            games = np.asarray(request['games'], dtype=np.int64).reshape(-1, 3)
+            pred = predictor.probability(season=games[:, 0], team_id=games[:, 1], other_team_id=games[:, 2])
+        except (KeyError, ValueError, TypeError) as e:
+            return self._respond(400, {'error': _message(e)})
+        self._respond(200, {'Pred': pred.tolist()})
+
+    def _models(self) -> Dict[str, Dict[str, FrozenPredictor]]:
+        return self.server.models
+
+    def _predictor(self, prefix: str, model: str) -> FrozenPredictor:
+        try:
+            return self._models()[prefix][model]
+        except KeyError:
+            raise KeyError(f'No frozen model {model} for prefix {prefix}.')
+
+    def _respond(self, status: int, body: Dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _message(e: Exception) -> str:
+    # str() of a KeyError quotes its message.
+    return str(e.args[0]) if e.args else type(e).__name__
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, models: Dict[str, Dict[str, FrozenPredictor]], address: Tuple[str, int] = default_address):
+        super().__init__(address, PredictionHandler)
+        self.models = models
+
+
+def frozen_models() -> Dict[str, Dict[str, FrozenPredictor]]:
+    models = {}
+    for access in (mens_access, womens_access):
+        design = matchup_design(prefix=access.prefix)
+        models[access.prefix] = {}
+        for pred in (EloTournamentPredictor(), LRTournamentPredictor(), MLPTournamentPredictor()):
+            pred.train_design(design=design)
+            models[access.prefix][type(pred).__name__] = pred.freeze()
+    return models
+
+
+def benchmark(server: PredictionServer, n_queries: int = 10_000) -> Dict[str, Dict[str, float]]:
+    """
+    Latency percentiles in microseconds of single matchup queries to every model, made in process and over
+    one keep alive HTTP connection.
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.connect()
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    for prefix, models in server.models.items():
+        for model, predictor in models.items():
+            # Pairs of teams of the same season; the frozen rows are sorted by season.
+            team = rng.integers(0, len(predictor.keys), size=n_queries)
+            seasons = predictor.seasons[team]
+            first = np.searchsorted(predictor.seasons, seasons, side='left')
+            last = np.searchsorted(predictor.seasons, seasons, side='right')
+            other_team = first + (rng.random(n_queries) * (last - first)).astype(np.int64)
+            team_ids, other_team_ids = predictor.team_ids[team], predictor.team_ids[other_team]
+
+            in_process, over_http = np.empty(n_queries), np.empty(n_queries)
+            for q in range(n_queries):
+                start = time.perf_counter()
+                predictor.probability_of(season=int(seasons[q]), team_id=int(team_ids[q]),
+                                         other_team_id=int(other_team_ids[q]))
+                in_process[q] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                connection.request('GET', f'/predict?prefix={prefix}&model={model}&season={seasons[q]}'
+                                          f'&team={team_ids[q]}&other_team={other_team_ids[q]}')
+                connection.getresponse().read()
+                over_http[q] = time.perf_counter() - start
+
+            for mode, latencies in (('in_process', in_process), ('http', over_http)):
+                p50, p99 = np.percentile(latencies * 1e6, [50, 99])
+                results[f'{prefix} {model} {mode}'] = {'p50_us': p50, 'p99_us': p99}
+
+    connection.close()
+    return results
+
+
+def main():
+    server = PredictionServer(models=frozen_models())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for name, latency in benchmark(server=server).items():
+        print(f'{name} p50: {latency["p50_us"]:.1f}us p99: {latency["p99_us"]:.1f}us')
+
+    print(f'Serving on http://{server.server_address[0]}:{server.server_address[1]}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,11 @@
 from ncaa_predict.data.access import mens_access, womens_access
+from ncaa_predict.data.store import team_feature_store
 from ncaa_predict.features import tf
-import pandas as pd
 
 
 def main():
     for access in (womens_access, mens_access):
-        team_features_df = pd.concat(tf.run(access=access).values(), axis=1)
-        team_features_df.to_pickle(f'{access.prefix}TeamFeatures.pkl')
+        team_feature_store.persist(features=tf, access=access)
 
 
 if __name__ == '__main__':
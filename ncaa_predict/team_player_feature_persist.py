@@ -1,12 +1,12 @@
 from ncaa_predict.data.access import mens_access, womens_access
+from ncaa_predict.data.store import lineup_feature_store, player_feature_store, team_player_feature_store
 from ncaa_predict.features import tpf
-import pandas as pd
 
 
 def main():
     for access in (womens_access, mens_access):
-        team_player_features_df = pd.concat(tpf.run(access=access).values(), axis=1)
-        team_player_features_df.to_pickle(f'{access.prefix}TeamPlayerFeatures.pkl')
+        team_player_feature_store.persist(features=tpf, access=access,
+                                          upstream=(player_feature_store, lineup_feature_store))
 
 
 if __name__ == '__main__':
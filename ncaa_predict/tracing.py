@@ -0,0 +1,255 @@
+import atexit
+import functools
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+T = TypeVar('T')
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+_maxrss_unit = 1 if sys.platform == 'darwin' else 1024
+
+
+class Span():
+    """
+    One timed region of one thread: wall and thread CPU seconds, and how far it raised the process's peak RSS.
+    While a sampling profiler runs, samples holds the counts of the call stacks seen inside it.
+    """
+    __slots__ = ('tracer', 'name', 'category', 'args', 'thread_id', 'start', 'wall_seconds', 'cpu_seconds',
+                 'peak_rss_delta', 'samples', '_cpu_start', '_maxrss_start')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: Dict[str, Any]):
+        self.tracer, self.name, self.category, self.args = tracer, name, category, args
+        self.wall_seconds, self.cpu_seconds, self.peak_rss_delta = None, None, None
+        self.samples = None  # type: Optional[Counter]
+
+    def __enter__(self) -> 'Span':
+        self.thread_id = threading.get_ident()
+        self.tracer._open.setdefault(self.thread_id, []).append(self)
+        self._maxrss_start = _maxrss()
+        self._cpu_start = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_seconds = time.perf_counter() - self.start
+        self.cpu_seconds = time.thread_time() - self._cpu_start
+        self.peak_rss_delta = _maxrss() - self._maxrss_start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._open[self.thread_id].pop()
+        self.tracer._record(self)
+
+
+class _NullSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class Tracer():
+    """
+    Collects spans around data reads, cached function calls, features and model fits once enabled, which it is
+    when NCAA_PREDICT_TRACE names a Chrome trace file to write at exit or NCAA_PREDICT_PROFILE names a directory
+    to write sampled call stacks of the NCAA_PREDICT_PROFILE_SPANS slowest spans to, as folded stacks for flame
+    graphs. Disabled, a span costs a flag check. Spans of worker processes are not collected.
+    """
+
+    def __init__(self, trace_file: Optional[str] = None, profile_dir: Optional[str] = None,
+                 profile_spans: int = 10, profile_interval: float = .005, max_spans: int = 1_000_000):
+        # Resolved now, as the working directory may have changed by exit.
+        self.trace_file = None if trace_file is None else os.path.abspath(trace_file)
+        self.profile_dir = None if profile_dir is None else os.path.abspath(profile_dir)
+        self.profile_spans = profile_spans
+        self.profile_interval = profile_interval
+        self.max_spans = max_spans
+        self.enabled = trace_file is not None or profile_dir is not None
+        self.spans = []  # type: List[Span]
+        self.dropped_spans = 0
+        self._open = {}  # type: Dict[int, List[Span]]
+        self._origin = time.perf_counter()
+        self._sampler = None  # type: Optional[threading.Thread]
+
+    def span(self, name: str, category: str, **args):
+        if not self.enabled:
+            return _null_span
+        if self.profile_dir is not None and self._sampler is None:
+            self._start_sampler()
+        return Span(tracer=self, name=name, category=category, args=args)
+
+    def annotate(self, **args):
+        """
+        Adds arguments to the innermost open span of the calling thread.
+        """
+        if self.enabled:
+            spans = self._open.get(threading.get_ident())
+            if spans:
+                spans[-1].args.update(args)
+
+    def iterate(self, iterable: Iterable[T], name: str, category: str, **args) -> Iterator[T]:
+        """
+        Yields the items of iterable, with a span around producing each one rather than around consuming it.
+        """
+        iterator = iter(iterable)
+        for index in itertools.count():
+            with self.span(name, category, index=index, **args):
+                item = next(iterator, _exhausted)
+            if item is _exhausted:
+                return
+            yield item
+
+    def _record(self, span: Span):
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    def spans_df(self) -> pd.DataFrame:
+        """
+        One row per span, with its arguments as arg_<name> columns.
+        """
+        records = [{'Name': s.name, 'Category': s.category, 'ThreadID': s.thread_id, 'Start': s.start - self._origin,
+                    'WallSeconds': s.wall_seconds, 'CPUSeconds': s.cpu_seconds, 'PeakRSSDelta': s.peak_rss_delta,
+                    **{f'arg_{name}': value for name, value in s.args.items()}} for s in self.spans]
+        arg_columns = sorted({column for record in records for column in record} - set(_span_columns))
+        return pd.DataFrame(records, columns=[*_span_columns, *arg_columns])
+
+    def summary_df(self) -> pd.DataFrame:
+        """
+        Calls, wall and CPU seconds and peak RSS growth per span name, most wall time first. Nested spans are
+        counted in their own rows and in every span around them.
+        """
+        spans_df = self.spans_df()
+        return spans_df.groupby(['Category', 'Name']) \
+            .agg(Calls=('WallSeconds', 'size'), WallSeconds=('WallSeconds', 'sum'),
+                 CPUSeconds=('CPUSeconds', 'sum'), MaxWallSeconds=('WallSeconds', 'max'),
+                 PeakRSSDelta=('PeakRSSDelta', 'sum')) \
+            .sort_values('WallSeconds', ascending=False)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """
+        The spans as complete events of the Chrome trace event format, for chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        thread_ids = sorted({s.thread_id for s in self.spans})
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                   'args': {'name': 'main' if thread_id == threading.main_thread().ident else f'thread {n}'}}
+                  for n, thread_id in enumerate(thread_ids)]
+        events += [{'name': s.name, 'cat': s.category, 'ph': 'X', 'pid': pid, 'tid': s.thread_id,
+                    'ts': (s.start - self._origin) * 1e6, 'dur': s.wall_seconds * 1e6,
+                    'args': {'cpu_ms': s.cpu_seconds * 1e3, 'peak_rss_delta': s.peak_rss_delta,
+                             **{name: _jsonable(value) for name, value in s.args.items()}}}
+                   for s in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'dropped_spans': self.dropped_spans}}
+
+    def write_chrome_trace(self, trace_file: str):
+        with open(f'{trace_file}.partial', 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(f'{trace_file}.partial', trace_file)
+
+    def write_profiles(self, profile_dir: str) -> List[str]:
+        """
+        Writes the sampled stacks of the slowest profile_spans spans, one folded stack file each, slowest first.
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        sampled = sorted((s for s in self.spans if s.samples), key=lambda s: s.wall_seconds, reverse=True)
+        profile_files = []
+        for rank, s in enumerate(sampled[:self.profile_spans]):
+            profile_file = os.path.join(profile_dir, f'{rank:02d}-{re.sub(r"[^A-Za-z0-9_.-]+", "_", s.name)}.folded')
+            with open(profile_file, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in s.samples.most_common())
+            profile_files.append(profile_file)
+        return profile_files
+
+    def close(self):
+        if self.profile_dir is not None:
+            self.write_profiles(profile_dir=self.profile_dir)
+        if self.trace_file is not None:
+            self.write_chrome_trace(trace_file=self.trace_file)
+
+    def _start_sampler(self):
+        self._sampler = threading.Thread(target=self._sample, name='ncaa_predict-sampler', daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        # Each sample of a thread is counted in every span it has open.
+        sampler_thread_id = threading.get_ident()
+        while True:
+            time.sleep(self.profile_interval)
+            frames = sys._current_frames()
+            for thread_id, spans in list(self._open.items()):
+                frame = frames.get(thread_id)
+                if not spans or frame is None or thread_id == sampler_thread_id:
+                    continue
+                stack = ';'.join(reversed(_frame_names(frame)))
+                for s in list(spans):
+                    if s.samples is None:
+                        s.samples = Counter()
+                    s.samples[stack] += 1
+
+
+_exhausted = object()
+_span_columns = ['Name', 'Category', 'ThreadID', 'Start', 'WallSeconds', 'CPUSeconds', 'PeakRSSDelta']
+
+
+def _frame_names(frame) -> List[str]:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return names
+
+
+def _maxrss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _maxrss_unit if resource is not None else 0
+
+
+def _jsonable(value: Any) -> Any:
+    return value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+
+
+tracer = Tracer(trace_file=os.environ.get('NCAA_PREDICT_TRACE'),
+                profile_dir=os.environ.get('NCAA_PREDICT_PROFILE'),
+                profile_spans=int(os.environ.get('NCAA_PREDICT_PROFILE_SPANS', 10)))
+atexit.register(tracer.close)
+
+
+def traced(category: str, name: Optional[str] = None):
+    """
+    Runs the decorated function in a span of the given category, named by its qualified name by default.
+    """
+
+    def decorator(f: Callable) -> Callable:
+        span_name = f.__qualname__ if name is None else name
+
+        @functools.wraps(f)
+        def helper(*args, **kwargs):
+            if not tracer.enabled:
+                return f(*args, **kwargs)
+            with tracer.span(span_name, category):
+                return f(*args, **kwargs)
+
+        return helper
+
+    return decorator
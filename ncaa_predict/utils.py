@@ -1,10 +1,278 @@
+import atexit
+import functools
+import hashlib
+import inspect
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .tracing import tracer
+
+CacheKey = Tuple[str, Tuple[Tuple[str, type, Hashable], ...]]
+
+
+class _CacheEntry(NamedTuple):
+    value: Any
+    size: int
+
+
+class Cache():
+    """
+    A least recently used cache of function results bounded by an estimate of their memory footprint, with
+    DataFrames and Series measured by memory_usage(deep=True). Evicted results are optionally pickled to
+    spill_dir and reloaded on their next use. Each key is computed by one caller at a time, which the others
+    wait on.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()  # type: OrderedDict[CacheKey, _CacheEntry]
+        self._spilled = {}  # type: Dict[CacheKey, str]
+        # The future of each key being computed, and the thread computing it.
+        self._in_flight = {}  # type: Dict[CacheKey, Tuple[Future, int]]
+        self._bytes = 0
+        self._stats = defaultdict(lambda: defaultdict(int))  # type: Dict[str, Dict[str, int]]
+        self._lock = threading.RLock()
+
+    def get(self, key: CacheKey, compute: Callable[[], Any]) -> Any:
+        name = key[0]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats[name]['hits'] += 1
+                tracer.annotate(cache='hit')
+                return self._entries[key].value
+            # Concurrent misses of one key compute it once: later callers wait on the first caller's future.
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                future = Future()
+                self._in_flight[key] = (future, threading.get_ident())
+                spill_file = self._spilled.pop(key, None)
+            elif in_flight[1] == threading.get_ident():
+                # Waiting on its own future would block the thread forever.
+                raise RecursionError(f'{name} needs its own result to compute it, for the same arguments.')
+            else:
+                self._stats[name]['waits'] += 1
+
+        if in_flight is not None:
+            tracer.annotate(cache='wait')
+            return in_flight[0].result()
+
+        try:
+            if spill_file is not None:
+                with open(spill_file, 'rb') as f:
+                    value = pickle.load(f)
+                os.remove(spill_file)
+                with self._lock:
+                    self._stats[name]['spill_hits'] += 1
+                tracer.annotate(cache='spill_hit')
+            else:
+                with self._lock:
+                    self._stats[name]['misses'] += 1
+                tracer.annotate(cache='miss')
+                value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        self._put(key=key, value=value)
+        future.set_result(value)
+        return value
+
+    def _put(self, key: CacheKey, value: Any):
+        size = _size_of(value)
+        evicted_entries = []
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).size
+            self._entries[key] = _CacheEntry(value=value, size=size)
+            self._bytes += size
+            self._in_flight.pop(key, None)
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats[evicted_key[0]]['evictions'] += 1
+                evicted_entries.append((evicted_key, evicted.value))
+        # Evicted values are pickled without holding the lock, so spilling never blocks other lookups.
+        for evicted_key, evicted_value in evicted_entries:
+            self._spill(key=evicted_key, value=evicted_value)
+
+    def _spill(self, key: CacheKey, value: Any):
+        if self.spill_dir is None:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        key_hash = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+        fd, spill_file = tempfile.mkstemp(dir=self.spill_dir, prefix=f'{os.getpid()}-{key_hash}-', suffix='.pkl')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            os.remove(spill_file)
+            return
+        with self._lock:
+            # The key may have been computed again while it was being pickled; then the copy in memory wins.
+            if key in self._entries or key in self._in_flight or key in self._spilled:
+                os.remove(spill_file)
+                return
+            self._spilled[key] = spill_file
+            self._stats[key[0]]['spills'] += 1
+
+    def invalidate(self, *values: Hashable):
+        """
+        Drops every cached result computed with any of the given values as an argument, or every result if none
+        are given. Arguments are compared by identity as well as equality, so a DataAccess drops its own entries.
+        """
+        with self._lock:
+            for key in [key for key in [*self._entries.keys(), *self._spilled.keys()]
+                        if not values or any(_matches(argument, value)
+                                             for _, _, argument in key[1] for value in values)]:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key).size
+                spill_file = self._spilled.pop(key, None)
+                if spill_file is not None and os.path.exists(spill_file):
+                    os.remove(spill_file)
+
+    def stats_df(self) -> pd.DataFrame:
+        """
+        Hits, misses, waits on a concurrent miss, evictions and spills per cached function, with the entries and
+        bytes currently held.
+        """
+        with self._lock:
+            held = defaultdict(lambda: defaultdict(int))
+            for key, entry in self._entries.items():
+                held[key[0]]['entries'] += 1
+                held[key[0]]['bytes'] += entry.size
+            for key in self._spilled:
+                held[key[0]]['spilled_entries'] += 1
+            names = sorted({*self._stats.keys(), *held.keys()})
+            columns = ['hits', 'misses', 'waits', 'spill_hits', 'evictions', 'spills', 'entries', 'spilled_entries',
+                       'bytes']
+            return pd.DataFrame([[{**self._stats[name], **held[name]}.get(column, 0) for column in columns]
+                                 for name in names],
+                                index=pd.Index(names, name='Function'), columns=columns)
+
+
+def _matches(argument: Hashable, value: Hashable) -> bool:
+    if argument is value:
+        return True
+    try:
+        return type(argument) is type(value) and bool(argument == value)
+    except (TypeError, ValueError):
+        return False
+
+
+def _size_of(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_size_of(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size_of(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+cache = Cache(max_bytes=int(os.environ.get('NCAA_PREDICT_CACHE_MAX_BYTES', 4 * 2 ** 30)),
+              spill_dir=os.environ.get('NCAA_PREDICT_CACHE_SPILL_DIR'))
+atexit.register(cache.invalidate)
+
+
+# Process pools started from a thread, such as a feature on the Features.run pool, start their workers from a
+# fork server: a plain fork could copy a lock held by another thread, the cache's among them, into the worker.
+pool_context = multiprocessing.get_context('forkserver')
+
+
 def memoize(f):
-    memo = {}
+    signature = inspect.signature(f)
+    name = f'{f.__module__}.{f.__qualname__}'
 
+    @functools.wraps(f)
     def helper(*args, **kwargs):
-        x = frozenset((*args, *(kwargs.items())))
-        if x not in memo:
-            memo[x] = f(*args, **kwargs)
-        return memo[x]
+        # Arguments are keyed in signature order along with their types, whether passed positionally or by name.
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        x = (name, tuple((argument_name, type(value), _hashable(value))
+                         for argument_name, value in bound.arguments.items()))
+        try:
+            hash(x)
+        except TypeError:
+            raise TypeError(f'{name} is memoized, so its arguments must be hashable, or lists or sets of hashable '
+                            f'values: {bound.arguments}') from None
+        if not tracer.enabled:
+            return cache.get(key=x, compute=lambda: f(*args, **kwargs))
+        with tracer.span(name, 'cache'):
+            return cache.get(key=x, compute=lambda: f(*args, **kwargs))
 
     return helper
+
+
+def _hashable(value: Any) -> Hashable:
+    # Lists and sets key by their contents, in order for lists, while the function still gets the original.
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(v) for v in value)
+    return value
+
+
+class SharedArray(NamedTuple):
+    name: str
+    dtype: str
+    length: int
+
+
+class SharedFrame(NamedTuple):
+    """
+    Where the index levels and columns of a numeric DataFrame live in shared memory, small enough to pickle.
+    """
+    index_names: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    arrays: Tuple[SharedArray, ...]
+
+
+def share_frame(df: pd.DataFrame) -> Tuple[SharedFrame, List[shared_memory.SharedMemory]]:
+    """
+    Copies each index level and column of df into its own shared memory block. The caller owns the blocks and
+    closes and unlinks them once every reader is done.
+    """
+    index_df = df.index.to_frame(index=False)
+    blocks, arrays = [], []
+    for values in [*(index_df[name].to_numpy() for name in index_df.columns),
+                   *(df[column].to_numpy() for column in df.columns)]:
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+        blocks.append(block)
+        arrays.append(SharedArray(name=block.name, dtype=values.dtype.str, length=len(values)))
+    return SharedFrame(index_names=tuple(index_df.columns), columns=tuple(df.columns), arrays=tuple(arrays)), blocks
+
+
+def attach_frame(shared: SharedFrame) -> pd.DataFrame:
+    """
+    Rebuilds a DataFrame shared by share_frame, copying it out of shared memory into this process.
+    """
+    values = []
+    for array in shared.arrays:
+        # Pool workers share their parent's resource tracker, so attaching does not take ownership of the block.
+        block = shared_memory.SharedMemory(name=array.name)
+        values.append(np.ndarray(array.length, dtype=np.dtype(array.dtype), buffer=block.buf).copy())
+        block.close()
+    n_index = len(shared.index_names)
+    index = pd.MultiIndex.from_arrays(values[:n_index], names=shared.index_names) if n_index > 1 \
+        else pd.Index(values[0], name=shared.index_names[0])
+    return pd.DataFrame(dict(zip(shared.columns, values[n_index:])), index=index, columns=list(shared.columns))